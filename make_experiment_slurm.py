@@ -5,20 +5,25 @@ import argparse
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from bpstools import pipeline, resources
+
+ENV_SETUP = """module load python/3.10.9-fasrc01 gcc/10.2.0-fasrc01 
+
+eval "$(conda shell.bash hook)"
+conda activate {conda_env}"""
+
 INFER_LOADINGS_TEMPLATE = """#!/bin/bash
 
 #SBATCH -c 4
 #SBATCH --job-name {jobname} 
-#SBATCH -t 0-02:00 
+#SBATCH -t {walltime} 
 #SBATCH -p {queue}
-#SBATCH --mem=64G 
+#SBATCH --mem={mem}G 
 #SBATCH -o {log_dir}/output_%j_%x.out 
 #SBATCH -e {log_dir}/error_%j_%x.err 
 
-module load python/3.10.9-fasrc01 gcc/10.2.0-fasrc01 
-
-eval "$(conda shell.bash hook)"
-conda activate {conda_env}
+{env_setup}
 
 DATA={data}
 FILTER="{filter}"
@@ -44,10 +49,7 @@ GENERATE_SYNTHETIC_TEMPLATE = """#!/bin/bash
 #SBATCH -o {log_dir}/output_%j_%x.out 
 #SBATCH -e {log_dir}/error_%j_%x.err 
 
-module load python/3.10.9-fasrc01 gcc/10.2.0-fasrc01 
-
-eval "$(conda shell.bash hook)"
-conda activate {conda_env}
+{env_setup}
 
 NEW_PREFIX={new_prefix}
 SIGS_FILE="{sigs_file}"
@@ -69,16 +71,24 @@ python scripts/generate-synthetic-data.py $NEW_PREFIX $SIGS_FILE --signatures-pr
 INFER_LOADINGS_AND_SIGS_TEMPLATE = """#!/bin/bash
 
 #SBATCH --job-name {jobname} 
-#SBATCH -t 7-00:00 
+#SBATCH -t {walltime} 
 #SBATCH -p {queue}
-#SBATCH --mem=32G 
+#SBATCH --mem={mem}G 
+#SBATCH -c {threads}
 #SBATCH -o {log_dir}/output_%A_%a_%x.out 
 #SBATCH -e {log_dir}/error_%A_%a_%x.err  
 
-module load python/3.10.9-fasrc01 gcc/10.2.0-fasrc01 
+{env_setup}
 
-eval "$(conda shell.bash hook)"
-conda activate {conda_env}
+# one row of a parameter table (submit-nmf-jobs.py --table): the array task
+# id picks the line after the header, giving the zeta, data file, seed,
+# whether to resume from a checkpoint and init
+if [ "$1" = "--table" ]; then
+    IFS=$'\\t' read -r ROW_ZETA ROW_DATA ROW_SEED ROW_RESUME ROW_INIT < <(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" "$2")
+    set -- "$ROW_ZETA" "$ROW_DATA" "$ROW_INIT"
+    SLURM_ARRAY_TASK_ID=$ROW_SEED
+    RESUME=$ROW_RESUME
+fi
 
 ZETA=$1
 DATA="{exp_name}/synthetic_data/${{2}}"
@@ -92,6 +102,15 @@ THIN={thin}
 RESULTS_DIR={exp_name}/results
 SEED=$SLURM_ARRAY_TASK_ID
 OPTS="{opts}"
+# optional warm start; the submitter passes @SEED@ in place of the seed
+INIT="${{3//@SEED@/$SEED}}"
+if [ -n "$INIT" ]; then
+    OPTS="$OPTS --init-from $INIT{warm_burnin}"
+fi
+# set by submit-nmf-jobs.py for runs that left a checkpoint
+if [ "$RESUME" = "1" ]; then
+    OPTS="$OPTS --resume"
+fi
 
 
 cd {BPS_dir}
@@ -102,16 +121,13 @@ python scripts/infer-mutsigs.py $DATA $RESULTS_DIR -m $MODEL -s $SAMPLES -b $BUR
 INFER_LOADINGS_AND_SIGS_LOOP_TEMPLATE = """#!/bin/bash
 
 #SBATCH --job-name {jobname} 
-#SBATCH -t 0-00:15 
+#SBATCH -t {loop_walltime} 
 #SBATCH -p {queue}
 #SBATCH --mem=8G 
 #SBATCH -o {log_dir}/output_%j_NMF_synthetic_{exp_name}.out 
 #SBATCH -e {log_dir}/error_%j_NMF_synthetic_{exp_name}.err 
 
-module load python/3.10.9-fasrc01 gcc/10.2.0-fasrc01 
-
-eval "$(conda shell.bash hook)"
-conda activate {conda_env}
+{env_setup}
 
 ZETAS="{zetas}"
 PREFIX={synthetic_prefix}
@@ -122,8 +138,8 @@ SEEDS="{seeds}"
 
 
 cd {BPS_dir}
-echo "python scripts/submit-nmf-jobs.py $PREFIX $EXP_DIR $TEMPLATE --seeds $SEEDS --zetas $ZETAS --exp-list $EXPS --slurm"
-python scripts/submit-nmf-jobs.py $PREFIX $EXP_DIR $TEMPLATE --seeds $SEEDS --zetas $ZETAS --exp-list $EXPS --slurm
+echo "python scripts/{driver} $PREFIX $EXP_DIR $TEMPLATE --seeds $SEEDS --zetas $ZETAS --exp-list $EXPS{backend_opts}{submit_opts}"
+python scripts/{driver} $PREFIX $EXP_DIR $TEMPLATE --seeds $SEEDS --zetas $ZETAS --exp-list $EXPS{backend_opts}{submit_opts}
 """
 
 
@@ -136,34 +152,35 @@ MAKE_PLOTS_LOOP_TEMPLATE = """#!/bin/bash
 #SBATCH -o {log_dir}/output_%j_%x.out 
 #SBATCH -e {log_dir}/error_%j_%x.err 
 
-module load python/3.10.9-fasrc01 gcc/10.2.0-fasrc01 
-
-eval "$(conda shell.bash hook)"
-conda activate {conda_env}
+{env_setup}
 
 ZETA={final_zeta}
 
 cd {BPS_dir}
 for EXP in {exp_list}
 do
-    echo "sbatch --job-name=generate_plots_{exp_name}_${{EXP}} {exp_name}/experiment_scripts/run_viz_{stage}.sh $EXP $ZETA"
-    sbatch --job-name=generate_plots_{exp_name}_${{EXP}} {exp_name}/experiment_scripts/run_viz_{stage}.sh $EXP $ZETA
+    echo "{submit} {exp_name}/experiment_scripts/run_viz_{stage}.sh $EXP $ZETA"
+    {submit} {exp_name}/experiment_scripts/run_viz_{stage}.sh $EXP $ZETA
 done
 """
 
 
+# Stage IIIb plots the zetas search-zetas.py ran (adaptive_zetas)
+ZETA_FILE = """
+if [ -f $EXP_DIR/zetas/$EXP.txt ]; then
+    ZETAS=$(cat $EXP_DIR/zetas/$EXP.txt)
+fi"""
+
+
 MAKE_PLOTS_TEMPLATE = """#!/bin/bash
 
-#SBATCH -t 0-06:00 
+#SBATCH -t {walltime} 
 #SBATCH -p {queue}
-#SBATCH --mem=32G 
+#SBATCH --mem={mem}G 
 #SBATCH -o {log_dir}/output_%j_%x.out 
 #SBATCH -e {log_dir}/error_%j_%x.err 
 
-module load python/3.10.9-fasrc01 gcc/10.2.0-fasrc01 
-
-eval "$(conda shell.bash hook)"
-conda activate {conda_env}
+{env_setup}
 
 EXP=$1
 SYNTHETIC_PREFIX="{synthetic_prefix}"
@@ -171,7 +188,7 @@ PREFIX={model}-burnin-{B}-samps-{S}-K-{K}
 MID=a-{a:.2f}-J0-{J0:.1f}
 EXP_DIR={exp_dir}
 SEEDS="{seeds}"
-ZETAS="{zetas}"
+ZETAS="{zetas}"{zeta_file}
 SKIP={skip}
 SAVE_DIR=figures/
 RESULTS_DIR=results/
@@ -199,7 +216,7 @@ PLOT_COMPARISON_TEMPLATE = """#!/bin/bash
 #SBATCH -o {log_dir}/output_%j_%x.out 
 #SBATCH -e {log_dir}/error_%j_%x.err 
 
-module load R/4.2.2-fasrc01
+{r_setup}
 
 EXP_DIR={exp_dir}
 SYNTHETIC_PREFIX="{synthetic_prefix}"
@@ -216,6 +233,18 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--config-file', default = "bps.ini")
     parser.add_argument('--section', default = "EXPERIMENT")
+    parser.add_argument('--backend', choices = ["slurm", "local"], default = "slurm",
+                        help = "write scripts for sbatch (slurm), or write scripts that run in the current "
+                               "environment and run the experiment on this machine (local)")
+    parser.add_argument('--workers', type = int, default = os.cpu_count(),
+                        help = "processes run at once with --backend local (default: %(default)s)")
+    parser.add_argument('--final-zetas', type = float, nargs = "*", default = [],
+                        help = "with --run, also run stage V on the original counts at these zetas")
+    parser.add_argument('--run', action = "store_true",
+                        help = "run or submit the tasks affected by changes since the last run "
+                               "(implied by --backend local); state is kept in <experiment>/pipeline-state.json")
+    parser.add_argument('--dry-run', action = "store_true",
+                        help = "with --run, only list the tasks that would run and why")
     return parser.parse_args()
 
 def read_config(config_file, section):
@@ -248,12 +277,28 @@ def main():
     os.makedirs(os.path.join(exp_name, "figures"), exist_ok = True)
     os.umask(oldmask)
 
+    resource_requests = resources.estimate_experiment(exp, exp_name, dict(
+        nnls = (64, 2 * 3600), nmf = (32, 7 * 24 * 3600), plots = (32, 6 * 3600)))
+
+    if args.backend == "local":
+        env_setup = "# runs in the current environment"
+        r_setup = env_setup
+        backend_opts = " --backend local --workers {}".format(args.workers)
+        submit_plots = "bash"
+    else:
+        env_setup = ENV_SETUP.format(conda_env = exp.get("conda_env"))
+        r_setup = "module load R/4.2.2-fasrc01"
+        backend_opts = " --slurm"
+        submit_plots = "sbatch --job-name=generate_plots_" + exp_name + "_${EXP}"
+
     ## Stage I 
     stage_1_content = INFER_LOADINGS_TEMPLATE.format(
+        mem = resource_requests["nnls"][0],
+        walltime = resources.slurm_time(resource_requests["nnls"][1]),
         jobname = "infer_loadings_initial_" + exp_name,
         queue = exp.get("main_queue"),
         log_dir = os.path.join(wd, exp_name, "logs"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         BPS_dir = wd,
         data = exp.get("data"),
         filter = exp.get("sample_prefixes"),
@@ -285,7 +330,7 @@ def main():
         jobname = "generate_synthetic_data_" + exp_name,
         queue = exp.get("main_queue"),
         log_dir = os.path.join(wd, exp_name, "logs"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         BPS_dir = wd,
         new_prefix = synthetic_prefix,
         sigs_file = "" if exp.get("signatures_file") == "" else "--signatures-file {}".format(exp.get("signatures_file")),
@@ -308,11 +353,23 @@ def main():
     synthetic_data_files = ["{}-seed-{}.tsv".format(synthetic_prefix, se) for se in synthetic_experiments]
 
     ## NMF script
+    nmf_opts = "-a " + exp.get("a") + " --J0 " + exp.get("J0") + " --engine " + exp.get("engine", "nuts") + " --stan-cache " + os.path.join(wd, "stan_cache")
+    if exp.get("checkpoint_every", "") != "":
+        nmf_opts += " --checkpoint-every {}".format(exp.get("checkpoint_every"))
+    if exp.getint("threads_per_chain", 1) > 1:
+        nmf_opts += " --threads-per-chain {}".format(exp.get("threads_per_chain"))
+    if exp.getboolean("prune", False):
+        nmf_opts += " --prune"
+    if exp.getboolean("stop_when_converged", False):
+        # chains of the same data and zeta pool their convergence checks
+        nmf_opts += " --stop-when-converged --pool-size {} --pool-dir $RESULTS_DIR/convergence/${{2%.tsv}}-zeta-$ZETA".format(exp.get("no_chains"))
     nmf_content = INFER_LOADINGS_AND_SIGS_TEMPLATE.format(
+        mem = resource_requests["nmf"][0],
+        walltime = resources.slurm_time(resource_requests["nmf"][1]),
         jobname = "NMF_" + exp_name,
         queue = exp.get("nmf_queue"),
         log_dir = os.path.join(wd, exp_name, "logs"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         max_time = exp.get("max_time"),
         exp_name = exp_name,
         BPS_dir = wd,
@@ -323,19 +380,52 @@ def main():
         samps = exp.get("samples"),
         burnin = exp.get("burnin"),
         thin = exp.get("thin"),
-        opts = "-a " + exp.get("a") + " --J0 " + exp.get("J0") 
+        opts = nmf_opts,
+        threads = exp.get("threads_per_chain", "1"),
+        warm_burnin = "" if exp.get("warm_burnin", "") == "" else " --warm-burnin {}".format(exp.get("warm_burnin"))
     )
 
     with open(os.path.join(exp_name, "experiment_scripts", "run_nmf.sh"), "w+") as f:
         f.writelines(nmf_content)
 
 
+    submit_opts = " --warm-start" if exp.getboolean("warm_start", False) else ""
+    if exp.getboolean("array_table", False) and not exp.getboolean("pack", False):
+        # one job array over a table of the missing runs
+        submit_opts += " --table"
+        if exp.get("max_concurrent", "") != "":
+            submit_opts += " --max-concurrent " + exp.get("max_concurrent")
+    if exp.getboolean("pack", False):
+        # bundle short chains into allocations that each run a local pool
+        submit_opts += " --pack --pack-cores {} --pack-memory {} --pack-hours {}".format(
+            exp.get("pack_cores", "8"), exp.get("pack_memory", "64"), exp.get("pack_hours", "12"))
+        if exp.get("profile_dirs", "") != "":
+            submit_opts += " --profile-dirs " + exp.get("profile_dirs")
+
+    if exp.getboolean("adaptive_zetas", False):
+        # refine the testing_powers ladder where K or the log likelihood
+        # changes; the job waits for each round of runs
+        search_hours = float(exp.get("zeta_search_hours", "96"))
+        search_rounds = int(exp.get("zeta_search_rounds", "6"))
+        stage_3_driver = "search-zetas.py"
+        # the coarse ladder and each refinement share the walltime
+        stage_3_opts = submit_opts + " --tolerance {} --max-rounds {} --timeout {:.2f}".format(
+            exp.get("zeta_tolerance", "0.05"), search_rounds, search_hours / (search_rounds + 1))
+        # plus time to submit the runs and read their results
+        stage_3_walltime = resources.slurm_time(3600 * search_hours + 1800)
+        zeta_file = ZETA_FILE
+    else:
+        stage_3_driver = "submit-nmf-jobs.py"
+        stage_3_opts = submit_opts
+        stage_3_walltime = "0-00:15"
+        zeta_file = ""
+
     ## Stage IIIa
     stage_3_a_content = INFER_LOADINGS_AND_SIGS_LOOP_TEMPLATE.format(
         jobname = "submit_NMF_" + exp_name,
         queue = exp.get("main_queue"),
         log_dir = os.path.join(wd, exp_name, "logs"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         exp_name = exp_name,
         BPS_dir = wd,
         zetas = exp.get("testing_powers"),
@@ -349,7 +439,11 @@ def main():
         burnin = exp.get("burnin"),
         a = float(exp.get("a")),
         J0 = float(exp.get("J0")),
-        opts = ""
+        opts = "",
+        backend_opts = backend_opts,
+        submit_opts = stage_3_opts,
+        driver = stage_3_driver,
+        loop_walltime = stage_3_walltime
     )
 
     with open(os.path.join(exp_name, "experiment_scripts", "stage_3_a.sh"), "w+") as f:
@@ -357,9 +451,11 @@ def main():
 
     ## Stage IIIb
     viz_content_3 = MAKE_PLOTS_TEMPLATE.format(
+        mem = resource_requests["plots"][0],
+        walltime = resources.slurm_time(resource_requests["plots"][1]),
         log_dir = os.path.join(wd, exp_name, "logs"),
         queue = exp.get("main_queue"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         BPS_dir = wd,
         exp_dir = exp_name,
         synthetic_prefix = synthetic_prefix + "-seed-",
@@ -371,6 +467,7 @@ def main():
         J0 = float(exp.get("J0")),
         seeds = " ".join(map(str, list(range(1, int(exp.get("no_chains")) + 1)))),
         zetas = exp.get("testing_powers"),
+        zeta_file = zeta_file,
         skip = exp.get("skip"),
         subst_type = exp.get("subst_type"),
         sigs_file = "" if exp.get("signatures_file") == "" else "--signatures-file {}".format(exp.get("signatures_file")),
@@ -387,10 +484,11 @@ def main():
         jobname = "generate_plot_jobs_" + exp_name,
         queue = exp.get("main_queue"),
         log_dir = os.path.join(wd, exp_name, "logs"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         BPS_dir = os.path.join(wd),
         exp_name = exp_name,
         exp_list = " ".join(synthetic_experiments),
+        submit = submit_plots,
         final_zeta = "",
         stage = str(3)
     )
@@ -403,6 +501,7 @@ def main():
         jobname = "plot_comparison_" + exp_name,
         queue = exp.get("main_queue"),
         log_dir = os.path.join(wd, exp_name, "logs"),
+        r_setup = r_setup,
         BPS_dir = wd,
         exp_dir = os.path.join(wd, exp_name),
         synthetic_prefix = synthetic_prefix + "-seed-",
@@ -423,7 +522,7 @@ def main():
         jobname = "submit_NMF_" + exp_name,
         queue = exp.get("main_queue"),
         log_dir = os.path.join(wd, exp_name, "logs"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         exp_name = exp_name,
         BPS_dir = wd,
         zetas = "$1",
@@ -437,7 +536,11 @@ def main():
         burnin = exp.get("burnin"),
         a = float(exp.get("a")),
         J0 = float(exp.get("J0")),
-        opts = ""
+        opts = "",
+        backend_opts = backend_opts,
+        submit_opts = submit_opts,
+        driver = "submit-nmf-jobs.py",
+        loop_walltime = "0-00:15"
     )
 
     with open(os.path.join(exp_name, "experiment_scripts", "stage_5_a.sh"), "w+") as f:
@@ -445,9 +548,11 @@ def main():
 
     ## Stage Vb
     viz_content_5 = MAKE_PLOTS_TEMPLATE.format(
+        mem = resource_requests["plots"][0],
+        walltime = resources.slurm_time(resource_requests["plots"][1]),
         log_dir = os.path.join(wd, exp_name, "logs"),
         queue = exp.get("main_queue"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         BPS_dir = wd,
         exp_dir = exp_name,
         synthetic_prefix = "",
@@ -459,6 +564,7 @@ def main():
         J0 = float(exp.get("J0")),
         seeds = " ".join(map(str, list(range(1, int(exp.get("no_chains")) + 1)))),
         zetas = "${*:2}",
+        zeta_file = "",
         skip = exp.get("skip"),
         subst_type = exp.get("subst_type"),
         sigs_file = "" if exp.get("signatures_file") == "" else "--signatures-file {}".format(exp.get("signatures_file")),
@@ -475,10 +581,11 @@ def main():
         jobname = "generate_plot_jobs_" + exp_name,
         queue = exp.get("main_queue"),
         log_dir = os.path.join(wd, exp_name, "logs"),
-        conda_env = exp.get("conda_env"),
+        env_setup = env_setup,
         BPS_dir = os.path.join(wd),
         exp_name = exp_name,
         exp_list = exp.get("sample_prefixes") + "_original_counts",
+        submit = submit_plots,
         final_zeta = "$*",
         stage = str(5)
     )
@@ -486,5 +593,86 @@ def main():
     with open(os.path.join(exp_name, "experiment_scripts", "stage_5_b.sh"), "w+") as f:
         f.writelines(stage_5_b_content)
 
+    if args.run or args.backend == "local":
+        if exp.getboolean("adaptive_zetas", False):
+            print("adaptive_zetas is used by stage_3_a.sh only; running the testing_powers grid")
+        tasks = pipeline_tasks(exp, exp_name, wd, synthetic_prefix, synthetic_experiments, synthetic_data_files,
+                               args.final_zetas)
+        log_dir = os.path.join(wd, exp_name, "logs")
+        failed = pipeline.run(tasks, os.path.join(wd, exp_name, "pipeline-state.json"), backend = args.backend,
+                              workers = args.workers, job_prefix = exp_name + "_", log_dir = log_dir,
+                              dry_run = args.dry_run)
+        if len(failed) > 0:
+            sys.exit("failed or not run: {} (logs in {})".format(" ".join(failed), log_dir))
+
+def pipeline_tasks(exp, exp_name, wd, synthetic_prefix, synthetic_experiments, synthetic_data_files, final_zetas):
+    """Stages I-IV, and V at final_zetas, as a graph of pipeline tasks.
+
+    The stages that only submit other jobs (IIIa/b, Va/b) are replaced by
+    those jobs: one run_nmf.sh task per data set, zeta and seed, and one
+    plotting task per data set.
+    """
+    scripts = os.path.join(wd, exp_name, "experiment_scripts")
+    data_dir = os.path.join(exp_name, "synthetic_data")
+    seeds = list(range(1, int(exp.get("no_chains")) + 1))
+    warm_start = exp.getboolean("warm_start", False)
+    # as in the stage IIIa/Va results template
+    run_info = "{}-burnin-{}-samps-{}-K-{}".format(exp.get("model"), exp.get("burnin"), exp.get("samples"), exp.get("K"))
+    mid_info = "a-{:.2f}-J0-{:.1f}".format(float(exp.get("a")), float(exp.get("J0")))
+    external = [os.path.join(wd, exp.get("data"))]
+    if exp.get("signatures_file") != "":
+        external.append(os.path.join(wd, exp.get("signatures_file")))
+
+    def task(name, script, *script_args, **kwargs):
+        return pipeline.Task(name, os.path.join(scripts, script), script_args, **kwargs)
+
+    def nmf_tasks(data_name, zetas, dep):
+        """Chains of one data set; with warm starts each seed's chain waits for its previous zeta."""
+        tasks = []
+        previous = {}
+        for zeta in (sorted(zetas) if warm_start else zetas):
+            for seed in seeds:
+                results = os.path.join(exp_name, "results", "{}-{}-seed-{}-{}-zeta-{:.3f}-samples.h5".format(
+                    data_name, run_info, seed, mid_info, zeta))
+                script_args = [zeta, data_name + ".tsv"]
+                deps = [dep]
+                if seed in previous:
+                    script_args.append(previous[seed][1])
+                    deps.append(previous[seed][0])
+                name = "nmf_{}_{}_{}".format(data_name, zeta, seed)
+                tasks.append(task(name, "run_nmf.sh", *script_args, deps = deps, array_index = seed,
+                                  outputs = [os.path.join(wd, results)]))
+                if warm_start:
+                    previous[seed] = (name, results)
+        return tasks
+
+    def figures(data_name):
+        return os.path.join(wd, exp_name, "figures", "{}-{}-{}-multi-zeta".format(data_name, run_info, mid_info),
+                            "summary.npz")
+
+    original = exp.get("sample_prefixes") + "_original_counts"
+    tasks = [
+        task("stage_1", "stage_1.sh", inputs = external, outputs = [os.path.join(wd, data_dir, original + ".tsv")]),
+        task("stage_2", "stage_2.sh", deps = ["stage_1"], inputs = external,
+             outputs = [os.path.join(wd, data_dir, f) for f in synthetic_data_files]),
+    ]
+    zetas = [float(z) for z in exp.get("testing_powers").split()]
+    viz_3 = []
+    for e in synthetic_experiments:
+        data_name = "{}-seed-{}".format(synthetic_prefix, e)
+        nmf = nmf_tasks(data_name, zetas, "stage_2")
+        tasks += nmf
+        viz_3.append("viz_3_" + e)
+        tasks.append(task(viz_3[-1], "run_viz_3.sh", e, deps = [t.name for t in nmf],
+                          outputs = [figures(data_name)]))
+    tasks.append(task("stage_4", "stage_4.sh", deps = viz_3,
+                      outputs = [os.path.join(wd, exp_name, "figures", "zeta-comparison.pdf")]))
+    if len(final_zetas) > 0:
+        nmf = nmf_tasks(original, final_zetas, "stage_1")
+        tasks += nmf
+        tasks.append(task("viz_5", "run_viz_5.sh", original, *final_zetas, deps = [t.name for t in nmf],
+                          outputs = [figures(original)]))
+    return tasks
+
 if __name__ == '__main__':
     main()
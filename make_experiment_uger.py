@@ -5,14 +5,17 @@ import argparse
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from bpstools import resources
+
 INFER_LOADINGS_TEMPLATE = """#!/bin/bash
 
 #$ -N {jobname}
 #$ -j y
 #$ -o {log_dir}
 
-#$ -l h_vmem=32G
-#$ -l h_rt=01:00:00
+#$ -l h_vmem={mem}G
+#$ -l h_rt={walltime}
 #$ -l os=RedHat7
 
 source /broad/software/scripts/useuse
@@ -74,8 +77,9 @@ INFER_LOADINGS_AND_SIGS_TEMPLATE = """#!/bin/bash
 #$ -j y
 #$ -o {log_dir}
 
-#$ -l h_vmem=64G
-#$ -l h_rt={max_time}
+#$ -l h_vmem={mem}G
+#$ -l h_rt={walltime}
+#$ -pe smp {threads}
 #$ -l os=RedHat7
 
 source /broad/software/scripts/useuse
@@ -84,6 +88,16 @@ reuse .python-3.6.0
 reuse GCC-5.2
 source {virtual_env}/bin/activate
 
+# one row of a parameter table (submit-nmf-jobs.py --table): the array task
+# id picks the line after the header, giving the zeta, data file, seed,
+# whether to resume from a checkpoint and init
+if [ "$1" = "--table" ]; then
+    IFS=$'\\t' read -r ROW_ZETA ROW_DATA ROW_SEED ROW_RESUME ROW_INIT < <(sed -n "$((SGE_TASK_ID + 1))p" "$2")
+    set -- "$ROW_ZETA" "$ROW_DATA" "$ROW_INIT"
+    SGE_TASK_ID=$ROW_SEED
+    RESUME=$ROW_RESUME
+fi
+
 ZETA=$1
 DATA="{exp_name}/synthetic_data/${{2}}"
 MODEL={model}
@@ -96,6 +110,15 @@ THIN={thin}
 RESULTS_DIR={exp_name}/results
 SEED=$SGE_TASK_ID
 OPTS="{opts}"
+# optional warm start; the submitter passes @SEED@ in place of the seed
+INIT="${{3//@SEED@/$SEED}}"
+if [ -n "$INIT" ]; then
+    OPTS="$OPTS --init-from $INIT{warm_burnin}"
+fi
+# set by submit-nmf-jobs.py for runs that left a checkpoint
+if [ "$RESUME" = "1" ]; then
+    OPTS="$OPTS --resume"
+fi
 
 
 cd {BPS_dir}
@@ -110,7 +133,7 @@ INFER_LOADINGS_AND_SIGS_LOOP_TEMPLATE = """#!/bin/bash
 #$ -o {log_dir}
 
 #$ -l h_vmem=8G
-#$ -l h_rt=00:20:00
+#$ -l h_rt={loop_walltime}
 #$ -l os=RedHat7
 
 source /broad/software/scripts/useuse
@@ -128,8 +151,8 @@ SEEDS="{seeds}"
 
 
 cd {BPS_dir}
-echo "python scripts/submit-nmf-jobs.py $PREFIX $EXP_DIR $TEMPLATE --seeds $SEEDS --zetas $ZETAS --exp-list $EXPS"
-python scripts/submit-nmf-jobs.py $PREFIX $EXP_DIR $TEMPLATE --seeds $SEEDS --zetas $ZETAS --exp-list $EXPS
+echo "python scripts/{driver} $PREFIX $EXP_DIR $TEMPLATE --seeds $SEEDS --zetas $ZETAS --exp-list $EXPS{submit_opts}"
+python scripts/{driver} $PREFIX $EXP_DIR $TEMPLATE --seeds $SEEDS --zetas $ZETAS --exp-list $EXPS{submit_opts}
 """
 
 MAKE_PLOTS_LOOP_TEMPLATE = """#!/bin/bash
@@ -159,13 +182,20 @@ done
 """
 
 
+# Stage IIIb plots the zetas search-zetas.py ran (adaptive_zetas)
+ZETA_FILE = """
+if [ -f $EXP_DIR/zetas/$EXP.txt ]; then
+    ZETAS=$(cat $EXP_DIR/zetas/$EXP.txt)
+fi"""
+
+
 MAKE_PLOTS_TEMPLATE = """#!/bin/bash
 
 #$ -j y
 #$ -o {log_dir}
 
-#$ -l h_vmem=32G
-#$ -l h_rt=06:00:00
+#$ -l h_vmem={mem}G
+#$ -l h_rt={walltime}
 #$ -l os=RedHat7
 
 
@@ -180,7 +210,7 @@ PREFIX={model}-burnin-{B}-samps-{S}-K-{K}
 MID=a-{a:.2f}-J0-{J0:.1f}
 EXP_DIR={exp_dir}
 SEEDS="{seeds}"
-ZETAS="{zetas}"
+ZETAS="{zetas}"{zeta_file}
 SKIP={skip}
 SAVE_DIR=figures/
 RESULTS_DIR=results/
@@ -262,8 +292,15 @@ def main():
     os.makedirs(os.path.join(exp_name, "figures"), exist_ok = True)
     os.umask(oldmask)
 
+    resource_requests = resources.estimate_experiment(exp, exp_name, dict(
+        nnls = (32, 3600), nmf = (64, resources.parse_walltime(exp.get("max_time"))),
+        plots = (32, 6 * 3600)))
+    threads = int(exp.get("threads_per_chain", "1"))
+
     ## Stage I 
     stage_1_content = INFER_LOADINGS_TEMPLATE.format(
+        mem = resource_requests["nnls"][0],
+        walltime = resources.uger_time(resource_requests["nnls"][1]),
         jobname = "infer_loadings_initial_" + exp_name,
         log_dir = os.path.join(wd, exp_name, "logs"),
         virtual_env = exp.get("virtual_env"),
@@ -320,11 +357,23 @@ def main():
     synthetic_data_files = ["{}-seed-{}.tsv".format(synthetic_prefix, se) for se in synthetic_experiments]
 
     ## NMF script
+    nmf_opts = "-a " + exp.get("a") + " --J0 " + exp.get("J0") + " --engine " + exp.get("engine", "nuts") + " --stan-cache " + os.path.join(wd, "stan_cache")
+    if exp.get("checkpoint_every", "") != "":
+        nmf_opts += " --checkpoint-every {}".format(exp.get("checkpoint_every"))
+    if exp.getint("threads_per_chain", 1) > 1:
+        nmf_opts += " --threads-per-chain {}".format(exp.get("threads_per_chain"))
+    if exp.getboolean("prune", False):
+        nmf_opts += " --prune"
+    if exp.getboolean("stop_when_converged", False):
+        # chains of the same data and zeta pool their convergence checks
+        nmf_opts += " --stop-when-converged --pool-size {} --pool-dir $RESULTS_DIR/convergence/${{2%.tsv}}-zeta-$ZETA".format(exp.get("no_chains"))
     nmf_content = INFER_LOADINGS_AND_SIGS_TEMPLATE.format(
+        # h_vmem is per slot
+        mem = -(-resource_requests["nmf"][0] // threads),
+        walltime = resources.uger_time(resource_requests["nmf"][1]),
         jobname = "NMF_" + exp_name,
         log_dir = os.path.join(wd, exp_name, "logs"),
         virtual_env = exp.get("virtual_env"),
-        max_time = exp.get("max_time"),
         exp_name = exp_name,
         BPS_dir = wd,
         model = exp.get("model"),
@@ -334,13 +383,46 @@ def main():
         samps = exp.get("samples"),
         burnin = exp.get("burnin"),
         thin = exp.get("thin"),
-        opts = "-a " + exp.get("a") + " --J0 " + exp.get("J0") 
+        opts = nmf_opts,
+        threads = threads,
+        warm_burnin = "" if exp.get("warm_burnin", "") == "" else " --warm-burnin {}".format(exp.get("warm_burnin"))
     )
 
     with open(os.path.join(exp_name, "experiment_scripts", "run_nmf.sh"), "w+") as f:
         f.writelines(nmf_content)
 
 
+    submit_opts = " --warm-start" if exp.getboolean("warm_start", False) else ""
+    if exp.getboolean("array_table", False) and not exp.getboolean("pack", False):
+        # one job array over a table of the missing runs
+        submit_opts += " --table"
+        if exp.get("max_concurrent", "") != "":
+            submit_opts += " --max-concurrent " + exp.get("max_concurrent")
+    if exp.getboolean("pack", False):
+        # bundle short chains into allocations that each run a local pool
+        submit_opts += " --pack --pack-cores {} --pack-memory {} --pack-hours {}".format(
+            exp.get("pack_cores", "8"), exp.get("pack_memory", "64"), exp.get("pack_hours", "12"))
+        if exp.get("profile_dirs", "") != "":
+            submit_opts += " --profile-dirs " + exp.get("profile_dirs")
+
+    if exp.getboolean("adaptive_zetas", False):
+        # refine the testing_powers ladder where K or the log likelihood
+        # changes; the job waits for each round of runs
+        search_hours = float(exp.get("zeta_search_hours", "96"))
+        search_rounds = int(exp.get("zeta_search_rounds", "6"))
+        stage_3_driver = "search-zetas.py"
+        # the coarse ladder and each refinement share the walltime
+        stage_3_opts = submit_opts + " --tolerance {} --max-rounds {} --timeout {:.2f}".format(
+            exp.get("zeta_tolerance", "0.05"), search_rounds, search_hours / (search_rounds + 1))
+        # plus time to submit the runs and read their results
+        stage_3_walltime = resources.uger_time(3600 * search_hours + 1800)
+        zeta_file = ZETA_FILE
+    else:
+        stage_3_driver = "submit-nmf-jobs.py"
+        stage_3_opts = submit_opts
+        stage_3_walltime = "00:20:00"
+        zeta_file = ""
+
     ## Stage IIIa
     stage_3_a_content = INFER_LOADINGS_AND_SIGS_LOOP_TEMPLATE.format(
         jobname = "submit_NMF_" + exp_name,
@@ -359,7 +441,10 @@ def main():
         burnin = exp.get("burnin"),
         a = float(exp.get("a")),
         J0 = float(exp.get("J0")),
-        opts = ""
+        opts = "",
+        submit_opts = stage_3_opts,
+        driver = stage_3_driver,
+        loop_walltime = stage_3_walltime
     )
 
     with open(os.path.join(exp_name, "experiment_scripts", "stage_3_a.sh"), "w+") as f:
@@ -367,6 +452,8 @@ def main():
 
     ## Stage IIIb
     viz_content_3 = MAKE_PLOTS_TEMPLATE.format(
+        mem = resource_requests["plots"][0],
+        walltime = resources.uger_time(resource_requests["plots"][1]),
         log_dir = os.path.join(wd, exp_name, "logs"),
         virtual_env = exp.get("virtual_env"),
         BPS_dir = wd,
@@ -380,6 +467,7 @@ def main():
         J0 = float(exp.get("J0")),
         seeds = " ".join(map(str, list(range(1, int(exp.get("no_chains")) + 1)))),
         zetas = exp.get("testing_powers"),
+        zeta_file = zeta_file,
         skip = exp.get("skip"),
         subst_type = exp.get("subst_type"),
         sigs_file = "" if exp.get("signatures_file") == "" else "--signatures-file {}".format(exp.get("signatures_file")),
@@ -444,7 +532,10 @@ def main():
         burnin = exp.get("burnin"),
         a = float(exp.get("a")),
         J0 = float(exp.get("J0")),
-        opts = ""
+        opts = "",
+        submit_opts = submit_opts,
+        driver = "submit-nmf-jobs.py",
+        loop_walltime = "00:20:00"
     )
 
     with open(os.path.join(exp_name, "experiment_scripts", "stage_5_a.sh"), "w+") as f:
@@ -452,6 +543,8 @@ def main():
 
     ## Stage Vb
     viz_content_5 = MAKE_PLOTS_TEMPLATE.format(
+        mem = resource_requests["plots"][0],
+        walltime = resources.uger_time(resource_requests["plots"][1]),
         log_dir = os.path.join(wd, exp_name, "logs"),
         virtual_env = exp.get("virtual_env"),
         BPS_dir = wd,
@@ -466,6 +559,7 @@ def main():
         seeds = " ".join(map(str, list(range(1, int(exp.get("no_chains")) + 1)))),
         zetas = "$2",
         # zetas = exp.get("testing_powers"),
+        zeta_file = "",
         skip = exp.get("skip"),
         subst_type = exp.get("subst_type"),
         sigs_file = "" if exp.get("signatures_file") == "" else "--signatures-file {}".format(exp.get("signatures_file")),
@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+import pandas
+
+from bpstools import diagnostics, gibbs, h5io, likelihood, sgmcmc
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Effective samples per second of full Gibbs sweeps '
+                    'and sgmcmc steps against the number of samples.  An '
+                    'sgmcmc step updates only one minibatch of loadings, so '
+                    'iterations are compared by the ESS per second of each '
+                    'sample\'s log likelihood (median over samples).')
+    parser.add_argument('--data', default='data/WGS_PCAWG.96.ready.tsv')
+    parser.add_argument('--J', type=int, nargs='*',
+                        default=[38, 100, 300, 1000, 3000],
+                        help='numbers of samples, drawn from the columns of '
+                             '--data (with replacement beyond its size)')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('-K', type=int, default=25)
+    parser.add_argument('-a', type=float, default=0.5)
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--epsilon', '-e', type=float, default=1e-3)
+    parser.add_argument('--J0', type=float, default=10.)
+    parser.add_argument('--zeta', type=float, default=1.)
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='untimed iterations before the ESS is measured')
+    parser.add_argument('--iters', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def time_sampler(sampler, warmup, iters, seed):
+    """Seconds per iteration, and the median over samples of the ESS per
+    second of their log likelihoods."""
+    rng = np.random.default_rng(seed)
+    state = sampler.initialize(rng)
+    for _ in range(warmup):
+        sampler.sweep(state, rng)
+    seconds = 0.
+    log_liks = np.empty((sampler.J, iters))
+    for t in range(iters):
+        start = time.time()
+        sampler.sweep(state, rng)
+        seconds += time.time() - start
+        log_liks[:,t] = likelihood.log_likelihood(
+            sampler.counts, state[h5io.LOADINGS], state[h5io.MUTSIGS],
+            per_sample=True)
+    ess = diagnostics.effective_sample_size(log_liks)
+    return seconds / iters, np.median(ess) / seconds
+
+
+def main():
+    args = parse_args()
+    all_counts = pandas.read_csv(args.data, sep='\t').iloc[:,1:].values
+    rng = np.random.default_rng(args.seed)
+    print('\t'.join(['J', 'nonzeros', 'gibbs ms/iter', 'sgmcmc ms/iter',
+                     'gibbs ESS/s', 'sgmcmc ESS/s', 'speedup']))
+    for J in args.J:
+        cols = rng.choice(all_counts.shape[1], J,
+                          replace=J > all_counts.shape[1])
+        counts = likelihood.as_coo(all_counts[:,cols])
+        J0 = args.J0 * J if args.J0 <= 1 else args.J0
+        a0 = J0 * args.a + 1
+        b0 = args.epsilon * (a0 - 1)
+        kwargs = dict(a=args.a, alpha=args.alpha, a0=a0, b0=b0,
+                      zeta=args.zeta)
+        full, full_ess = time_sampler(
+            gibbs.PowerNMFGibbs(counts, args.K, **kwargs), args.warmup,
+            args.iters, args.seed)
+        sg, sg_ess = time_sampler(
+            sgmcmc.PowerNMFSGRLD(counts, args.K, batch_size=args.batch_size,
+                                 **kwargs), args.warmup, args.iters, args.seed)
+        print('\t'.join([str(J), str(counts.nnz), '{:.1f}'.format(1e3 * full),
+                         '{:.1f}'.format(1e3 * sg), '{:.1f}'.format(full_ess),
+                         '{:.1f}'.format(sg_ess),
+                         '{:.2f}'.format(sg_ess / full_ess)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import os
+import argparse
+import time
+
+import numpy as np
+import pandas
+
+from bpstools import likelihood
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='time of the dense and the nonzero-only Poisson '
+                    'log-likelihood as the count matrix gets sparser')
+    parser.add_argument('--data', default='data/WGS_PCAWG.96.ready.tsv')
+    parser.add_argument('--thinning', type=float, nargs='*',
+                        default=[1, .3, .1, .03, .01, .003],
+                        help='fractions of mutations kept (binomial thinning '
+                             'mimics lower-burden tumours)')
+    parser.add_argument('-K', type=int, default=25)
+    parser.add_argument('--draws', type=int, default=200)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def best_time(f, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    counts = pandas.read_csv(args.data, sep='\t').iloc[:,1:].values
+    I, J = counts.shape
+    mutsigs = rng.dirichlet(np.ones(I), size=(args.K, args.draws))
+    mutsigs = np.moveaxis(mutsigs, 1, -1)
+    loadings = rng.gamma(.5, 2 * counts.sum(axis=0) / args.K,
+                         size=(args.draws, args.K, J))
+    loadings = np.moveaxis(loadings, 0, -1)
+    print('\t'.join(['data', 'kept', 'zero fraction', 'dense (s)',
+                     'sparse (s)', 'speedup']))
+    for fraction in args.thinning:
+        thinned = rng.binomial(counts, fraction)
+        sparse = likelihood.as_coo(thinned)
+        dense_time = best_time(lambda: likelihood.dense_log_likelihood(
+            thinned, loadings, mutsigs), args.repeats)
+        sparse_time = best_time(lambda: likelihood.log_likelihood(
+            sparse, loadings, mutsigs), args.repeats)
+        print('\t'.join([os.path.basename(args.data), '{:g}'.format(fraction),
+                         '{:.3f}'.format(1 - sparse.nnz / thinned.size),
+                         '{:.3f}'.format(dense_time),
+                         '{:.3f}'.format(sparse_time),
+                         '{:.1f}'.format(dense_time / sparse_time)]))
+
+
+if __name__ == '__main__':
+    main()
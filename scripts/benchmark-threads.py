@@ -0,0 +1,59 @@
+import os
+import argparse
+import time
+
+import numpy as np
+import pandas
+
+from bpstools import gibbs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Gibbs sweep time against the number of threads per chain')
+    parser.add_argument('--data',
+                        default='data/synthetic-326-liver-hcc-all-seed-1.tsv')
+    parser.add_argument('--threads', type=int, nargs='*', default=[1, 2, 4, 8])
+    parser.add_argument('-K', type=int, default=25)
+    parser.add_argument('-a', type=float, default=0.5)
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--epsilon', '-e', type=float, default=1e-3)
+    parser.add_argument('--J0', type=float, default=10.)
+    parser.add_argument('--zeta', type=float, default=1.)
+    parser.add_argument('--iters', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    counts = pandas.read_csv(args.data, sep='\t').iloc[:,1:].values
+    J0 = args.J0 * counts.shape[1] if args.J0 <= 1 else args.J0
+    a0 = J0 * args.a + 1
+    b0 = args.epsilon * (a0 - 1)
+    print('{} CPUs available'.format(len(os.sched_getaffinity(0))))
+    print('\t'.join(['data', 'threads', 'ms/sweep', 'speedup', 'efficiency']))
+    base = None
+    for threads in args.threads:
+        sampler = gibbs.PowerNMFGibbs(counts, args.K, a=args.a,
+                                      alpha=args.alpha, a0=a0, b0=b0,
+                                      zeta=args.zeta, threads=threads)
+        rng = np.random.default_rng(args.seed)
+        state = sampler.initialize(rng)
+        # a few sweeps so the timing excludes the start-up transient
+        for _ in range(10):
+            sampler.sweep(state, rng)
+        start = time.time()
+        for _ in range(args.iters):
+            sampler.sweep(state, rng)
+        per_sweep = (time.time() - start) / args.iters
+        sampler.close()
+        base = base or per_sweep
+        print('\t'.join([os.path.basename(args.data), str(threads),
+                         '{:.1f}'.format(1e3 * per_sweep),
+                         '{:.2f}'.format(base / per_sweep),
+                         '{:.0%}'.format(base / per_sweep / threads)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import os
+import glob
+import argparse
+import time
+
+import numpy as np
+import pandas
+
+from bpstools import gibbs, h5io
+
+CUTOFF = 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='warmup needed for expected K to stabilize when each '
+                    'zeta is started cold versus from the previous zeta')
+    parser.add_argument('--data', nargs='*',
+                        default=sorted(glob.glob('data/synthetic-38-lung-adenoca-*.tsv')))
+    parser.add_argument('--zetas', type=float, nargs='*',
+                        default=[0.1, 0.2, 0.3, 0.4, 0.6, 0.8, 1])
+    parser.add_argument('-K', type=int, default=25)
+    parser.add_argument('-a', type=float, default=0.5)
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--epsilon', '-e', type=float, default=1e-3)
+    parser.add_argument('--J0', type=float, default=10.)
+    parser.add_argument('--iters', type=int, default=2000,
+                        help='iterations per zeta; the second half defines '
+                             'the stable expected K')
+    parser.add_argument('--window', type=int, default=50,
+                        help='window of the running median of K')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def iterations_to_stable_K(Ks, window):
+    """First iteration after which the running median of K stays at its final value."""
+    running = np.array([np.median(Ks[max(0, t - window + 1):t + 1])
+                        for t in range(len(Ks))])
+    target = np.median(Ks[len(Ks) // 2:])
+    off = np.nonzero(np.abs(running - target) > .5)[0]
+    return 0 if off.size == 0 else off[-1] + 1
+
+
+def trace_K(sampler, state, iters, rng):
+    Ks = np.empty(iters, dtype=int)
+    for it in range(iters):
+        sampler.sweep(state, rng)
+        Ks[it] = np.sum(state[h5io.EXPECTED_LOADINGS] > CUTOFF)
+    return Ks, state
+
+
+def main():
+    args = parse_args()
+    print('\t'.join(['data', 'zeta', 'K', 'cold warmup', 'warm warmup',
+                     'cold (s)', 'warm (s)']))
+    for path in args.data:
+        counts = pandas.read_csv(path, sep='\t').iloc[:,1:].values
+        J0 = args.J0 * counts.shape[1] if args.J0 <= 1 else args.J0
+        a0 = J0 * args.a + 1
+        b0 = args.epsilon * (a0 - 1)
+        warm_state = None
+        for zeta in sorted(args.zetas):
+            sampler = gibbs.PowerNMFGibbs(counts, args.K, a=args.a,
+                                          alpha=args.alpha, a0=a0, b0=b0,
+                                          zeta=zeta)
+            rng = np.random.default_rng(args.seed)
+            start = time.time()
+            cold_Ks, cold_state = trace_K(sampler, sampler.initialize(rng),
+                                          args.iters, rng)
+            cold_time = time.time() - start
+            if warm_state is None:
+                warm_Ks, warm_time = cold_Ks, cold_time
+                warm_state = cold_state
+            else:
+                rng = np.random.default_rng(args.seed)
+                start = time.time()
+                warm_Ks, warm_state = trace_K(sampler, warm_state, args.iters, rng)
+                warm_time = time.time() - start
+            print('\t'.join([os.path.basename(path), '{:.3f}'.format(zeta),
+                             '{:.0f}'.format(np.median(warm_Ks[args.iters // 2:])),
+                             str(iterations_to_stable_K(cold_Ks, args.window)),
+                             str(iterations_to_stable_K(warm_Ks, args.window)),
+                             '{:.1f}'.format(cold_time),
+                             '{:.1f}'.format(warm_time)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+"""In-tree helpers for the Bayesian power-posterior signature pipeline.
+
+Everything that talks to Stan still goes through ``mutsigtools``; this package
+holds the pieces that live in this repository (NumPy samplers, HDF5 output).
+"""
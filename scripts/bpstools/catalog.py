@@ -0,0 +1,262 @@
+"""SQLite catalog of the samples files and figures of experiments.
+
+``Catalog.scan`` walks the ``results`` and ``figures`` directories of
+experiment directories.  It reads only the files whose size or mtime
+changed since the last scan.  Each samples file gets a row of ``results``
+(one per ``zeta-*`` group for multi-zeta files).  The row holds the run's
+settings, its runtime, whether it finished, and summaries read from the
+file's ``summary`` group and per-draw statistics.  Each other file under
+``figures`` gets a row of ``figures``.  Queries then replace probing shared
+storage with ``os.path.exists`` or ``ls | grep``.
+
+The catalog only caches what is on shared storage, so by default each user
+keeps one on the local disk of each node: SQLite's locking is unreliable on
+NFS.
+"""
+import os
+import re
+import getpass
+import sqlite3
+import tempfile
+
+import numpy as np
+import h5py
+
+from . import h5io, summary
+
+
+CATALOG = os.path.join(tempfile.gettempdir(),
+                       'bps-catalog-{}.sqlite'.format(getpass.getuser()))
+# median expected loading above which a signature counts towards K
+CUTOFF = 1
+
+RESULT_COLUMNS = (
+    ('path', 'TEXT'), ('grp', 'TEXT'), ('experiment', 'TEXT'),
+    ('name', 'TEXT'), ('data', 'TEXT'), ('variant', 'TEXT'),
+    ('model', 'TEXT'), ('engine', 'TEXT'), ('K', 'INTEGER'), ('a', 'REAL'),
+    ('J0', 'REAL'), ('eps', 'REAL'), ('alpha', 'REAL'), ('zeta', 'REAL'),
+    ('seed', 'INTEGER'), ('burnin', 'INTEGER'), ('samples', 'INTEGER'),
+    ('n_draws', 'INTEGER'), ('runtime', 'REAL'), ('size', 'INTEGER'),
+    ('mtime', 'REAL'), ('checkpointed', 'INTEGER'), ('complete', 'INTEGER'),
+    ('expected_K', 'INTEGER'), ('mean_log_likelihood', 'REAL'),
+    ('mean_log_prior', 'REAL'))
+FIGURE_COLUMNS = (
+    ('path', 'TEXT'), ('experiment', 'TEXT'), ('directory', 'TEXT'),
+    ('name', 'TEXT'), ('zeta', 'REAL'), ('size', 'INTEGER'),
+    ('mtime', 'REAL'))
+
+# infer-mutsigs.py output names, e.g.
+# <data>-normalized-burnin-1000-samps-1000-K-25-seed-1-a-0.50-J0-10.0-zeta-0.300-samples.h5
+RESULT_NAME = re.compile(
+    r'(?P<data>.+?)-(?P<model>[a-z_]+)-(?:sgmcmc-batch-\d+-)?'
+    r'burnin-(?P<burnin>\d+)-samps-(?P<samples>\d+)-K-(?P<K>\d+)'
+    r'-seed-(?P<seed>\d+)(?:-a-(?P<a>[\d.]+))?(?:-alpha-[\d.]+)?'
+    r'(?:-eps-[\d.]+)?(?:-J0-(?P<J0>[\d.]+))?'
+    r'(?:-zeta-(?P<zeta>[\d.]+))?.*-samples\.h5$')
+# the data set of a synthetic experiment, e.g. 1-overdispersed-2.0
+VARIANT = re.compile(r'-seed-(\d+(?:-[a-z]+-[\d.]+)?)$')
+ZETA = re.compile(r'zeta-(\d+(?:\.\d+)?)')
+# columns compared with a tolerance
+TOLERANCE = 1e-6
+# columns that tell whether a file changed since it was indexed
+STAMP = dict(results=('size', 'mtime', 'checkpointed'),
+             figures=('size', 'mtime'))
+
+
+def _from_name(name):
+    row = {}
+    m = RESULT_NAME.match(name)
+    if m is None:
+        return row
+    for key, value in m.groupdict().items():
+        if value is None:
+            continue
+        if key in ('K', 'seed', 'burnin', 'samples'):
+            value = int(value)
+        elif key in ('a', 'J0', 'zeta'):
+            value = float(value)
+        row[key] = value
+    v = VARIANT.search(row['data'])
+    if v is not None:
+        row['variant'] = v.group(1)
+    elif row['data'].endswith('_original_counts'):
+        row['variant'] = 'original_counts'
+    return row
+
+
+def _from_group(g):
+    row = {}
+    params = dict(g['parameters'].attrs) if 'parameters' in g else {}
+    for key in ('a', 'J0', 'eps', 'alpha', 'zeta'):
+        if key in params:
+            row[key] = float(params[key])
+    for key in ('engine', 'seed', 'runtime'):
+        if key in g.attrs:
+            value = g.attrs[key]
+            row[key] = value.decode() if isinstance(value, bytes) else value
+    if h5io.LOADINGS in g:
+        row['K'], _, row['n_draws'] = g[h5io.LOADINGS].shape
+    stats = summary.read_summary(g)
+    if stats is not None and 'median' in stats.get(h5io.EXPECTED_LOADINGS, {}):
+        row['expected_K'] = int(np.sum(
+            stats[h5io.EXPECTED_LOADINGS]['median'][0] > CUTOFF))
+    for name, column in ((h5io.LOG_LIKELIHOOD, 'mean_log_likelihood'),
+                         (h5io.LOG_PRIOR, 'mean_log_prior')):
+        if name in g and g[name].size > 0:
+            row[column] = float(np.mean(g[name][()]))
+    row['complete'] = int('runtime' in g.attrs)
+    return row
+
+
+def _stamp(table, path, st):
+    stamp = (st.st_size, st.st_mtime)
+    if table == 'results':
+        # the samplers remove the checkpoint only after the samples file is
+        # in place
+        stamp += (int(os.path.exists(path + '.ckpt')),)
+    return stamp
+
+
+def _sql_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class Catalog(object):
+    def __init__(self, path=CATALOG):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.row_factory = sqlite3.Row
+        for table, columns, key in (('results', RESULT_COLUMNS, 'path, grp'),
+                                    ('figures', FIGURE_COLUMNS, 'path')):
+            old = [row[1] for row in self.db.execute(
+                'PRAGMA table_info({})'.format(table))]
+            if old and old != [c[0] for c in columns]:
+                # written by an older version; the files are read again
+                self.db.execute('DROP TABLE {}'.format(table))
+            self.db.execute('CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY '
+                            '({}))'.format(table, ', '.join(
+                                ' '.join(c) for c in columns), key))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, experiment_dirs):
+        """Index new and changed files; drop rows of files that are gone.
+        Returns the number of files read and removed."""
+        read = removed = 0
+        for exp_dir in experiment_dirs:
+            experiment = os.path.basename(os.path.normpath(exp_dir))
+            for table, sub, index in (('results', 'results', self._index_result),
+                                      ('figures', 'figures', self._index_figure)):
+                known = {row['path']: tuple(row[c] for c in STAMP[table])
+                         for row in self.db.execute(
+                             'SELECT path, {} FROM {} WHERE experiment = '
+                             '?'.format(', '.join(STAMP[table]), table),
+                             (experiment,))}
+                seen = set()
+                for root, _, files in os.walk(os.path.join(exp_dir, sub)):
+                    for name in files:
+                        if table == 'results' and not name.endswith('.h5'):
+                            continue
+                        path = os.path.normpath(os.path.join(root, name))
+                        st = os.stat(path)
+                        seen.add(path)
+                        if known.get(path) == _stamp(table, path, st):
+                            continue
+                        self.db.execute('DELETE FROM {} WHERE path = ?'.format(
+                            table), (path,))
+                        index(path, experiment, st)
+                        read += 1
+                for path in set(known) - seen:
+                    self.db.execute('DELETE FROM {} WHERE path = ?'.format(
+                        table), (path,))
+                    removed += 1
+            self.db.commit()
+        return read, removed
+
+    def _insert(self, table, row):
+        self.db.execute('INSERT INTO {} ({}) VALUES ({})'.format(
+            table, ', '.join(row), ', '.join('?' * len(row))),
+            [_sql_value(v) for v in row.values()])
+
+    def _index_result(self, path, experiment, st):
+        name = os.path.basename(path)
+        checkpointed = int(os.path.exists(path + '.ckpt'))
+        base = dict(path=path, experiment=experiment, name=name,
+                    size=st.st_size, mtime=st.st_mtime,
+                    checkpointed=checkpointed, complete=0)
+        base.update(_from_name(name))
+        rows = []
+        try:
+            with h5py.File(path, 'r') as f:
+                groups = [g for g in f if g.startswith('zeta-')]
+                if groups:
+                    rows = [dict(base, grp=g, **_from_group(f[g]))
+                            for g in groups]
+                else:
+                    rows = [dict(base, grp='', **_from_group(f))]
+        except (OSError, KeyError):
+            # being written, or not a samples file
+            rows = [dict(base, grp='')]
+        for row in rows:
+            if checkpointed:
+                # a checkpointed run that has not finished
+                row['complete'] = 0
+            self._insert('results', row)
+
+    def _index_figure(self, path, experiment, st):
+        name = os.path.basename(path)
+        zeta = ZETA.search(name)
+        self._insert('figures', dict(
+            path=path, experiment=experiment,
+            directory=os.path.dirname(path), name=name,
+            zeta=None if zeta is None else float(zeta.group(1)),
+            size=st.st_size, mtime=st.st_mtime))
+
+    def _query(self, table, where):
+        clauses = []
+        values = []
+        for key, value in where.items():
+            if isinstance(value, float):
+                clauses.append('ABS({} - ?) < {}'.format(key, TOLERANCE))
+            elif isinstance(value, str) and ('*' in value or '?' in value):
+                clauses.append('{} GLOB ?'.format(key))
+            else:
+                clauses.append('{} = ?'.format(key))
+                if key in ('path', 'directory'):
+                    value = os.path.normpath(value)
+            values.append(value)
+        sql = 'SELECT * FROM {}'.format(table)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return [dict(row) for row in self.db.execute(sql + ' ORDER BY path',
+                                                     values)]
+
+    def results(self, **where):
+        """Rows of ``results`` whose columns equal the given values.
+
+        Floats match within ``TOLERANCE``; strings with ``*`` or ``?`` are
+        glob patterns, e.g. ``results(experiment='liver-WS', zeta=.3,
+        name='*-seed-1-*')``.
+        """
+        return self._query('results', where)
+
+    def figures(self, **where):
+        """Rows of ``figures``, selected as by ``results``."""
+        return self._query('figures', where)
+
+    def paths(self, **where):
+        """Paths of the matching results; pass ``complete=1`` to leave out
+        runs that are still being written or were interrupted."""
+        return set(row['path'] for row in self.results(**where))
+
+
+def open_scanned(experiment_dir, path=None):
+    """The catalog at ``path`` (default: ``CATALOG``), brought up to date
+    with the experiment's files."""
+    catalog = Catalog(CATALOG if path is None else path)
+    catalog.scan([experiment_dir])
+    return catalog
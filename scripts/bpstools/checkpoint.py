@@ -0,0 +1,44 @@
+"""Checkpoints of in-progress NumPy sampler runs.
+
+A checkpoint holds the iteration reached, the current sampler state, the
+number of draws already streamed to the partial samples file, the generator
+state and the elapsed sampling time.  It is
+written to a temporary file and renamed into place so that a job killed at
+the walltime never leaves a truncated checkpoint behind.
+"""
+import os
+import json
+
+import numpy as np
+import h5py
+
+
+def checkpoint_path(samples_path):
+    return samples_path + '.ckpt'
+
+
+def save(path, iteration, state, n_draws, rng, elapsed):
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with h5py.File(tmp_path, 'w') as f:
+        f.attrs['iteration'] = iteration
+        f.attrs['elapsed'] = elapsed
+        f.attrs['rng_state'] = json.dumps(rng.bit_generator.state)
+        f.attrs['bit_generator'] = type(rng.bit_generator).__name__
+        f.attrs['n_draws'] = n_draws
+        g = f.create_group('state')
+        for name, value in state.items():
+            g.create_dataset(name, data=value)
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    """Return the iteration, state, number of draws, generator and elapsed
+    time."""
+    with h5py.File(path, 'r') as f:
+        iteration = int(f.attrs['iteration'])
+        elapsed = float(f.attrs['elapsed'])
+        bit_generator = getattr(np.random, f.attrs['bit_generator'])()
+        bit_generator.state = json.loads(f.attrs['rng_state'])
+        n_draws = int(f.attrs['n_draws'])
+        state = {name: f['state'][name][()] for name in f['state']}
+    return iteration, state, n_draws, np.random.Generator(bit_generator), elapsed
@@ -0,0 +1,114 @@
+"""MCMC convergence diagnostics on draws stored along the last axis."""
+import numpy as np
+from scipy.stats import norm, rankdata
+
+
+def autocorrelation(x):
+    """Autocorrelation of each series in ``x`` (draws along the last axis)."""
+    x = np.asarray(x, dtype=float)
+    n = x.shape[-1]
+    centered = x - x.mean(axis=-1, keepdims=True)
+    size = 2 ** int(np.ceil(np.log2(2 * n)))
+    f = np.fft.rfft(centered, n=size, axis=-1)
+    acov = np.fft.irfft(f * np.conjugate(f), n=size, axis=-1)[...,:n]
+    var = acov[...,:1]
+    var[var == 0] = 1.
+    return acov / var
+
+
+def effective_sample_size(x):
+    """ESS of each series in ``x`` using Geyer's initial monotone sequence."""
+    x = np.asarray(x, dtype=float)
+    n = x.shape[-1]
+    rho = autocorrelation(x).reshape(-1, n)
+    ess = np.empty(rho.shape[0])
+    for i, r in enumerate(rho):
+        pairs = r[:n - n % 2].reshape(-1, 2).sum(axis=1)
+        # truncate at the first negative pair and enforce monotonicity
+        negative = np.nonzero(pairs < 0)[0]
+        if negative.size > 0:
+            pairs = pairs[:negative[0]]
+        pairs = np.minimum.accumulate(pairs)
+        tau = -1. + 2. * pairs.sum()
+        ess[i] = n / max(tau, 1. / np.log10(max(n, 10)))
+    return ess.reshape(x.shape[:-1])
+
+
+def split_rhat(chains):
+    """Split R-hat of each series; ``chains`` has shape (M, ..., S)."""
+    chains = np.asarray(chains, dtype=float)
+    n = chains.shape[-1] // 2
+    halves = np.concatenate([chains[...,:n], chains[...,n:2*n]], axis=0)
+    within = halves.var(axis=-1, ddof=1).mean(axis=0)
+    between = n * halves.mean(axis=-1).var(axis=0, ddof=1)
+    var_plus = (n - 1) / n * within + between / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rhat = np.sqrt(var_plus / within)
+    return np.where(within > 0, rhat, 1.)
+
+
+def _split(chains):
+    n = chains.shape[-1] // 2
+    return np.concatenate([chains[...,:n], chains[...,n:2*n]], axis=0)
+
+
+def multichain_ess(chains):
+    """ESS of each series pooled over chains; ``chains`` has shape (M, ..., S).
+
+    Combines the within-chain autocorrelations with the between-chain
+    variance as in Vehtari et al. (2021), truncating Geyer's initial monotone
+    sequence.
+    """
+    chains = np.asarray(chains, dtype=float)
+    M, n = chains.shape[0], chains.shape[-1]
+    chains = chains.reshape(M, -1, n)
+    acov = autocorrelation(chains) * chains.var(axis=-1, keepdims=True)
+    within = chains.var(axis=-1, ddof=1).mean(axis=0)
+    var_plus = (n - 1) / n * within
+    if M > 1:
+        var_plus = var_plus + chains.mean(axis=-1).var(axis=0, ddof=1)
+    ess = np.empty(chains.shape[1])
+    for i in range(chains.shape[1]):
+        if var_plus[i] <= 0:
+            ess[i] = M * n
+            continue
+        rho = 1. - (within[i] - acov[:,i].mean(axis=0)) / var_plus[i]
+        rho[0] = 1.
+        pairs = rho[:n - n % 2].reshape(-1, 2).sum(axis=1)
+        negative = np.nonzero(pairs < 0)[0]
+        if negative.size > 0:
+            pairs = pairs[:negative[0]]
+        pairs = np.minimum.accumulate(pairs)
+        tau = -1. + 2. * pairs.sum()
+        ess[i] = M * n / max(tau, 1. / np.log10(max(M * n, 10)))
+    return ess
+
+
+def rank_normalize(chains):
+    """Normal scores of the ranks of each series, pooled over chains."""
+    chains = np.asarray(chains, dtype=float)
+    pooled = np.moveaxis(chains, 0, -2)
+    flat = pooled.reshape(pooled.shape[:-2] + (-1,))
+    ranks = rankdata(flat, axis=-1)
+    z = norm.ppf((ranks - 3. / 8) / (flat.shape[-1] + 1. / 4))
+    return np.moveaxis(z.reshape(pooled.shape), -2, 0)
+
+
+def bulk_ess(chains):
+    """Rank-normalized split ESS; ``chains`` has shape (M, ..., S)."""
+    chains = np.asarray(chains, dtype=float)
+    shape = chains.shape[1:-1]
+    return multichain_ess(rank_normalize(_split(chains))).reshape(shape)
+
+
+def tail_ess(chains):
+    """Minimum split ESS of the 5% and 95% quantile indicators."""
+    chains = np.asarray(chains, dtype=float)
+    shape = chains.shape[1:-1]
+    split = _split(chains)
+    pooled = np.moveaxis(split, 0, -2).reshape(shape + (-1,))
+    ess = []
+    for q in (.05, .95):
+        cut = np.quantile(pooled, q, axis=-1)[...,np.newaxis]
+        ess.append(multichain_ess(split <= cut).reshape(shape))
+    return np.minimum(*ess)
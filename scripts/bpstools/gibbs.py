@@ -0,0 +1,335 @@
+"""Blocked Gibbs sampler for the ``normalized`` power-posterior NMF model.
+
+Model (no count rescaling, i.e. ``no_rho=True``)::
+
+    mutsigs_k          ~ Dirichlet(alpha)                     k = 1..K
+    expected_loadings_k ~ InvGamma(a0, b0)
+    loadings_kj        ~ Gamma(a, a / expected_loadings_k)    j = 1..J
+    counts_ij          ~ Poisson(sum_k mutsigs_ki loadings_kj)   ^ zeta
+
+Each sweep draws the Poisson augmentation ``z_ijk`` (multinomial split of
+every nonzero count), then the loadings, signatures and ARD scales from their
+conjugate conditionals.  The power ``zeta`` enters as an exponent on the
+augmented counts, so the complete-data conditionals stay conjugate.  The
+split itself uses the untempered multinomial, so for zeta < 1 the sampler
+approximates rather than exactly targets p(theta) p(x | theta)^zeta.
+"""
+import os
+import time
+import concurrent.futures
+
+import numpy as np
+import scipy.sparse
+import h5py
+from scipy.special import gammaln
+
+from . import checkpoint, h5io, likelihood, pruning, stopping
+
+
+class PowerNMFGibbs(object):
+
+    def __init__(self, counts, K, a, alpha, a0, b0, zeta=1.0, threads=1):
+        # only the nonzero counts enter the sweeps and the likelihood
+        counts = likelihood.as_coo(counts)
+        self.counts = counts
+        self.I, self.J = counts.shape
+        self.K = K
+        self.a = a
+        self.alpha = alpha
+        self.a0 = a0
+        self.b0 = b0
+        self.zeta = zeta
+        rows, cols = counts.row, counts.col
+        self.rows = rows
+        self.cols = cols
+        self.vals = counts.data
+        self.total = self.vals.sum()
+        # indicator matrices used to sum the augmented counts over channels
+        # and over samples
+        ones = np.ones(rows.size)
+        nz = np.arange(rows.size)
+        self._by_channel = scipy.sparse.csr_matrix(
+            (ones, (rows, nz)), shape=(self.I, rows.size))
+        self._by_sample = scipy.sparse.csr_matrix(
+            (ones, (cols, nz)), shape=(self.J, rows.size))
+        self._log_factorial = gammaln(self.vals + 1).sum()
+        self.threads = threads
+        self._blocks = []
+        self._pool = None
+        if threads > 1:
+            # contiguous blocks of samples, each with its own nonzeros
+            for block in np.array_split(np.arange(self.J), threads):
+                nz = np.nonzero((cols >= block[0]) & (cols <= block[-1]))[0]
+                local = np.arange(nz.size)
+                self._blocks.append(dict(
+                    samples=slice(block[0], block[-1] + 1), rows=rows[nz],
+                    cols=cols[nz], vals=self.vals[nz],
+                    by_channel=scipy.sparse.csr_matrix(
+                        (np.ones(nz.size), (rows[nz], local)),
+                        shape=(self.I, nz.size)),
+                    by_sample=scipy.sparse.csr_matrix(
+                        (np.ones(nz.size), (cols[nz] - block[0], local)),
+                        shape=(block.size, nz.size))))
+
+    def close(self):
+        """Stop the threads of a multi-threaded sampler.  A later sweep
+        starts new ones."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def initialize(self, rng):
+        mu = np.full(self.K, self.total / (self.J * self.K))
+        return {
+            h5io.MUTSIGS: rng.dirichlet(np.ones(self.I), size=self.K),
+            h5io.LOADINGS: rng.gamma(self.a, mu[:,np.newaxis] / self.a,
+                                     size=(self.K, self.J)),
+            h5io.EXPECTED_LOADINGS: mu,
+        }
+
+    def sample_prior(self, rng):
+        mu = 1. / rng.gamma(self.a0, 1. / self.b0, size=self.K)
+        return {
+            h5io.MUTSIGS: rng.dirichlet(np.full(self.I, self.alpha), size=self.K),
+            h5io.LOADINGS: rng.gamma(self.a, mu[:,np.newaxis] / self.a,
+                                     size=(self.K, self.J)),
+            h5io.EXPECTED_LOADINGS: mu,
+        }
+
+    def augment(self, state, rng):
+        """Split each nonzero count across the K signatures."""
+        probs = (state[h5io.MUTSIGS][:,self.rows]
+                 * state[h5io.LOADINGS][:,self.cols]).T
+        probs /= probs.sum(axis=1, keepdims=True)
+        return rng.multinomial(self.vals, probs)
+
+    def _sweep_block(self, block, state, zeta, seed):
+        """Augmentation and loadings update for one block of samples."""
+        rng = np.random.default_rng(seed)
+        probs = (state[h5io.MUTSIGS][:,block['rows']]
+                 * state[h5io.LOADINGS][:,block['cols']]).T
+        probs /= probs.sum(axis=1, keepdims=True)
+        z = rng.multinomial(block['vals'], probs)
+        z_sample = np.asarray(block['by_sample'] @ z).T
+        mu = state[h5io.EXPECTED_LOADINGS]
+        loadings = rng.gamma(self.a + zeta * z_sample,
+                             1. / (self.a / mu[:,np.newaxis] + zeta))
+        return loadings, np.asarray(block['by_channel'] @ z).T
+
+    def sweep(self, state, rng, zeta=None):
+        zeta = self.zeta if zeta is None else zeta
+        mu = state[h5io.EXPECTED_LOADINGS]
+        if self.threads > 1:
+            # one generator per block, drawn from ``rng`` so that runs are
+            # reproducible for a given number of threads
+            seeds = rng.integers(2**63, size=len(self._blocks))
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(self.threads)
+            results = list(self._pool.map(
+                self._sweep_block, self._blocks,
+                [state] * len(self._blocks), [zeta] * len(self._blocks), seeds))
+            loadings = np.concatenate([l for l, _ in results], axis=1)
+            z_channel = sum(zc for _, zc in results)
+        else:
+            z = self.augment(state, rng)
+            z_sample = np.asarray(self._by_sample @ z).T    # K x J
+            z_channel = np.asarray(self._by_channel @ z).T  # K x I
+            # mutsigs rows sum to one, so the Poisson rate contributes zeta
+            loadings = rng.gamma(self.a + zeta * z_sample,
+                                 1. / (self.a / mu[:,np.newaxis] + zeta))
+        mutsigs = rng.gamma(self.alpha + zeta * z_channel)
+        mutsigs /= mutsigs.sum(axis=1, keepdims=True)
+        mu = 1. / rng.gamma(self.a0 + self.J * self.a,
+                            1. / (self.b0 + self.a * loadings.sum(axis=1)))
+        state[h5io.LOADINGS] = loadings
+        state[h5io.MUTSIGS] = mutsigs
+        state[h5io.EXPECTED_LOADINGS] = mu
+        return state
+
+    def log_prior(self, draws):
+        """Log prior density of stacked draws (draws along the last axis)."""
+        a, alpha, a0, b0 = self.a, self.alpha, self.a0, self.b0
+        theta = draws[h5io.LOADINGS]
+        r = draws[h5io.MUTSIGS]
+        mu = draws[h5io.EXPECTED_LOADINGS][0]
+        with np.errstate(divide='ignore'):
+            lp = self.J * np.sum(a * np.log(a / mu) - gammaln(a), axis=0)
+            lp += np.sum((a - 1) * np.log(theta) - a * theta / mu[:,np.newaxis],
+                         axis=(0, 1))
+            lp += (r.shape[0] * (gammaln(alpha * self.I)
+                                 - self.I * gammaln(alpha))
+                   + (alpha - 1) * np.log(r).sum(axis=(0, 1)))
+            lp += np.sum(a0 * np.log(b0) - gammaln(a0) - (a0 + 1) * np.log(mu)
+                         - b0 / mu, axis=0)
+        return lp
+
+    def draw_stats(self, draws):
+        """Per-draw statistics of stacked draws, keyed by ``h5io.STAT_NAMES``."""
+        per_sample = likelihood.log_likelihood(
+            self.counts, draws[h5io.LOADINGS], draws[h5io.MUTSIGS],
+            per_sample=True)
+        return {h5io.LOG_LIKELIHOOD: per_sample.sum(axis=0),
+                h5io.LOG_LIKELIHOOD_PER_SAMPLE: per_sample,
+                h5io.LOG_PRIOR: self.log_prior(draws)}
+
+    def log_likelihood(self, state):
+        rates = np.einsum('kn,kn->n', state[h5io.MUTSIGS][:,self.rows],
+                          state[h5io.LOADINGS][:,self.cols])
+        return (np.sum(self.vals * np.log(rates))
+                - state[h5io.LOADINGS].sum() - self._log_factorial)
+
+    def run(self, iters, warmup, thin=1, seed=1, state=None, verbose=True,
+            rng=None, draws=None, first=0, checkpoint=None,
+            checkpoint_every=0, monitor=None, pruner=None, profile=None):
+        """Run iterations ``first`` to ``iters`` and return the saved draws.
+
+        ``draws`` may be any object with an ``append`` method, such as an
+        ``h5io.DrawWriter``.  To continue an interrupted run pass the
+        ``state``, ``rng`` and ``draws`` it reached.  If ``checkpoint_every``
+        is positive, ``checkpoint(iteration, state, draws, rng)`` is called
+        every that many iterations.  A ``stopping.ConvergenceMonitor`` passed
+        as ``monitor`` ends sampling early once its targets are met, and a
+        ``pruning.ARDPruner`` drops dead components during warmup.  Warmup
+        and sampling time are added to ``profile``, a ``profiling.Profile``.
+        """
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        if state is None:
+            state = self.initialize(rng)
+        draws = [] if draws is None else draws
+        if profile is not None:
+            profile.push('warmup' if first < warmup else 'sampling')
+        for it in range(first, iters):
+            if profile is not None and it == warmup and it > first:
+                profile.pop()
+                profile.push('sampling')
+            if pruner is not None:
+                sweep_start = time.time()
+                self.sweep(state, rng)
+                pruner.record_time(time.time() - sweep_start)
+                if it < warmup:
+                    state = pruner.update(state, it + 1)
+            else:
+                self.sweep(state, rng)
+            if it >= warmup and (it - warmup) % thin == 0:
+                draws.append(pruner.pad(state) if pruner is not None
+                             else {k: v.copy() for k, v in state.items()})
+                if monitor is not None:
+                    monitor.record(state)
+            if verbose and (it + 1) % max(1, iters // 10) == 0:
+                print('iteration {}/{} log-likelihood {:.1f}'.format(
+                    it + 1, iters, self.log_likelihood(state)))
+            if checkpoint_every > 0 and (it + 1) % checkpoint_every == 0 \
+                    and it + 1 < iters:
+                checkpoint(it + 1, state if pruner is None
+                           else pruner.checkpoint_state(state), draws, rng)
+            if monitor is not None and it >= warmup \
+                    and (it + 1 - warmup) % monitor.check_every == 0 \
+                    and monitor.check(it + 1):
+                break
+        if profile is not None:
+            profile.pop()
+        if pruner is not None:
+            state = pruner.pad(state)
+        return draws, state
+
+
+def fit_model_and_save_results(counts, K, samples_path, J0, eps, alpha, a,
+                               a0, b0, lik_power=1.0, iters=2000, warmup=1000,
+                               thin=1, seed=1, init=None, init_from=None,
+                               checkpoint_every=0, resume=False,
+                               buffer_size=100, monitor=None,
+                               prune_threshold=None, prune_window=200,
+                               threads=1, sampler=None, engine='gibbs',
+                               attrs=None, profile=None):
+    """Gibbs counterpart of ``mutsigtools.models.fit_model_and_save_results``.
+
+    ``init`` is an optional starting state, e.g. from ``h5io.load_last_draw``.
+    Draws are streamed to ``samples_path + '.part'``, holding at most
+    ``buffer_size`` of them in memory, and the file is renamed once the run
+    is complete.  With ``checkpoint_every`` the run is checkpointed next to
+    ``samples_path``; with ``resume`` an existing checkpoint is picked up.
+    ``monitor`` is a function of the sampler returning a
+    ``stopping.ConvergenceMonitor``, for stopping once the chain has
+    converged; ``iters`` is then the cap on the number of iterations.
+    With ``prune_threshold`` components whose expected loading stays below
+    it for ``prune_window`` warmup iterations are dropped.  ``threads``
+    splits each sweep over that many blocks of samples.  Another
+    ``sampler`` with the same interface (e.g. ``sgmcmc.PowerNMFSGRLD``) can
+    be run in place of the Gibbs sampler, recorded as ``engine``, with extra
+    ``attrs`` for the samples file.  Time spent in each phase is added to
+    ``profile``.
+    """
+    if sampler is None:
+        if profile is not None:
+            profile.push('build')
+        sampler = PowerNMFGibbs(counts, K, a=a, alpha=alpha, a0=a0, b0=b0,
+                                zeta=lik_power, threads=threads)
+        if profile is not None:
+            profile.pop()
+    if monitor is not None:
+        monitor = monitor(sampler)
+    pruner = None
+    if prune_threshold is not None:
+        pruner = pruning.ARDPruner(K, prune_threshold, window=prune_window)
+    ckpt_path = checkpoint.checkpoint_path(samples_path)
+    part_path = samples_path + '.part'
+    state = None if init is None else dict(init)
+    rng = None
+    first = n_draws = 0
+    elapsed = 0.
+    if resume and os.path.exists(ckpt_path) and os.path.exists(part_path):
+        first, state, n_draws, rng, elapsed = checkpoint.load(ckpt_path)
+        print('resuming from iteration {} of {}'.format(first, ckpt_path))
+        saved = {key: state.pop(key) for key in pruning.STATE_KEYS
+                 if key in state}
+        if pruner is not None and pruning.ACTIVE in saved:
+            state = pruner.restore(state, **saved)
+    start = time.time() - elapsed
+
+    # leaving the block also stops the sampler's threads
+    with sampler, h5py.File(part_path, 'a' if first > 0 else 'w') as f:
+        writer = h5io.DrawWriter(f, buffer_size=buffer_size,
+                                 n_existing=n_draws, stats=sampler.draw_stats,
+                                 profile=profile)
+        if monitor is not None:
+            monitor.replay(f)
+
+        def save_checkpoint(it, state, draws, rng):
+            draws.flush()
+            if profile is not None:
+                profile.push('write')
+            checkpoint.save(ckpt_path, it, state, len(draws), rng,
+                            time.time() - start)
+            if profile is not None:
+                profile.pop()
+
+        sampler.run(iters, warmup, thin=thin, seed=seed, state=state, rng=rng,
+                    draws=writer, first=first, checkpoint=save_checkpoint,
+                    checkpoint_every=checkpoint_every, monitor=monitor,
+                    pruner=pruner, profile=profile)
+        runtime = time.time() - start
+        parameters = dict(a=a, alpha=alpha, a0=a0, b0=b0, zeta=lik_power,
+                          eps=eps, J0=J0)
+        attrs = dict(attrs or {}, engine=engine, seed=seed, warmup=warmup,
+                     threads=threads)
+        if init_from is not None:
+            attrs['init_from'] = init_from
+        if monitor is not None:
+            if monitor.reason != stopping.CONVERGED:
+                monitor.check(iters)
+            attrs.update(monitor.attrs())
+        if pruner is not None:
+            pruner.report()
+            attrs.update(pruner.attrs())
+        writer.close(parameters, runtime, attrs=attrs)
+    os.replace(part_path, samples_path)
+    if os.path.exists(ckpt_path):
+        os.remove(ckpt_path)
+    return runtime
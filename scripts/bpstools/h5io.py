@@ -0,0 +1,249 @@
+"""Reading and writing posterior samples files.
+
+The layout matches what ``mutsigtools.models.fit_model_and_save_results``
+produces and ``mutsigtools.analysis.load_samples_h5_file`` reads: one dataset
+per parameter with the draws along the last axis, the model hyperparameters
+in the ``parameters`` group and the total sampling time in the ``runtime``
+attribute.  Files written here also carry a ``summary`` group (see
+``bpstools.summary``), so means and quantiles can be read without the draws,
+and, when the sampler provides them, the log-likelihood and log-prior of
+each draw.
+"""
+import numpy as np
+import h5py
+
+from . import summary
+
+
+LOADINGS = 'loadings'                    # K x J x S
+MUTSIGS = 'mutsigs'                      # K x I x S
+EXPECTED_LOADINGS = 'expected_loadings'  # 1 x K x S
+DRAW_NAMES = (LOADINGS, MUTSIGS, EXPECTED_LOADINGS)
+
+# per-draw statistics
+LOG_LIKELIHOOD = 'log_likelihood'                        # S
+LOG_LIKELIHOOD_PER_SAMPLE = 'log_likelihood_per_sample'  # J x S
+LOG_PRIOR = 'log_prior'                                  # S
+STAT_NAMES = (LOG_LIKELIHOOD, LOG_LIKELIHOOD_PER_SAMPLE, LOG_PRIOR)
+
+# parameter names in the Stan programs (``theta`` as in models.infer_loadings)
+STAN_NAMES = {LOADINGS: 'theta', MUTSIGS: 'r', EXPECTED_LOADINGS: 'mu'}
+
+
+def stack_draws(draws):
+    """Stack a list of sampler states into arrays with draws along the last axis."""
+    return {
+        LOADINGS: np.stack([d[LOADINGS] for d in draws], axis=-1),
+        MUTSIGS: np.stack([d[MUTSIGS] for d in draws], axis=-1),
+        EXPECTED_LOADINGS: np.stack([d[EXPECTED_LOADINGS][np.newaxis]
+                                     for d in draws], axis=-1),
+    }
+
+
+def write_samples(group, draws, parameters, runtime, attrs=None):
+    """Write draws into an open HDF5 file or group.
+
+    Draws missing from ``draws`` are left alone, e.g. when they were
+    streamed with a ``DrawWriter``; otherwise their summary is written too.
+    ``draws`` may also hold the per-draw statistics in ``STAT_NAMES``.
+    """
+    for name in DRAW_NAMES + STAT_NAMES:
+        if name in draws:
+            group.create_dataset(name, data=draws[name])
+    if all(name in draws for name in DRAW_NAMES):
+        summary.write_summary(
+            group, summary.exact_stats({name: draws[name]
+                                        for name in DRAW_NAMES}),
+            draws[LOADINGS].shape[-1])
+    params = group.require_group('parameters')
+    for key, value in parameters.items():
+        params.attrs[key] = value
+    group.attrs['runtime'] = runtime
+    for key, value in (attrs or {}).items():
+        group.attrs[key] = value
+
+
+def save_samples(samples_path, draws, parameters, runtime, attrs=None):
+    with h5py.File(samples_path, 'w') as f:
+        write_samples(f, draws, parameters, runtime, attrs)
+
+
+def add_summary(samples_path):
+    """Add the summary group to a samples file written elsewhere (e.g. by
+    ``mutsigtools``)."""
+    with h5py.File(samples_path, 'a') as f:
+        draws = {name: f[name][()] for name in DRAW_NAMES}
+        summary.write_summary(f, summary.exact_stats(draws),
+                              draws[LOADINGS].shape[-1])
+
+
+def add_draw_stats(samples_path, stats):
+    """Add per-draw statistics to a samples file written elsewhere.
+
+    ``stats`` maps the stacked draws to a dict of arrays, as
+    ``gibbs.PowerNMFGibbs.draw_stats`` does.
+    """
+    with h5py.File(samples_path, 'a') as f:
+        draws = {name: f[name][()] for name in DRAW_NAMES}
+        for name, values in stats(draws).items():
+            if name in f:
+                del f[name]
+            f.create_dataset(name, data=values)
+
+
+def load_draw_stats(samples_path, group=None):
+    """Return the per-draw statistics of a samples file, or None if it has
+    none.  ``group`` is as for ``load_draws``."""
+    with h5py.File(samples_path, 'r') as f:
+        g = f if group is None else f[group]
+        stats = {name: g[name][()] for name in STAT_NAMES if name in g}
+    return stats or None
+
+
+def load_summary(samples_path, group=None):
+    """Return the summaries of a samples file, or None if it has none.
+
+    ``group`` is as for ``load_draws``.
+    """
+    with h5py.File(samples_path, 'r') as f:
+        return summary.read_summary(f if group is None else f[group])
+
+
+class DrawWriter(object):
+    """Append draws to chunked, compressed datasets as they are produced.
+
+    At most ``buffer_size`` draws are held in memory; the datasets are chunked
+    along the draw axis in blocks of that size.  Opening a group that already
+    holds draws (e.g. when resuming) keeps the first ``n_existing`` of them.
+    Running summaries of every draw written are added on ``close``.  If given,
+    ``stats`` maps a block of stacked draws to per-draw statistics (see
+    ``STAT_NAMES``), which are stored alongside the draws.  Time spent
+    writing is added to the ``write`` phase of ``profile``.
+    """
+    def __init__(self, group, buffer_size=100, compression='gzip',
+                 n_existing=0, stats=None, profile=None):
+        self.group = group
+        self.stats = stats
+        self.profile = profile
+        self.buffer_size = max(1, buffer_size)
+        self.compression = compression
+        self.n_written = n_existing
+        self.buffer = []
+        self.summary = summary.RunningSummary()
+        for name in DRAW_NAMES + STAT_NAMES:
+            if name in group:
+                group[name].resize(n_existing, axis=group[name].ndim - 1)
+        # replay the kept draws so the summaries match an uninterrupted run
+        for start in range(0, n_existing, self.buffer_size):
+            block = {name: group[name][...,start:start+self.buffer_size]
+                     for name in DRAW_NAMES}
+            for i in range(block[LOADINGS].shape[-1]):
+                self.summary.update({name: block[name][...,i]
+                                     for name in DRAW_NAMES})
+
+    def __len__(self):
+        return self.n_written + len(self.buffer)
+
+    def append(self, draw):
+        self.buffer.append(draw)
+        self.summary.update({LOADINGS: draw[LOADINGS], MUTSIGS: draw[MUTSIGS],
+                             EXPECTED_LOADINGS: draw[EXPECTED_LOADINGS][
+                                 np.newaxis]})
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, draws):
+        for draw in draws:
+            self.append(draw)
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        if self.profile is not None:
+            self.profile.push('write')
+        stacked = stack_draws(self.buffer)
+        if self.stats is not None:
+            stacked.update(self.stats(stacked))
+        n = len(self.buffer)
+        for name, data in stacked.items():
+            if name not in self.group:
+                self.group.create_dataset(
+                    name, shape=data.shape[:-1] + (0,),
+                    maxshape=data.shape[:-1] + (None,),
+                    chunks=data.shape[:-1] + (self.buffer_size,),
+                    dtype=data.dtype, compression=self.compression,
+                    shuffle=self.compression is not None)
+            dset = self.group[name]
+            dset.resize(self.n_written + n, axis=dset.ndim - 1)
+            dset[...,self.n_written:] = data
+        self.n_written += n
+        self.buffer = []
+        self.group.file.flush()
+        if self.profile is not None:
+            self.profile.pop()
+
+    def close(self, parameters, runtime, attrs=None):
+        """Flush the remaining draws and record the run's metadata."""
+        self.flush()
+        if self.profile is not None:
+            self.profile.push('write')
+        summary.write_summary(self.group, self.summary.stats(), len(self))
+        write_samples(self.group, {}, parameters, runtime, attrs)
+        if self.profile is not None:
+            self.profile.pop()
+
+
+def zeta_group_name(zeta):
+    """Group holding the draws for one power in multi-zeta samples files."""
+    return 'zeta-{:.3f}'.format(zeta)
+
+
+def load_draws(samples_path, group=None):
+    """Return the draws, parameters and attributes of a samples file.
+
+    ``group`` selects one power of a multi-zeta file, e.g.
+    ``zeta_group_name(0.1)``.
+    """
+    with h5py.File(samples_path, 'r') as f:
+        g = f if group is None else f[group]
+        draws = {name: g[name][()] for name in DRAW_NAMES}
+        parameters = dict(g['parameters'].attrs) if 'parameters' in g else {}
+        attrs = dict(g.attrs)
+    return draws, parameters, attrs
+
+
+def save_adaptation(samples_path, stepsize, inv_metric):
+    """Record the NUTS adaptation of a run for ``load_last_draw``."""
+    with h5py.File(samples_path, 'a') as f:
+        f.attrs['stepsize'] = stepsize
+        if 'inv_metric' in f:
+            del f['inv_metric']
+        f.create_dataset('inv_metric', data=inv_metric)
+
+
+def load_last_draw(samples_path):
+    """Return the final draw of a samples file as a sampler state.
+
+    Also returns the NUTS adaptation (``stepsize`` attribute and
+    ``inv_metric`` dataset, see ``save_adaptation``) when the file records
+    it, in the form expected by the ``control`` argument of pystan's
+    ``sampling``.
+    """
+    adaptation = {}
+    with h5py.File(samples_path, 'r') as f:
+        state = {
+            LOADINGS: f[LOADINGS][...,-1],
+            MUTSIGS: f[MUTSIGS][...,-1],
+            EXPECTED_LOADINGS: f[EXPECTED_LOADINGS][0,:,-1],
+        }
+        if 'stepsize' in f.attrs:
+            adaptation['stepsize'] = float(f.attrs['stepsize'])
+        if 'inv_metric' in f:
+            adaptation['inv_metric'] = f['inv_metric'][()]
+    return state, adaptation
+
+
+def stan_init(state):
+    """Convert a sampler state into a pystan ``init`` dictionary."""
+    return {STAN_NAMES[name]: np.asarray(value)
+            for name, value in state.items()}
@@ -0,0 +1,83 @@
+"""Poisson log-likelihood of a count matrix, evaluated over its nonzeros.
+
+With rates ``rate_ij = sum_k mutsigs_ki loadings_kj`` the log-likelihood is
+
+    sum_{ij: x_ij > 0} [x_ij log(rate_ij) - log(x_ij!)] - sum_ij rate_ij
+
+and the last term is ``sum_k (sum_i mutsigs_ki) (sum_j loadings_kj)``, which
+does not depend on the counts.  The rates, their logarithms and the count
+terms are evaluated at the nonzero cells only, so the dense I x J rate
+matrix is never formed.  Counts may be dense arrays or any ``scipy.sparse``
+matrix.
+"""
+import numpy as np
+import scipy.sparse
+import pandas
+from scipy.special import gammaln, xlogy
+
+
+def as_coo(counts):
+    """COO matrix of integer counts without explicit zeros."""
+    if scipy.sparse.issparse(counts):
+        counts = counts.tocoo(copy=True)
+        counts.sum_duplicates()
+        counts.eliminate_zeros()
+    else:
+        counts = scipy.sparse.coo_matrix(np.asarray(counts))
+    return counts.astype(np.int64)
+
+
+def read_counts(path):
+    """Read a channels x samples counts table as a COO matrix.
+
+    Also returns the channel and sample names.
+    """
+    data = pandas.read_csv(path, sep='\t')
+    return (as_coo(data.iloc[:,1:].values), data.iloc[:,0].values,
+            data.columns[1:].values)
+
+
+def log_likelihood(counts, loadings, mutsigs, per_sample=False,
+                   batch_size=100):
+    """Log-likelihood of each draw.
+
+    ``loadings`` is K x J x S and ``mutsigs`` K x I x S (or K x J and K x I
+    for a single draw).  Returns an array of length S, or J x S with
+    ``per_sample``.
+    """
+    counts = as_coo(counts)
+    single = np.ndim(loadings) == 2
+    if single:
+        loadings = loadings[...,np.newaxis]
+        mutsigs = mutsigs[...,np.newaxis]
+    rows, cols, vals = counts.row, counts.col, counts.data
+    n_samples = counts.shape[1]
+    log_factorial = gammaln(vals + 1)
+    S = loadings.shape[-1]
+    out = np.empty((n_samples, S) if per_sample else S)
+    for s0 in range(0, S, batch_size):
+        theta = loadings[...,s0:s0+batch_size]
+        r = mutsigs[...,s0:s0+batch_size]
+        # rates at the nonzero cells only, as in PowerNMFGibbs.log_likelihood;
+        # one draw at a time keeps the gathered factors at K x nnz
+        rates = np.array([np.einsum('kn,kn->n', r[:,rows,s], theta[:,cols,s])
+                          for s in range(theta.shape[-1])])
+        data_term = vals * np.log(rates) - log_factorial
+        # rate term for every cell, zero or not
+        rate_term = np.einsum('ks,kjs->sj', r.sum(axis=1), theta)
+        if per_sample:
+            data_sum = np.zeros((theta.shape[-1], n_samples))
+            np.add.at(data_sum.T, cols, data_term.T)
+            out[:,s0:s0+batch_size] = (data_sum - rate_term).T
+        else:
+            out[s0:s0+batch_size] = data_term.sum(axis=1) - rate_term.sum(axis=1)
+    return out[...,0] if single else out
+
+
+def dense_log_likelihood(counts, loadings, mutsigs):
+    """Reference evaluation over every cell of the count matrix."""
+    counts = np.asarray(counts.todense() if scipy.sparse.issparse(counts)
+                        else counts)
+    rates = np.einsum('kis,kjs->ijs', mutsigs, loadings)
+    return np.sum(xlogy(counts[...,np.newaxis], rates) - rates
+                  - gammaln(counts + 1)[...,np.newaxis], axis=(0, 1))
@@ -0,0 +1,126 @@
+"""Run a graph of jobs on this machine instead of submitting them.
+
+This is the local counterpart of ``sbatch``/``qsub`` for the experiment
+scripts.  Each ``Job`` is one command, usually one of the generated
+``experiment_scripts/*.sh`` files run with ``bash``.  At most ``workers``
+commands run at once.  A job starts once every job it depends on has
+succeeded.  A job whose outputs all exist already is skipped, which is the
+same checkpoint the submit scripts use.  Jobs that depend on a failed job are
+not run.
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+import concurrent.futures
+
+
+OK = 'ok'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+
+class Job(object):
+    """A command with its dependencies (job names) and output files.
+
+    ``env`` is added to the environment of the command.  The command's output
+    goes to ``log + '.out'`` and ``log + '.err'`` if ``log`` is given.
+    """
+    def __init__(self, name, cmd, deps=(), outputs=(), env=None, log=None):
+        self.name = name
+        self.cmd = [str(c) for c in cmd]
+        self.deps = list(deps)
+        self.outputs = list(outputs)
+        self.env = env or {}
+        self.log = log
+
+    def done(self):
+        return (len(self.outputs) > 0
+                and all(os.path.exists(path) for path in self.outputs))
+
+
+def save_jobs(path, jobs):
+    """Write jobs to a JSON file, e.g. for ``run-jobs.py`` on another node."""
+    with open(path, 'w') as f:
+        json.dump([dict(name=job.name, cmd=job.cmd, deps=job.deps,
+                        outputs=job.outputs, env=job.env, log=job.log)
+                   for job in jobs], f, indent=1)
+
+
+def load_jobs(path):
+    with open(path) as f:
+        return [Job(**job) for job in json.load(f)]
+
+
+def _run(job):
+    env = dict(os.environ, **{k: str(v) for k, v in job.env.items()})
+    if job.log is None:
+        return subprocess.run(job.cmd, env=env).returncode
+    os.makedirs(os.path.dirname(job.log) or '.', exist_ok=True)
+    with open(job.log + '.out', 'w') as out, open(job.log + '.err', 'w') as err:
+        return subprocess.run(job.cmd, env=env, stdout=out,
+                              stderr=err).returncode
+
+
+def run_jobs(jobs, workers=1):
+    """Run ``jobs`` and return a dict of job name to status (``OK``,
+    ``SKIPPED``, ``FAILED`` or ``BLOCKED`` by a failed dependency)."""
+    names = set(job.name for job in jobs)
+    for job in jobs:
+        unknown = [d for d in job.deps if d not in names]
+        if unknown:
+            raise ValueError('job {} depends on unknown jobs {}'.format(
+                job.name, ' '.join(unknown)))
+    status = {}
+    pending = list(jobs)
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as pool:
+        while pending or running:
+            # starting a job can finish it at once when it is skipped, which
+            # may in turn make other jobs ready
+            changed = True
+            while changed:
+                changed = False
+                for job in list(pending):
+                    deps = [status.get(d) for d in job.deps]
+                    if any(s in (FAILED, BLOCKED) for s in deps):
+                        status[job.name] = BLOCKED
+                        print('not running {}: a dependency failed'.format(
+                            job.name))
+                    elif all(s in (OK, SKIPPED) for s in deps):
+                        if job.done():
+                            status[job.name] = SKIPPED
+                            print('already completed:', job.name)
+                        else:
+                            print('starting {}: {}'.format(
+                                job.name, ' '.join(job.cmd)))
+                            running[pool.submit(_run, job)] = (job,
+                                                               time.time())
+                    else:
+                        continue
+                    pending.remove(job)
+                    changed = True
+            sys.stdout.flush()
+            if not running:
+                if pending:
+                    raise ValueError('circular dependencies between jobs {}'
+                                     .format(' '.join(j.name for j in pending)))
+                break
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                job, start = running.pop(future)
+                returncode = future.result()
+                status[job.name] = OK if returncode == 0 else FAILED
+                print('{} {} after {:.0f}s{}'.format(
+                    'finished' if returncode == 0 else 'FAILED', job.name,
+                    time.time() - start,
+                    '' if returncode == 0 else
+                    ' (exit status {})'.format(returncode)))
+    return status
+
+
+def failed(status):
+    return sorted(name for name, s in status.items() if s in (FAILED, BLOCKED))
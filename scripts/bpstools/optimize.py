@@ -0,0 +1,174 @@
+"""Point estimates of the power posterior of the ``normalized`` model.
+
+Both methods use the same Poisson augmentation as the Gibbs sampler, with the
+expected split of each count in place of a random one.
+
+``map`` is EM for the posterior mode in unconstrained coordinates (log
+loadings, log expected loadings and softmax signatures), where the mode
+exists even for ``a`` and ``alpha`` below one.  ``advi`` is mean-field
+variational inference with Gamma, Dirichlet and inverse-gamma factors, fitted
+by closed-form coordinate ascent; the estimate is the variational mean.
+
+Restarts from random initializations run in parallel, and the one with the
+highest log posterior (in the same coordinates) is kept for each zeta.
+"""
+import time
+import multiprocessing
+
+import numpy as np
+from scipy.special import digamma, gammaln
+
+from . import gibbs, h5io
+
+
+METHODS = ('map', 'advi')
+# iterations between checks of the relative change in the log posterior
+CHECK_EVERY = 10
+
+_model = None
+
+
+def _init_worker(counts, K, a, alpha, a0, b0):
+    global _model
+    _model = gibbs.PowerNMFGibbs(counts, K, a=a, alpha=alpha, a0=a0, b0=b0)
+
+
+def _expected_split(model, log_mutsigs, log_loadings):
+    """Expected augmented counts summed over samples and over channels."""
+    logits = (log_mutsigs[:,model.rows] + log_loadings[:,model.cols]).T
+    logits -= logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    z = probs * (model.vals / probs.sum(axis=1))[:,np.newaxis]
+    return (np.asarray(model._by_sample @ z).T,
+            np.asarray(model._by_channel @ z).T)
+
+
+def log_posterior(model, state, zeta):
+    """Unnormalized log power posterior in unconstrained coordinates."""
+    a, alpha, a0, b0 = model.a, model.alpha, model.a0, model.b0
+    theta = state[h5io.LOADINGS]
+    r = state[h5io.MUTSIGS]
+    mu = state[h5io.EXPECTED_LOADINGS]
+    with np.errstate(divide='ignore'):
+        lp = zeta * model.log_likelihood(state)
+        lp += np.sum(a * np.log(a / mu[:,np.newaxis]) - gammaln(a)
+                     + a * np.log(theta) - a * theta / mu[:,np.newaxis])
+        lp += np.sum(gammaln(alpha * model.I) - model.I * gammaln(alpha)
+                     + alpha * np.log(r).sum(axis=1))
+        lp += np.sum(a0 * np.log(b0) - gammaln(a0) - a0 * np.log(mu) - b0 / mu)
+    return lp
+
+
+def fit_map(model, state, zeta, max_iter=5000, tol=1e-6):
+    J = model.J
+    lp = -np.inf
+    for it in range(max_iter):
+        z_sample, z_channel = _expected_split(
+            model, np.log(state[h5io.MUTSIGS]), np.log(state[h5io.LOADINGS]))
+        mu = state[h5io.EXPECTED_LOADINGS]
+        loadings = ((model.a + zeta * z_sample)
+                    / (model.a / mu[:,np.newaxis] + zeta))
+        mutsigs = model.alpha + zeta * z_channel
+        mutsigs /= mutsigs.sum(axis=1, keepdims=True)
+        mu = ((model.b0 + model.a * loadings.sum(axis=1))
+              / (model.a0 + J * model.a))
+        state = {h5io.LOADINGS: loadings, h5io.MUTSIGS: mutsigs,
+                 h5io.EXPECTED_LOADINGS: mu}
+        if (it + 1) % CHECK_EVERY == 0:
+            lp, old_lp = log_posterior(model, state, zeta), lp
+            if abs(lp - old_lp) < tol * abs(lp):
+                break
+    return state, it + 1
+
+
+def fit_advi(model, state, zeta, max_iter=5000, tol=1e-6):
+    J = model.J
+    log_mutsigs = np.log(state[h5io.MUTSIGS])
+    log_loadings = np.log(state[h5io.LOADINGS])
+    inv_mu = 1. / state[h5io.EXPECTED_LOADINGS]
+    lp = -np.inf
+    for it in range(max_iter):
+        z_sample, z_channel = _expected_split(model, log_mutsigs, log_loadings)
+        shape = model.a + zeta * z_sample
+        rate = model.a * inv_mu[:,np.newaxis] + zeta
+        log_loadings = digamma(shape) - np.log(rate)
+        concentration = model.alpha + zeta * z_channel
+        log_mutsigs = (digamma(concentration)
+                       - digamma(concentration.sum(axis=1, keepdims=True)))
+        mu_shape = model.a0 + J * model.a
+        mu_scale = model.b0 + model.a * (shape / rate).sum(axis=1)
+        inv_mu = mu_shape / mu_scale
+        state = {
+            h5io.LOADINGS: shape / rate,
+            h5io.MUTSIGS: concentration / concentration.sum(axis=1,
+                                                            keepdims=True),
+            h5io.EXPECTED_LOADINGS: mu_scale / (mu_shape - 1),
+        }
+        if (it + 1) % CHECK_EVERY == 0:
+            lp, old_lp = log_posterior(model, state, zeta), lp
+            if abs(lp - old_lp) < tol * abs(lp):
+                break
+    return state, it + 1
+
+
+def _restart(job):
+    method, zeta, max_iter, tol, seed = job
+    rng = np.random.default_rng(seed)
+    fit = fit_map if method == 'map' else fit_advi
+    state, iters = fit(_model, _model.initialize(rng), zeta, max_iter=max_iter,
+                       tol=tol)
+    return (zeta, state, iters, log_posterior(_model, state, zeta),
+            _model.log_likelihood(state))
+
+
+def run_restarts(counts, K, zetas, a, alpha, a0, b0, method='map', restarts=8,
+                 max_iter=5000, tol=1e-6, seed=1, processes=None):
+    """Return, for each zeta, the best restart's state and its summary."""
+    seeds = np.random.SeedSequence(seed).spawn(restarts)
+    jobs = [(method, zeta, max_iter, tol, s) for zeta in zetas for s in seeds]
+    _init_worker(counts, K, a, alpha, a0, b0)
+    processes = processes or min(len(jobs), multiprocessing.cpu_count())
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(counts, K, a, alpha, a0, b0)) as pool:
+        results = pool.map(_restart, jobs)
+    best = {}
+    for zeta in zetas:
+        fits = [r for r in results if r[0] == zeta]
+        lps = np.array([r[3] for r in fits])
+        _, state, iters, lp, ll = fits[int(np.argmax(lps))]
+        best[zeta] = (state, dict(iterations=iters, log_posterior=lp,
+                                  log_likelihood=ll, restart_log_posteriors=lps))
+    return best
+
+
+def fit_model_and_save_results(counts, K, samples_paths, J0, eps, alpha, a, a0,
+                               b0, zetas, method='map', restarts=8,
+                               max_iter=5000, tol=1e-6, seed=1, processes=None,
+                               cutoff=1):
+    """Fit every zeta and write each estimate as a single-draw samples file.
+
+    The files can be passed to ``infer-mutsigs.py --init-from``.  ``K_estimate``
+    counts the expected loadings above ``cutoff``.
+    """
+    start = time.time()
+    best = run_restarts(counts, K, zetas, a=a, alpha=alpha, a0=a0, b0=b0,
+                        method=method, restarts=restarts, max_iter=max_iter,
+                        tol=tol, seed=seed, processes=processes)
+    runtime = time.time() - start
+    model = gibbs.PowerNMFGibbs(counts, K, a=a, alpha=alpha, a0=a0, b0=b0)
+    for zeta, samples_path in zip(zetas, samples_paths):
+        state, summary = best[zeta]
+        parameters = dict(a=a, alpha=alpha, a0=a0, b0=b0, zeta=zeta, eps=eps,
+                          J0=J0)
+        K_estimate = int(np.sum(state[h5io.EXPECTED_LOADINGS] > cutoff))
+        attrs = dict(engine=method, seed=seed, restarts=restarts,
+                     K_estimate=K_estimate)
+        attrs.update(summary)
+        draws = h5io.stack_draws([state])
+        draws.update(model.draw_stats(draws))
+        h5io.save_samples(samples_path, draws, parameters, runtime,
+                          attrs=attrs)
+        print('zeta {:.3f} K {} log posterior {:.1f} ({} iterations)'.format(
+            zeta, K_estimate, summary['log_posterior'],
+            summary['iterations']))
+    return runtime
@@ -0,0 +1,254 @@
+"""Re-run only the parts of an experiment that a change affects.
+
+An experiment is a graph of ``Task``s.  Each task runs one of the generated
+``experiment_scripts/*.sh`` files.  A task's key hashes:
+
+* the script's commands and variable settings, which are where the
+  ``bps.ini`` values end up;
+* its arguments;
+* the contents of its external input files (e.g. the counts table);
+* the keys of the tasks it depends on.
+
+Scheduler directives and environment setup are left out of the hash, so
+new resource estimates or a different backend do not invalidate results.
+The key of every task that ran is kept in a state file.  A task is run again
+if its key differs from the recorded one or if any of its outputs is missing,
+unless its slurm job is still pending or running.
+Changing a config value therefore re-runs exactly the tasks whose scripts
+use it, and the tasks downstream of those.  Outputs of a stale task are
+moved aside to ``*.stale`` first, so checks that skip existing results
+(e.g. ``infer-mutsigs.py --resume``) do not keep the old ones.
+"""
+import os
+import json
+import getpass
+import hashlib
+import subprocess
+
+from . import localrun
+
+
+# lines of the generated scripts that do not change what a task computes
+SETUP_PREFIXES = ('#', 'module ', 'eval ', 'conda ', 'echo ')
+
+
+class Task(object):
+    """One run of ``script``.  ``deps`` are task names, ``inputs`` files not
+    produced by any task, and ``array_index`` the array task id the script
+    reads (e.g. the seed of ``run_nmf.sh``)."""
+    def __init__(self, name, script, args=(), deps=(), inputs=(), outputs=(),
+                 array_index=None):
+        self.name = name
+        self.script = script
+        self.args = [str(a) for a in args]
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.array_index = array_index
+
+
+def script_commands(path):
+    with open(path) as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.strip().startswith(SETUP_PREFIXES)]
+
+
+class State(object):
+    """Task keys, slurm job ids and cached input file hashes, stored as
+    JSON."""
+    def __init__(self, path):
+        self.path = path
+        self.keys = {}
+        self.jobs = {}
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.keys = state.get('keys', {})
+            self.jobs = state.get('jobs', {})
+            self.files = state.get('files', {})
+
+    def file_hash(self, path):
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        cached = self.files.get(path)
+        if cached is not None and cached[:2] == stamp:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.files[path] = stamp + [h.hexdigest()]
+        return h.hexdigest()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(keys=self.keys, jobs=self.jobs, files=self.files),
+                      f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def _ordered(tasks):
+    """Tasks in dependency order."""
+    by_name = {task.name: task for task in tasks}
+    order = []
+    visiting = set()
+    done = set()
+
+    def visit(task):
+        if task.name in done:
+            return
+        if task.name in visiting:
+            raise ValueError('circular dependency at task ' + task.name)
+        visiting.add(task.name)
+        for dep in task.deps:
+            if dep not in by_name:
+                raise ValueError('task {} depends on unknown task {}'.format(
+                    task.name, dep))
+            visit(by_name[dep])
+        visiting.discard(task.name)
+        done.add(task.name)
+        order.append(task)
+
+    for task in tasks:
+        visit(task)
+    return order
+
+
+def task_keys(tasks, state):
+    keys = {}
+    for task in _ordered(tasks):
+        inputs = [(path, state.file_hash(path) if os.path.exists(path)
+                   else None) for path in task.inputs]
+        content = [script_commands(task.script), task.args, task.array_index,
+                   inputs, [keys[dep] for dep in task.deps]]
+        keys[task.name] = hashlib.sha256(
+            json.dumps(content, sort_keys=True).encode()).hexdigest()
+    return keys
+
+
+def plan(tasks, state):
+    """The tasks to run, in dependency order, with the reason for each."""
+    keys = task_keys(tasks, state)
+    stale = []
+    rerun = set()
+    for task in _ordered(tasks):
+        recorded = state.keys.get(task.name)
+        outputs_exist = all(os.path.exists(path) for path in task.outputs)
+        if recorded is None:
+            if outputs_exist and not rerun.intersection(task.deps):
+                # results from before the state file was kept are adopted,
+                # as the file-existence checks of the submit scripts would
+                state.keys[task.name] = keys[task.name]
+                continue
+            reason = 'new'
+        elif recorded != keys[task.name]:
+            reason = 'changed'
+        elif not outputs_exist:
+            reason = 'outputs missing'
+        else:
+            continue
+        stale.append((task, reason))
+        rerun.add(task.name)
+    return stale, keys
+
+
+def queued_jobs(state):
+    """Job ids of the tasks whose slurm jobs are still pending or running."""
+    if not state.jobs:
+        return {}
+    # %F is the job id sbatch printed, also for the tasks of an array
+    out = subprocess.run(['squeue', '--noheader', '--format=%F',
+                          '--user', getpass.getuser()],
+                         capture_output=True, text=True, check=True)
+    active = set(out.stdout.split())
+    return {name: job for name, job in state.jobs.items() if job in active}
+
+
+def _move_aside(task):
+    for path in task.outputs:
+        # a checkpoint of the old configuration must not be resumed either
+        for p in (path, path + '.ckpt'):
+            if os.path.exists(p):
+                os.replace(p, p + '.stale')
+
+
+def run(tasks, state_path, backend='local', workers=1, job_prefix='',
+        log_dir=None, dry_run=False):
+    """Run or submit the stale tasks of ``tasks``.
+
+    Locally a task's key is recorded once it succeeds.  With ``slurm`` the
+    key and job id are recorded on submission.  A task whose job is still
+    pending or running is left to it, and its dependents wait on it; a job
+    of a changed task is cancelled first.  A job that fails leaves its
+    outputs missing, so the next run submits it again.
+    """
+    state = State(state_path)
+    stale, keys = plan(tasks, state)
+    queued = queued_jobs(state) if backend == 'slurm' else {}
+    waiting = {task.name: queued[task.name] for task, _ in stale
+               if task.name in queued
+               and state.keys.get(task.name) == keys[task.name]}
+    stale = [(task, reason) for task, reason in stale
+             if task.name not in waiting]
+    for name in sorted(waiting):
+        print('{}: queued as job {}'.format(name, waiting[name]))
+    for task, reason in stale:
+        print('{}: {}'.format(task.name, reason))
+    if len(stale) == 0 and len(waiting) == 0:
+        print('All tasks up to date.')
+    if dry_run:
+        return []
+    if len(stale) == 0:
+        state.save()
+        return []
+    rerun = set(task.name for task, _ in stale)
+    for task, reason in stale:
+        if task.name in queued:
+            # still computing the old configuration
+            subprocess.run(['scancel', queued[task.name]], check=True)
+            del state.jobs[task.name]
+        if reason == 'changed':
+            _move_aside(task)
+
+    if backend == 'local':
+        jobs = []
+        for task, _ in stale:
+            env = {}
+            if task.array_index is not None:
+                env = dict(SLURM_ARRAY_TASK_ID=task.array_index,
+                           SGE_TASK_ID=task.array_index)
+            jobs.append(localrun.Job(
+                task.name, ['bash', task.script] + task.args,
+                deps=[d for d in task.deps if d in rerun], env=env,
+                log=None if log_dir is None else os.path.join(
+                    log_dir, 'pipeline_' + task.name)))
+        status = localrun.run_jobs(jobs, workers)
+        for name, s in status.items():
+            if s == localrun.OK:
+                state.keys[name] = keys[name]
+        state.save()
+        return localrun.failed(status)
+
+    job_ids = dict(waiting)
+    try:
+        for task, _ in stale:
+            cmd = ['sbatch', '--parsable', '--job-name',
+                   job_prefix + task.name]
+            deps = [job_ids[d] for d in task.deps if d in job_ids]
+            if deps:
+                cmd.append('--dependency=afterok:' + ':'.join(deps))
+            if task.array_index is not None:
+                cmd.append('--array={}'.format(task.array_index))
+            cmd += [task.script] + task.args
+            print(' '.join(cmd))
+            out = subprocess.run(cmd, capture_output=True, text=True,
+                                 check=True)
+            job_ids[task.name] = out.stdout.strip().split(';')[0]
+            state.keys[task.name] = keys[task.name]
+            state.jobs[task.name] = job_ids[task.name]
+    finally:
+        # keep what was submitted before a failed sbatch
+        state.save()
+    return []
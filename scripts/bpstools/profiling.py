@@ -0,0 +1,197 @@
+"""Per-phase timing and resource use of a run.
+
+A ``Profile`` accumulates wall and CPU time over the phases in ``PHASES``.
+Phases nest and the times are exclusive: a phase entered inside another
+is subtracted from the outer one.  So draws flushed to disk during sampling
+count as ``write``, not ``sampling``.  ``save`` stores the totals, the peak
+resident set size and sampler statistics as ``profile_*`` attributes of
+the samples file.  It also writes them to a sidecar ``-profile.json`` file,
+which ``report-profiles.py`` aggregates.
+
+For NUTS, ``install_pystan`` times model compilation and ``sampling``.  It
+also reads gradient evaluations, tree depths, divergences and the adapted
+step size and inverse metric off the fit.
+pystan does not time warmup separately, so the sampling time is split
+between warmup and sampling in proportion to their gradient evaluations.
+"""
+import os
+import json
+import time
+import resource
+
+import numpy as np
+import h5py
+
+from . import diagnostics, h5io
+
+
+PHASES = ('load', 'build', 'warmup', 'sampling', 'write')
+PREFIX = 'profile_'
+
+
+def sidecar_path(samples_path):
+    return os.path.splitext(samples_path)[0] + '-profile.json'
+
+
+def cpu_time():
+    """CPU seconds of this process and of its finished worker processes."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return max(resource.getrusage(who).ru_maxrss for who in
+               (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) / 1024.
+
+
+class Profile(object):
+    def __init__(self):
+        self.wall = dict.fromkeys(PHASES, 0.)
+        self.cpu = dict.fromkeys(PHASES, 0.)
+        self.stats = {}
+        # NUTS step size and inverse metric, for runs warm-started from this
+        self.adaptation = None
+        self._stack = []
+
+    def push(self, name):
+        self._stack.append([name, time.time(), cpu_time(), 0., 0.])
+
+    def pop(self):
+        name, wall, cpu, child_wall, child_cpu = self._stack.pop()
+        wall = time.time() - wall
+        cpu = cpu_time() - cpu
+        self.add(name, wall - child_wall, cpu - child_cpu)
+        if self._stack:
+            self._stack[-1][3] += wall
+            self._stack[-1][4] += cpu
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def add(self, name, wall, cpu):
+        self.wall[name] += wall
+        self.cpu[name] += cpu
+
+    def split(self, source, target, fraction):
+        """Move ``fraction`` of the time of phase ``source`` to ``target``."""
+        for times in (self.wall, self.cpu):
+            moved = fraction * times[source]
+            times[source] -= moved
+            times[target] += moved
+
+    def record_nuts(self, fit):
+        """Sampler statistics of a pystan fit."""
+        warmup = fit.sim['warmup']
+        chains = fit.get_sampler_params(inc_warmup=True)
+        leapfrog = np.array([c['n_leapfrog__'] for c in chains])
+        treedepth = np.array([c['treedepth__'] for c in chains])[:,warmup:]
+        divergent = np.array([c['divergent__'] for c in chains])[:,warmup:]
+        total = leapfrog.sum()
+        self.stats.update(gradient_evaluations=int(total),
+                          mean_treedepth=float(treedepth.mean()),
+                          divergences=int(divergent.sum()))
+        if total > 0:
+            self.split('sampling', 'warmup', leapfrog[:,:warmup].sum() / total)
+        self.adaptation = dict(stepsize=float(fit.get_stepsize()[0]),
+                               inv_metric=np.asarray(fit.get_inv_metric()[0]))
+
+    def record_ess(self, samples_path):
+        """Bulk ESS of the log-likelihood per second of warmup and sampling."""
+        with h5py.File(samples_path, 'r') as f:
+            if h5io.LOG_LIKELIHOOD not in f:
+                return
+            ll = f[h5io.LOG_LIKELIHOOD][()]
+        seconds = self.wall['warmup'] + self.wall['sampling']
+        if ll.size < 4 or seconds <= 0:
+            return
+        ess = float(diagnostics.bulk_ess(ll[np.newaxis,np.newaxis])[0])
+        self.stats.update(ess_log_likelihood=ess,
+                          ess_per_second=ess / seconds)
+
+    def attrs(self):
+        attrs = {}
+        for name in PHASES:
+            attrs['{}wall_{}'.format(PREFIX, name)] = self.wall[name]
+            attrs['{}cpu_{}'.format(PREFIX, name)] = self.cpu[name]
+        attrs[PREFIX + 'peak_rss_mb'] = peak_rss_mb()
+        for key, value in self.stats.items():
+            attrs[PREFIX + key] = value
+        return attrs
+
+    def save(self, samples_path, info=None):
+        """Add the profile to a samples file and write its sidecar JSON."""
+        attrs = self.attrs()
+        with h5py.File(samples_path, 'a') as f:
+            for key, value in attrs.items():
+                f.attrs[key] = value
+            runtime = float(f.attrs.get('runtime', np.nan))
+            # set by runs that stopped once they converged
+            iterations = f.attrs.get('iterations')
+        record = dict(info or {}, samples_file=samples_path, runtime=runtime)
+        if iterations is not None:
+            record['iterations'] = int(iterations)
+        record.update({key[len(PREFIX):]: value
+                       for key, value in attrs.items()})
+        with open(sidecar_path(samples_path), 'w') as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+        return record
+
+
+class _Phase(object):
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.push(self.name)
+        return self.profile
+
+    def __exit__(self, *exc):
+        self.profile.pop()
+        return False
+
+
+# profile that the pystan wrappers report to
+_active = None
+
+
+def activate(profile):
+    global _active
+    _active = profile
+
+
+def install_pystan(modules=()):
+    """Time compilation and sampling of ``pystan.StanModel`` for the active
+    profile.  Call after ``stancache.install`` so compilation is timed
+    through the cache."""
+    import pystan
+
+    if getattr(pystan.StanModel, '_profiled', False):
+        return
+    StanModel = pystan.StanModel
+
+    def profiled_stan_model(*args, **kwargs):
+        if _active is None:
+            return StanModel(*args, **kwargs)
+        with _active.phase('build'):
+            model = StanModel(*args, **kwargs)
+        if not getattr(model, '_profiled', False):
+            sampling = model.sampling
+
+            def profiled_sampling(*args, **kwargs):
+                if _active is None:
+                    return sampling(*args, **kwargs)
+                with _active.phase('sampling'):
+                    fit = sampling(*args, **kwargs)
+                _active.record_nuts(fit)
+                return fit
+            model.sampling = profiled_sampling
+            model._profiled = True
+        return model
+
+    profiled_stan_model._profiled = True
+    pystan.StanModel = profiled_stan_model
+    for module in modules:
+        if getattr(module, 'StanModel', None) is StanModel:
+            module.StanModel = profiled_stan_model
@@ -0,0 +1,95 @@
+"""Removal of dead signatures from Gibbs runs during warmup.
+
+A component whose expected loading (its ARD scale) stays below ``threshold``
+for ``window`` consecutive warmup iterations is frozen at its current values
+and dropped from the state the sampler works on, so later sweeps cost O(K
+active) instead of O(K).  Draws are padded back to the full K with the frozen
+values, so samples files keep their shapes.
+"""
+import numpy as np
+
+from . import h5io
+
+
+# keys under which checkpoints store the mask of active components, the
+# iterations each has spent below the threshold and when it was pruned
+ACTIVE = 'active'
+BELOW = 'below'
+PRUNED_AT = 'pruned_at'
+STATE_KEYS = (ACTIVE, BELOW, PRUNED_AT)
+
+
+class ARDPruner(object):
+    def __init__(self, K, threshold, window=200):
+        self.K = K
+        self.threshold = threshold
+        self.window = window
+        self.active = np.ones(K, dtype=bool)
+        self.below = np.zeros(K, dtype=int)
+        self.pruned_at = np.full(K, -1)
+        self.full = None
+        self.seconds = {}
+
+    def update(self, state, iteration):
+        """Count iterations below the threshold and drop dead components."""
+        below = state[h5io.EXPECTED_LOADINGS] < self.threshold
+        idx = np.nonzero(self.active)[0]
+        self.below[idx] = np.where(below, self.below[idx] + 1, 0)
+        dead = self.below[idx] >= self.window
+        # always keep at least one component
+        if not np.any(dead) or np.all(dead):
+            return state
+        self.full = self.pad(state)
+        self.active[idx[dead]] = False
+        self.pruned_at[idx[dead]] = iteration
+        return {k: v[~dead] for k, v in state.items()}
+
+    def pad(self, state):
+        """Full-K copy of ``state``, with frozen values for pruned components."""
+        if np.all(self.active):
+            return {k: v.copy() for k, v in state.items()}
+        full = {k: v.copy() for k, v in self.full.items()}
+        for k, v in state.items():
+            full[k][self.active] = v
+        return full
+
+    def checkpoint_state(self, state):
+        """Padded state together with the pruner's counters."""
+        full = self.pad(state)
+        full[ACTIVE] = self.active.copy()
+        full[BELOW] = self.below.copy()
+        full[PRUNED_AT] = self.pruned_at.copy()
+        return full
+
+    def restore(self, full_state, active, below=None, pruned_at=None):
+        """Resume from a padded state and the counters saved with it."""
+        self.active = np.asarray(active, dtype=bool)
+        if below is not None:
+            self.below = np.asarray(below, dtype=int)
+        if pruned_at is not None:
+            self.pruned_at = np.asarray(pruned_at, dtype=int)
+        self.full = {k: v.copy() for k, v in full_state.items()}
+        return {k: v[self.active] for k, v in full_state.items()}
+
+    def record_time(self, seconds):
+        n = int(self.active.sum())
+        total, count = self.seconds.get(n, (0., 0))
+        self.seconds[n] = (total + seconds, count + 1)
+
+    def attrs(self):
+        Ks = sorted(self.seconds, reverse=True)
+        per_iter = [self.seconds[n][0] / self.seconds[n][1] for n in Ks]
+        return dict(active_K=int(self.active.sum()), pruned_at=self.pruned_at,
+                    prune_threshold=self.threshold, prune_window=self.window,
+                    active_K_levels=np.array(Ks),
+                    seconds_per_iteration=np.array(per_iter))
+
+    def report(self):
+        attrs = self.attrs()
+        per_iter = attrs['seconds_per_iteration']
+        if per_iter.size == 0:
+            return
+        print('active K {} -> {}; {:.1f} ms -> {:.1f} ms per iteration '
+              '({:.0%} less)'.format(self.K, attrs['active_K'],
+                                     1e3 * per_iter[0], 1e3 * per_iter[-1],
+                                     1 - per_iter[-1] / per_iter[0]))
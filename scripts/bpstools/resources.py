@@ -0,0 +1,259 @@
+"""Memory and walltime requests for cluster jobs.
+
+NMF runs are costed as ``seconds = c * iterations * I * J * K`` and
+``memory = m0 + m1 * stored floats``.  The constants come from the
+``-profile.json`` files of past runs (see ``profiling``) when there are
+enough of them for the engine.  The per-iteration rate may then also depend
+on zeta.  Otherwise fixed constants are used, and the requests are never
+smaller than the ones the job scripts used to set by hand.  Estimates are
+padded by ``SAFETY`` and clipped to ``[MIN_SECONDS, max_seconds]``.
+"""
+import os
+import glob
+import json
+import math
+
+import numpy as np
+
+
+SAFETY = 1.5
+MIN_SECONDS = 15 * 60
+MIN_GB = 2
+# profiles needed before the fitted model replaces the fallback
+MIN_PROFILES = 3
+
+# fallback seconds per iteration per I * J * K cell; NUTS assumes about 256
+# gradient evaluations per iteration
+SECONDS_PER_CELL = {'nuts': 2.5e-6, 'gibbs': 2.5e-7, 'sgmcmc': 2.5e-7}
+# pystan keeps every iteration of every parameter, and a few copies of it
+# while writing the samples file
+BYTES_PER_FLOAT = {'nuts': 8 * 4, 'gibbs': 8 * 2, 'sgmcmc': 8 * 2}
+BASE_GB = 1.
+
+
+def read_profiles(dirs):
+    records = []
+    for d in dirs:
+        for path in glob.glob(os.path.join(d, '**', '*-profile.json'),
+                              recursive=True):
+            with open(path) as f:
+                records.append(json.load(f))
+    return records
+
+
+def stored_floats(engine, I, J, K, samples, burnin, thin=1, buffer_size=100):
+    """Floats of draws held in memory by one run."""
+    per_draw = K * (I + J + 1)
+    if engine == 'nuts':
+        return per_draw * (samples + burnin)
+    # the NumPy engines stream their draws
+    return per_draw * min(buffer_size, samples // max(thin, 1)) + I * J * K
+
+
+class CostModel(object):
+    def __init__(self, engine, records=()):
+        self.engine = engine
+        self.rate = None
+        self.zeta_slope = 0.
+        self.memory = None
+        # a run over a ladder of zetas (parallel tempering) costs a chain
+        # per zeta, so it is left out
+        records = [r for r in records if r.get('engine') == engine
+                   and 'zetas' not in r
+                   and all(k in r for k in ('I', 'J', 'K', 'samples',
+                                            'burnin'))]
+        self.n_profiles = len(records)
+        if len(records) >= MIN_PROFILES:
+            self._fit(records)
+
+    def _fit(self, records):
+        # runs that stopped once they converged record the iterations run
+        cells = np.array([r['I'] * r['J'] * r['K']
+                          * r.get('iterations', r['samples'] + r['burnin'])
+                          for r in records], dtype=float)
+        seconds = np.array([sum(r.get('wall_' + p, 0.) for p in
+                                ('build', 'warmup', 'sampling', 'write'))
+                            for r in records])
+        log_rate = np.log(seconds / cells)
+        log_zeta = np.log([r.get('zeta', 1.) for r in records])
+        if np.ptp(log_zeta) > 0 and len(records) > MIN_PROFILES:
+            self.zeta_slope, intercept = np.polyfit(log_zeta, log_rate, 1)
+        else:
+            intercept = log_rate.mean()
+        residuals = log_rate - intercept - self.zeta_slope * log_zeta
+        # cover the slowest runs seen, not the average one
+        self.rate = math.exp(intercept + residuals.max())
+
+        floats = np.array([stored_floats(self.engine, r['I'], r['J'], r['K'],
+                                         r['samples'], r['burnin'],
+                                         r.get('thin', 1))
+                           for r in records], dtype=float)
+        rss = np.array([r.get('peak_rss_mb', 0.) for r in records]) / 1024.
+        if np.ptp(floats) > 0:
+            slope, intercept = np.polyfit(floats, rss, 1)
+            slope = max(slope, 0.)
+        else:
+            slope, intercept = 0., rss.mean()
+        intercept += (rss - intercept - slope * floats).max()
+        self.memory = (max(intercept, 0.), slope)
+
+    def seconds(self, I, J, K, samples, burnin, zeta=1.):
+        if self.rate is None:
+            rate = SECONDS_PER_CELL.get(self.engine, SECONDS_PER_CELL['nuts'])
+        else:
+            rate = self.rate * zeta ** self.zeta_slope
+        return rate * I * J * K * (samples + burnin)
+
+    def memory_gb(self, I, J, K, samples, burnin, thin=1):
+        floats = stored_floats(self.engine, I, J, K, samples, burnin, thin)
+        if self.memory is None:
+            bytes_per_float = BYTES_PER_FLOAT.get(self.engine,
+                                                  BYTES_PER_FLOAT['nuts'])
+            return BASE_GB + bytes_per_float * floats / 2**30
+        return self.memory[0] + self.memory[1] * floats
+
+
+def estimate_nmf(engine, I, J, K, samples, burnin, zetas=(1.,), thin=1,
+                 profile_dirs=(), max_seconds=7 * 24 * 3600, floor=None):
+    """(memory in GB, walltime in seconds) for the slowest of ``zetas``.
+
+    Until there are ``MIN_PROFILES`` profiles of the engine the estimate is
+    no smaller than ``floor``, a (GB, seconds) pair.
+    """
+    model = CostModel(engine, read_profiles(profile_dirs))
+    seconds = max(model.seconds(I, J, K, samples, burnin, zeta)
+                  for zeta in zetas)
+    memory = model.memory_gb(I, J, K, samples, burnin, thin)
+    memory, seconds = _pad(memory, seconds, max_seconds)
+    if model.rate is None and floor is not None:
+        memory, seconds = max(memory, floor[0]), max(seconds, floor[1])
+    return memory, seconds
+
+
+def estimate_nnls(I, J, K):
+    """Stage I: NNLS loadings of every sample in the counts table."""
+    memory = BASE_GB + 8 * 20 * (I * J + I * K + K * J) / 2**30
+    return _pad(memory, 60 + 1e-4 * I * J * K)
+
+
+def estimate_plots(I, J, K, samples, thin, n_seeds, n_zetas):
+    """Stage III/V figures: every seed's draws for one zeta at a time, and
+    the best seed's for every zeta."""
+    draws = samples // max(thin, 1)
+    floats = K * (I + J + 1) * draws * (n_seeds + n_zetas)
+    memory = 2 * BASE_GB + 8 * 3 * floats / 2**30
+    return _pad(memory, 600 + 1e-6 * floats * 25)
+
+
+def count_samples(exp):
+    """Samples in the NMF runs of an experiment: the columns of the counts
+    table kept for the original counts, capped at ``num_samples`` as
+    ``--max-J`` caps them.  Falls back to ``num_samples`` if the table is
+    not there."""
+    num_samples = int(exp.get('num_samples') or 0)
+    if not os.path.isfile(exp.get('data', '')):
+        return num_samples
+    with open(exp.get('data')) as f:
+        columns = f.readline().rstrip('\n').split('\t')[1:]
+    if not exp.getboolean('plain', False):
+        columns = [c for c in columns
+                   if c.startswith(exp.get('sample_prefixes', ''))]
+    return min(len(columns), num_samples) if num_samples > 0 else len(columns)
+
+
+def estimate_experiment(exp, exp_name, fixed):
+    """(memory in GB, walltime in seconds) of the ``nnls``, ``nmf`` and
+    ``plots`` jobs of an experiment section of ``bps.ini``.
+
+    ``fixed`` holds the requests the backend's job scripts used to set by
+    hand.  They are returned as they are unless ``estimate_resources`` is
+    on.  The NMF cost model is then fitted to the profiles under the
+    experiment's ``results`` directory and the config's ``profile_dirs``.
+    NMF jobs never get more walltime than ``fixed['nmf']``, nor less memory
+    or walltime until there are enough profiles.
+    """
+    if not exp.getboolean('estimate_resources', False):
+        return dict(fixed)
+    subst_type = exp.get('subst_type')
+    I = 96 if subst_type == 'SBS' else (78 if subst_type == 'DBS' else 83)
+    J = count_samples(exp)
+    K = int(exp.get('K'))
+    samples = int(exp.get('samples'))
+    burnin = int(exp.get('burnin'))
+    thin = int(exp.get('thin'))
+    zetas = [float(z) for z in exp.get('testing_powers').split()]
+    profile_dirs = ([os.path.join(exp_name, 'results')]
+                    + exp.get('profile_dirs', '').split())
+    # all of COSMIC unless putative signatures are given
+    n_sigs = len(exp.get('putative_sigs', '').split()) or 65
+    return dict(
+        nnls=estimate_nnls(I, J, n_sigs),
+        nmf=estimate_nmf(exp.get('engine', 'nuts'), I, J, K, samples, burnin,
+                         zetas, thin, profile_dirs, fixed['nmf'][1],
+                         fixed['nmf']),
+        plots=estimate_plots(I, J, K, samples, thin,
+                             int(exp.get('no_chains')), len(zetas)))
+
+
+def pack(items, cores, max_seconds, max_gb):
+    """Group runs into allocations of ``cores`` cores, ``max_gb`` of memory
+    and ``max_seconds`` of walltime.
+
+    ``items`` are (key, seconds, GB) predictions.  Runs are placed first-fit
+    in decreasing order of seconds.  An allocation runs as many of its runs
+    at once as its cores and the memory of its largest run allow.  List
+    scheduling then finishes within ``(total - longest) / workers + longest``
+    (Graham's bound), which must fit the walltime after padding.  A run too
+    large for any allocation gets one of its own.  Returns (keys, workers, GB, seconds)
+    per allocation, with the requests padded as by ``estimate_nmf``.
+    """
+    def workers(gb):
+        return max(1, min(cores, int(max_gb // (SAFETY * gb)) if gb > 0
+                          else cores))
+
+    def makespan(b, n):
+        return ((b['total'] - b['longest']) / min(workers(b['gb']), n)
+                + b['longest'])
+
+    bins = []
+    for key, seconds, gb in sorted(items, key=lambda item: -item[1]):
+        for b in bins:
+            trial = dict(total=b['total'] + seconds, gb=max(b['gb'], gb),
+                         longest=max(b['longest'], seconds))
+            if SAFETY * makespan(trial, len(b['keys']) + 1) <= max_seconds:
+                b.update(trial)
+                b['keys'].append(key)
+                break
+        else:
+            bins.append(dict(keys=[key], total=seconds, gb=gb,
+                             longest=seconds))
+    packed = []
+    for b in bins:
+        n = min(workers(b['gb']), len(b['keys']))
+        memory, seconds = _pad(n * b['gb'], makespan(b, len(b['keys'])))
+        packed.append((b['keys'], n, memory, seconds))
+    return packed
+
+
+def _pad(memory, seconds, max_seconds=7 * 24 * 3600):
+    memory = max(MIN_GB, int(math.ceil(SAFETY * memory)))
+    seconds = int(min(max(MIN_SECONDS, SAFETY * seconds), max_seconds))
+    return memory, seconds
+
+
+def parse_walltime(text):
+    """Seconds in an ``HH:MM:SS`` walltime."""
+    hours, minutes, seconds = (int(x) for x in text.split(':'))
+    return 3600 * hours + 60 * minutes + seconds
+
+
+def slurm_time(seconds):
+    minutes = int(math.ceil(seconds / 60.))
+    return '{}-{:02d}:{:02d}'.format(minutes // 1440, minutes // 60 % 24,
+                                     minutes % 60)
+
+
+def uger_time(seconds):
+    seconds = int(seconds)
+    return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60,
+                                         seconds % 60)
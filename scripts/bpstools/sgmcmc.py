@@ -0,0 +1,132 @@
+"""Stochastic-gradient MCMC over minibatches of samples.
+
+Each step draws a minibatch B of samples (columns) and runs a few local Gibbs
+sweeps of the count augmentation and of their loadings.  It then takes one
+stochastic-gradient Riemannian Langevin step (Patterson & Teh, 2013) on the
+signatures in the expanded-mean parameterization ``mutsigs_k = w_k / sum(w_k)``
+with ``w_ki ~ Gamma(alpha, 1)``:
+
+    w <- | w + eps/2 (alpha + s (z_B - n_B mutsigs) - w) + sqrt(eps w) N(0,1) |
+
+Here ``z_B`` are the augmented counts of the batch summed over its samples,
+``n_B`` their totals per signature, and ``s = zeta * J / |B|``.  The power
+therefore scales the minibatch likelihood exactly as it scales the full one.
+The step size decays as ``eps = step_size * (1 + t / step_decay) ** -0.55``.
+The expected loadings are drawn from their conditional given every sample's
+current loadings.
+"""
+import numpy as np
+
+from . import gibbs, h5io
+
+
+EXPANDED_MUTSIGS = 'expanded_mutsigs'
+STEP = 'step'
+
+
+def _sum_by(index, z, n):
+    """K x n sums of the rows of ``z`` grouped by ``index``."""
+    K = z.shape[1]
+    return np.bincount((index[:,np.newaxis] * K + np.arange(K)).ravel(),
+                       weights=z.ravel(), minlength=n * K).reshape(n, K).T
+
+
+class PowerNMFSGRLD(gibbs.PowerNMFGibbs):
+
+    def __init__(self, counts, K, a, alpha, a0, b0, zeta=1.0, batch_size=64,
+                 step_size=.01, step_decay=100., local_sweeps=2):
+        super(PowerNMFSGRLD, self).__init__(counts, K, a, alpha, a0, b0,
+                                            zeta=zeta)
+        self.batch_size = min(batch_size, self.J)
+        self.step_size = step_size
+        self.step_decay = step_decay
+        self.local_sweeps = local_sweeps
+        # nonzeros grouped by sample, so a batch's cells are contiguous slices
+        self._order = np.argsort(self.cols, kind='stable')
+        self._col_ptr = np.searchsorted(self.cols[self._order],
+                                        np.arange(self.J + 1))
+
+    def initialize(self, rng):
+        state = super(PowerNMFSGRLD, self).initialize(rng)
+        return self._expand(state)
+
+    def _expand(self, state):
+        # start near the stationary scale, alpha * I plus the (powered)
+        # counts assigned to each signature
+        scale = self.alpha * self.I + self.zeta * self.total / self.K
+        state[EXPANDED_MUTSIGS] = state[h5io.MUTSIGS] * scale
+        state[STEP] = np.array(0)
+        return state
+
+    def _batch(self, rng):
+        samples = np.sort(rng.choice(self.J, self.batch_size, replace=False))
+        nz = np.concatenate([self._order[self._col_ptr[j]:self._col_ptr[j+1]]
+                             for j in samples])
+        # position of each cell's sample within the batch
+        local = np.searchsorted(samples, self.cols[nz])
+        return samples, self.rows[nz], local, self.vals[nz]
+
+    def sweep(self, state, rng, zeta=None):
+        zeta = self.zeta if zeta is None else zeta
+        if EXPANDED_MUTSIGS not in state:
+            # e.g. initialized from another engine's samples file
+            self._expand(state)
+        I = self.I
+        samples, rows, local, vals = self._batch(rng)
+        mutsigs = state[h5io.MUTSIGS]
+        mu = state[h5io.EXPECTED_LOADINGS]
+        loadings = state[h5io.LOADINGS][:,samples]
+        for _ in range(self.local_sweeps):
+            probs = (mutsigs[:,rows] * loadings[:,local]).T
+            probs /= probs.sum(axis=1, keepdims=True)
+            z = rng.multinomial(vals, probs)
+            z_sample = _sum_by(local, z, samples.size)
+            loadings = rng.gamma(self.a + zeta * z_sample,
+                                 1. / (self.a / mu[:,np.newaxis] + zeta))
+        state[h5io.LOADINGS][:,samples] = loadings
+        z_channel = _sum_by(rows, z, I)
+
+        eps = self.step_size * (1 + state[STEP] / self.step_decay) ** -.55
+        scale = zeta * self.J / samples.size
+        w = state[EXPANDED_MUTSIGS]
+        drift = (self.alpha + scale * (z_channel
+                                       - z_channel.sum(axis=1, keepdims=True)
+                                       * mutsigs) - w)
+        w = np.abs(w + eps / 2 * drift
+                   + np.sqrt(eps * w) * rng.standard_normal(w.shape))
+        # keep the signatures strictly positive
+        w = np.maximum(w, 1e-300)
+        state[EXPANDED_MUTSIGS] = w
+        state[h5io.MUTSIGS] = w / w.sum(axis=1, keepdims=True)
+        state[h5io.EXPECTED_LOADINGS] = 1. / rng.gamma(
+            self.a0 + self.J * self.a,
+            1. / (self.b0 + self.a * state[h5io.LOADINGS].sum(axis=1)))
+        state[STEP] = state[STEP] + 1
+        return state
+
+
+def fit_model_and_save_results(counts, K, samples_path, J0, eps, alpha, a, a0,
+                               b0, lik_power=1.0, iters=2000, warmup=1000,
+                               thin=1, seed=1, batch_size=64, step_size=.01,
+                               step_decay=100., local_sweeps=2, **kwargs):
+    """Run SGRLD through ``gibbs.fit_model_and_save_results``.
+
+    Remaining keyword arguments (``init``, ``checkpoint_every``, ``monitor``,
+    ``profile``, ...) are passed on.
+    """
+    profile = kwargs.get('profile')
+    if profile is not None:
+        profile.push('build')
+    sampler = PowerNMFSGRLD(counts, K, a=a, alpha=alpha, a0=a0, b0=b0,
+                            zeta=lik_power, batch_size=batch_size,
+                            step_size=step_size, step_decay=step_decay,
+                            local_sweeps=local_sweeps)
+    if profile is not None:
+        profile.pop()
+    return gibbs.fit_model_and_save_results(
+        counts, K, samples_path, J0=J0, eps=eps, alpha=alpha, a=a, a0=a0,
+        b0=b0, lik_power=lik_power, iters=iters, warmup=warmup, thin=thin,
+        seed=seed, sampler=sampler, engine='sgmcmc',
+        attrs=dict(batch_size=sampler.batch_size, step_size=step_size,
+                   step_decay=step_decay, local_sweeps=local_sweeps),
+        **kwargs)
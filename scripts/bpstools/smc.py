@@ -0,0 +1,147 @@
+"""Sequential Monte Carlo along the power-likelihood path.
+
+Particles start as draws from the prior (zeta = 0) and are moved towards
+zeta = 1 through a sequence of intermediate powers.  At each step they are
+reweighted by ``exp((zeta_new - zeta_old) * loglik)``, resampled and then
+rejuvenated with a few Gibbs sweeps at the new power, in parallel over a
+process pool.  Intermediate powers are chosen adaptively by bisection so the
+effective sample size after reweighting stays near ``ess_fraction`` of the
+population; the requested powers are always hit exactly.  The running sum of
+the log mean incremental weights estimates log Z(zeta) for every requested
+zeta.
+
+The weights are those of the power posteriors p(theta) p(x | theta)^zeta,
+but the Gibbs moves only approximate that target for zeta < 1 (see
+``gibbs``).  After a move the particles are no longer distributed as the
+weights assume, so the populations and the log Z estimates are biased for
+zeta < 1.  Treat log Z as an approximate, relative measure across zetas of
+one run.  The first rung at zeta = 0 starts from exact prior draws.
+"""
+import time
+import multiprocessing
+
+import numpy as np
+import h5py
+from scipy.special import logsumexp
+
+from . import gibbs, h5io
+
+
+_sampler = None
+
+
+def _init_worker(counts, K, a, alpha, a0, b0):
+    global _sampler
+    _sampler = gibbs.PowerNMFGibbs(counts, K, a=a, alpha=alpha, a0=a0, b0=b0)
+
+
+def _rejuvenate(job):
+    states, zeta, moves, seed = job
+    rng = np.random.default_rng(seed)
+    lls = np.empty(len(states))
+    for i, state in enumerate(states):
+        for _ in range(moves):
+            _sampler.sweep(state, rng, zeta=zeta)
+        lls[i] = _sampler.log_likelihood(state)
+    return states, lls
+
+
+def _ess(log_weights):
+    w = np.exp(log_weights - logsumexp(log_weights))
+    return 1. / np.sum(w ** 2)
+
+
+def _next_zeta(zeta, target, lls, min_ess, tol=1e-6):
+    """Largest power in (zeta, target] keeping the ESS above ``min_ess``."""
+    if _ess((target - zeta) * lls) >= min_ess:
+        return target
+    lo, hi = zeta, target
+    while hi - lo > tol:
+        mid = (lo + hi) / 2
+        if _ess((mid - zeta) * lls) >= min_ess:
+            lo = mid
+        else:
+            hi = mid
+    return max(lo, zeta + tol)
+
+
+def _systematic_resample(log_weights, rng):
+    w = np.exp(log_weights - logsumexp(log_weights))
+    positions = (rng.uniform() + np.arange(w.size)) / w.size
+    return np.minimum(np.searchsorted(np.cumsum(w), positions), w.size - 1)
+
+
+def run_smc(counts, K, zetas, a, alpha, a0, b0, particles=200, moves=5,
+            ess_fraction=.5, seed=1, processes=None, verbose=True):
+    """Return the requested powers (increasing), the particle population at
+    each of them and the log normalizing constant estimates."""
+    zetas = sorted(zetas)
+    seeds = np.random.SeedSequence(seed)
+    rng = np.random.default_rng(seeds.spawn(1)[0])
+    _init_worker(counts, K, a, alpha, a0, b0)
+    states = [_sampler.sample_prior(rng) for _ in range(particles)]
+    lls = np.array([_sampler.log_likelihood(s) for s in states])
+    lls[np.isnan(lls)] = -np.inf
+    n_jobs = processes or multiprocessing.cpu_count()
+    chunks = np.array_split(np.arange(particles), n_jobs)
+
+    populations = []
+    log_Zs = []
+    log_Z = 0.
+    zeta = 0.
+    steps = 0
+    with multiprocessing.Pool(n_jobs, initializer=_init_worker,
+                              initargs=(counts, K, a, alpha, a0, b0)) as pool:
+        for target in zetas:
+            while zeta < target:
+                new_zeta = _next_zeta(zeta, target, lls, ess_fraction * particles)
+                log_weights = (new_zeta - zeta) * lls
+                log_Z += logsumexp(log_weights) - np.log(particles)
+                keep = _systematic_resample(log_weights, rng)
+                states = [{k: v.copy() for k, v in states[i].items()}
+                          for i in keep]
+                zeta = new_zeta
+                jobs = [([states[i] for i in chunk], zeta, moves, s)
+                        for chunk, s in zip(chunks, seeds.spawn(len(chunks)))]
+                results = pool.map(_rejuvenate, jobs)
+                states = [s for chunk_states, _ in results for s in chunk_states]
+                lls = np.concatenate([chunk_lls for _, chunk_lls in results])
+                steps += 1
+                if verbose:
+                    print('step {} zeta {:.5f} log Z {:.1f}'.format(
+                        steps, zeta, log_Z))
+            populations.append([{k: v.copy() for k, v in s.items()}
+                                for s in states])
+            log_Zs.append(log_Z)
+    return zetas, populations, np.array(log_Zs), steps
+
+
+def fit_model_and_save_results(counts, K, samples_path, J0, eps, alpha, a, a0,
+                               b0, zetas, particles=200, moves=5,
+                               ess_fraction=.5, seed=1, processes=None):
+    """Run SMC and write one group per requested zeta to ``samples_path``."""
+    start = time.time()
+    zetas, populations, log_Zs, steps = run_smc(
+        counts, K, zetas, a=a, alpha=alpha, a0=a0, b0=b0, particles=particles,
+        moves=moves, ess_fraction=ess_fraction, seed=seed,
+        processes=processes)
+    runtime = time.time() - start
+    model = gibbs.PowerNMFGibbs(counts, K, a=a, alpha=alpha, a0=a0, b0=b0)
+    with h5py.File(samples_path, 'w') as f:
+        for zeta, population, log_Z in zip(zetas, populations, log_Zs):
+            parameters = dict(a=a, alpha=alpha, a0=a0, b0=b0, zeta=zeta,
+                              eps=eps, J0=J0)
+            draws = h5io.stack_draws(population)
+            draws.update(model.draw_stats(draws))
+            h5io.write_samples(f.create_group(h5io.zeta_group_name(zeta)),
+                               draws, parameters,
+                               runtime, attrs=dict(engine='smc', seed=seed,
+                                                   log_normalizing_constant=log_Z))
+        f.attrs['engine'] = 'smc'
+        f.attrs['zetas'] = zetas
+        f.attrs['log_normalizing_constants'] = log_Zs
+        f.attrs['steps'] = steps
+        f.attrs['particles'] = particles
+        f.attrs['moves'] = moves
+        f.attrs['runtime'] = runtime
+    return runtime
@@ -0,0 +1,105 @@
+"""Persistent cache of compiled pystan models.
+
+``install`` replaces ``pystan.StanModel`` (and any module-level alias of it,
+such as the one in ``mutsigtools.models``) with a wrapper that pickles each
+compiled model under ``cache_dir``.  Entries are keyed by model name, a hash
+of the Stan source, the pystan version and the C++ compiler version, and are
+built under an exclusive file lock so that concurrent array tasks on a shared
+filesystem compile a given model only once.
+"""
+import os
+import time
+import fcntl
+import pickle
+import hashlib
+import subprocess
+import sysconfig
+
+
+_memory_cache = {}
+
+
+def compiler_version():
+    cc = (sysconfig.get_config_var('CXX') or sysconfig.get_config_var('CC')
+          or 'c++').split()[0]
+    try:
+        out = subprocess.run([cc, '--version'], capture_output=True, text=True)
+        return out.stdout.splitlines()[0].strip()
+    except (OSError, IndexError):
+        return cc
+
+
+def cache_key(model_name, model_code, pystan_version):
+    h = hashlib.sha256()
+    for part in (model_name, model_code, pystan_version, compiler_version()):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return '{}-{}'.format(model_name, h.hexdigest()[:16])
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def cached_model(build, model_name, model_code, pystan_version, cache_dir,
+                 verbose=True):
+    """Return the compiled model for ``model_code``, calling ``build`` on a miss."""
+    key = cache_key(model_name, model_code, pystan_version)
+    if key in _memory_cache:
+        return _memory_cache[key]
+    path = os.path.join(cache_dir, key + '.pkl')
+    start = time.time()
+    status = 'hit'
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path + '.lock', 'w') as lock:
+            fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                # another task may have built the model while we waited
+                if not os.path.exists(path):
+                    status = 'miss'
+                    model = build()
+                    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+                    with open(tmp_path, 'wb') as f:
+                        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp_path, path)
+            finally:
+                fcntl.lockf(lock, fcntl.LOCK_UN)
+    if status == 'hit':
+        model = _load(path)
+    if verbose:
+        print('stan model cache {}: {} ({:.1f} s)'.format(
+            status, key, time.time() - start))
+    _memory_cache[key] = model
+    return model
+
+
+def install(cache_dir, modules=(), verbose=True):
+    """Route ``pystan.StanModel`` construction through the cache in ``cache_dir``."""
+    import pystan
+
+    StanModel = getattr(pystan.StanModel, '_uncached', pystan.StanModel)
+
+    def cached_stan_model(file=None, charset='utf-8', model_name='anon_model',
+                          model_code=None, **kwargs):
+        if model_code is None and file is not None:
+            with open(file, encoding=charset) as f:
+                model_code = f.read()
+        if model_code is None:
+            # e.g. built from stanc_ret; nothing to key on
+            return StanModel(file=file, charset=charset, model_name=model_name,
+                             **kwargs)
+
+        def build():
+            return StanModel(model_name=model_name, model_code=model_code,
+                             **kwargs)
+        return cached_model(build, model_name, model_code, pystan.__version__,
+                            cache_dir, verbose=verbose)
+
+    cached_stan_model._uncached = StanModel
+    pystan.StanModel = cached_stan_model
+    for module in modules:
+        if getattr(module, 'StanModel', None) is StanModel:
+            module.StanModel = cached_stan_model
+    return cached_stan_model
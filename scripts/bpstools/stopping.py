@@ -0,0 +1,106 @@
+"""Convergence-driven stopping of Gibbs runs.
+
+The monitor keeps, for every saved draw, the log-likelihood and the total
+loading of each sample (summed over signatures, so unaffected by label
+switching).  Every ``check_every`` iterations after warmup it computes the
+split R-hat and the bulk and tail ESS of these series, within the chain or
+pooled with the other chains of the same data and zeta.  Pooled chains share
+their traces through ``pool_dir``, which works both for chains forked by one
+job and for array tasks on a shared filesystem.
+"""
+import os
+import glob
+
+import numpy as np
+
+from . import diagnostics, h5io
+
+
+CONVERGED = 'converged'
+MAX_ITERATIONS = 'max_iterations'
+
+
+class ConvergenceMonitor(object):
+    def __init__(self, sampler, rhat=1.01, ess=400, check_every=500,
+                 min_draws=100, pool_dir=None, pool_size=1, chain_id=0):
+        self.sampler = sampler
+        self.target_rhat = rhat
+        self.target_ess = ess
+        self.check_every = check_every
+        self.min_draws = min_draws
+        self.pool_dir = pool_dir
+        self.pool_size = pool_size if pool_dir is not None else 1
+        self.chain_id = chain_id
+        self.trace = []
+        self.reason = MAX_ITERATIONS
+        self.summary = {}
+        if pool_dir is not None:
+            os.makedirs(pool_dir, exist_ok=True)
+
+    def record(self, state):
+        self.trace.append(np.concatenate([
+            [self.sampler.log_likelihood(state)],
+            state[h5io.LOADINGS].sum(axis=0)]))
+
+    def replay(self, group, batch=100):
+        """Record the draws already stored in ``group``, e.g. after resuming."""
+        if h5io.LOADINGS not in group:
+            return
+        n = group[h5io.LOADINGS].shape[-1]
+        for s0 in range(0, n, batch):
+            loadings = group[h5io.LOADINGS][...,s0:s0+batch]
+            mutsigs = group[h5io.MUTSIGS][...,s0:s0+batch]
+            for s in range(loadings.shape[-1]):
+                self.record({h5io.LOADINGS: loadings[...,s],
+                             h5io.MUTSIGS: mutsigs[...,s]})
+
+    def _chains(self):
+        trace = np.array(self.trace).T
+        if self.pool_dir is None:
+            return trace[np.newaxis]
+        path = os.path.join(self.pool_dir, 'chain-{}.npy'.format(self.chain_id))
+        tmp_path = '{}.{}.tmp.npy'.format(path, os.getpid())
+        np.save(tmp_path, trace)
+        os.replace(tmp_path, path)
+        traces = []
+        for other in glob.glob(os.path.join(self.pool_dir, 'chain-*.npy')):
+            try:
+                traces.append(trace if other == path else np.load(other))
+            except (OSError, ValueError):
+                pass
+        n = min(t.shape[-1] for t in traces)
+        return np.stack([t[:,:n] for t in traces])
+
+    def check(self, iteration):
+        """Return True once the targets are met; records the diagnostics."""
+        if len(self.trace) < self.min_draws:
+            return False
+        chains = self._chains()
+        bulk = diagnostics.bulk_ess(chains)
+        tail = diagnostics.tail_ess(chains)
+        rhat = diagnostics.split_rhat(chains)
+        self.summary = dict(iterations=iteration, chains=chains.shape[0],
+                            max_rhat=np.max(rhat),
+                            min_bulk_ess=np.min(bulk),
+                            min_tail_ess=np.min(tail),
+                            loglik_bulk_ess=bulk[0],
+                            loglik_tail_ess=tail[0])
+        print('iteration {} chains {} R-hat {:.3f} bulk ESS {:.0f} '
+              'tail ESS {:.0f}'.format(iteration, chains.shape[0],
+                                       self.summary['max_rhat'],
+                                       self.summary['min_bulk_ess'],
+                                       self.summary['min_tail_ess']))
+        if (chains.shape[0] >= self.pool_size
+                and self.summary['max_rhat'] <= self.target_rhat
+                and self.summary['min_bulk_ess'] >= self.target_ess
+                and self.summary['min_tail_ess'] >= self.target_ess):
+            self.reason = CONVERGED
+            return True
+        return False
+
+    def attrs(self):
+        """Stopping reason and achieved diagnostics for the samples file."""
+        attrs = {'stop_reason': self.reason, 'target_rhat': self.target_rhat,
+                 'target_ess': self.target_ess}
+        attrs.update(self.summary)
+        return attrs
@@ -0,0 +1,164 @@
+"""Posterior summaries stored alongside the draws of a samples file.
+
+The ``summary`` group holds, for each parameter, the posterior ``mean`` and
+``var`` and a ``quantiles`` dataset with the levels in ``QUANTILES`` along
+its first axis.  Each has the shape of one draw.  Streamed runs accumulate
+them while sampling (Welford's algorithm for the moments, the P-squared
+algorithm of Jain & Chlamtac (1985) for the quantiles) so no pass over the
+draws is needed; files written in one go get exact values.
+"""
+import numpy as np
+
+
+SUMMARY = 'summary'
+QUANTILES = (.05, .25, .5, .75, .95)
+
+
+class P2Quantiles(object):
+    """P-squared estimates of several quantiles of each element of a vector."""
+    def __init__(self, quantiles):
+        p = np.asarray(quantiles, dtype=float)[:,np.newaxis]
+        self.p = p
+        self.n = 0
+        self.first = []
+        self.heights = None
+        self.positions = None
+        # desired marker positions and their increments, per quantile
+        self.desired = np.stack([np.ones_like(p), 1 + 2 * p, 1 + 4 * p,
+                                 3 + 2 * p, np.full_like(p, 5.)])
+        self.increments = np.stack([np.zeros_like(p), p / 2, p, (1 + p) / 2,
+                                    np.ones_like(p)])
+
+    def update(self, x):
+        self.n += 1
+        if self.n <= 5:
+            self.first.append(np.array(x, dtype=float))
+            if self.n == 5:
+                # five markers x quantiles x elements
+                first = np.sort(np.stack(self.first), axis=0)
+                self.heights = np.repeat(first[:,np.newaxis], len(self.p),
+                                         axis=1)
+                self.positions = np.broadcast_to(
+                    np.arange(1., 6.)[:,np.newaxis,np.newaxis],
+                    self.heights.shape).copy()
+                self.first = []
+            return
+        q, pos = self.heights, self.positions
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        # markers above the new observation move up one position
+        pos[1:] += x < q[1:]
+        pos[4] += x >= q[4]
+        self.desired += self.increments
+        for i in (1, 2, 3):
+            d = self.desired[i] - pos[i]
+            move = (((d >= 1) & (pos[i+1] - pos[i] > 1))
+                    | ((d <= -1) & (pos[i-1] - pos[i] < -1)))
+            if not np.any(move):
+                continue
+            s = np.sign(d)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[i] + s / (pos[i+1] - pos[i-1]) * (
+                    (pos[i] - pos[i-1] + s) * (q[i+1] - q[i])
+                    / (pos[i+1] - pos[i])
+                    + (pos[i+1] - pos[i] - s) * (q[i] - q[i-1])
+                    / (pos[i] - pos[i-1]))
+                up = s > 0
+                linear = q[i] + s * (np.where(up, q[i+1], q[i-1]) - q[i]) / (
+                    np.where(up, pos[i+1], pos[i-1]) - pos[i])
+            ok = (q[i-1] < parabolic) & (parabolic < q[i+1])
+            q[i] = np.where(move, np.where(ok, parabolic, linear), q[i])
+            pos[i] += np.where(move, s, 0)
+
+    def value(self):
+        """Quantiles x elements."""
+        if self.n < 5:
+            return np.quantile(np.stack(self.first), self.p[:,0], axis=0)
+        return self.heights[2].copy()
+
+
+class RunningSummary(object):
+    """Accumulate means, variances and quantiles of a stream of draws.
+
+    Each draw is a dict of arrays; the summaries have the same keys.  The
+    arrays are concatenated into one vector so each draw costs a fixed
+    number of vectorized operations.
+    """
+    def __init__(self, quantiles=QUANTILES):
+        self.quantiles = tuple(quantiles)
+        self.n = 0
+        self.shapes = None
+        self.mean = None
+        self.m2 = None
+        self.sketch = P2Quantiles(self.quantiles)
+
+    def update(self, draw):
+        if self.shapes is None:
+            self.shapes = [(name, np.shape(x)) for name, x in draw.items()]
+        x = np.concatenate([np.ravel(draw[name]) for name, _ in self.shapes])
+        x = x.astype(float)
+        self.n += 1
+        if self.mean is None:
+            self.mean = np.zeros_like(x)
+            self.m2 = np.zeros_like(x)
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.sketch.update(x)
+
+    def stats(self):
+        if self.n == 0:
+            return {}
+        ddof = 1 if self.n > 1 else 0
+        var = self.m2 / (self.n - ddof)
+        quantiles = self.sketch.value()
+        stats = {}
+        start = 0
+        for name, shape in self.shapes:
+            end = start + int(np.prod(shape))
+            stats[name] = dict(
+                mean=self.mean[start:end].reshape(shape),
+                var=var[start:end].reshape(shape),
+                quantiles=quantiles[:,start:end].reshape(
+                    (len(self.quantiles),) + shape))
+            start = end
+        return stats
+
+
+def exact_stats(draws, quantiles=QUANTILES):
+    """Summaries of arrays with the draws along the last axis."""
+    return {name: dict(mean=x.mean(axis=-1),
+                       var=x.var(axis=-1, ddof=1 if x.shape[-1] > 1 else 0),
+                       quantiles=np.quantile(x, quantiles, axis=-1))
+            for name, x in draws.items()}
+
+
+def write_summary(group, stats, n_draws, quantiles=QUANTILES):
+    """Write ``stats`` into the ``summary`` group of an open file or group."""
+    if SUMMARY in group:
+        del group[SUMMARY]
+    g = group.create_group(SUMMARY)
+    g.attrs['n_draws'] = n_draws
+    g.attrs['quantiles'] = np.asarray(quantiles)
+    for name, values in stats.items():
+        sub = g.create_group(name)
+        for key, value in values.items():
+            sub.create_dataset(key, data=value)
+
+
+def read_summary(group):
+    """Return the summaries in an open file or group, or None if absent.
+
+    Besides ``mean``, ``var`` and ``quantiles`` each parameter gets a
+    ``median`` entry.
+    """
+    if SUMMARY not in group:
+        return None
+    g = group[SUMMARY]
+    levels = list(g.attrs['quantiles'])
+    stats = {}
+    for name in g:
+        stats[name] = {key: g[name][key][()] for key in g[name]}
+        if .5 in levels:
+            stats[name]['median'] = stats[name]['quantiles'][levels.index(.5)]
+    return stats
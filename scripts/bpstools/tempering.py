@@ -0,0 +1,152 @@
+"""Replica exchange (parallel tempering) across a ladder of powers.
+
+One Gibbs replica runs at each zeta.  Between rounds of ``swap_every`` sweeps
+(run in parallel on a process pool) neighbouring replicas propose to exchange
+states, alternating between even and odd pairs.  The swap between powers
+zeta_i < zeta_j is accepted with probability
+
+    min(1, exp((zeta_j - zeta_i) * (loglik(x_i) - loglik(x_j))))
+
+where loglik is the Poisson log-likelihood of the counts.
+
+This is the exchange rule for replicas that target the power posteriors
+p(theta) p(x | theta)^zeta.  The Gibbs kernel of each replica only
+approximates that target for zeta < 1: it splits the counts with the
+untempered multinomial and tempers the augmented counts instead (see
+``gibbs``).  Swaps therefore exchange states between slightly different
+targets than the rule assumes, and the draws of every replica, including
+zeta = 1, are approximate power-posterior draws.  Use independent
+single-zeta chains where exact per-zeta posteriors matter; the ladder is
+meant for mixing across K and for warm-starting.
+"""
+import os
+import time
+import multiprocessing
+
+import numpy as np
+import h5py
+
+from . import gibbs, h5io
+
+
+_sampler = None
+
+
+def _init_worker(counts, K, a, alpha, a0, b0):
+    global _sampler
+    _sampler = gibbs.PowerNMFGibbs(counts, K, a=a, alpha=alpha, a0=a0, b0=b0)
+
+
+def _advance(job):
+    """Run ``iters`` sweeps at ``zeta``; ``first`` is the iteration number
+    relative to the end of warmup."""
+    state, zeta, iters, first, thin, rng = job
+    draws = []
+    for it in range(first, first + iters):
+        _sampler.sweep(state, rng, zeta=zeta)
+        if it >= 0 and it % thin == 0:
+            draws.append({k: v.copy() for k, v in state.items()})
+    return state, draws, _sampler.log_likelihood(state), rng
+
+
+def swap_log_ratio(zeta_i, zeta_j, ll_i, ll_j):
+    """Log acceptance ratio of exchanging the states of the replicas at
+    ``zeta_i`` and ``zeta_j`` whose log-likelihoods are ``ll_i`` and ``ll_j``."""
+    return (zeta_j - zeta_i) * (ll_i - ll_j)
+
+
+def run_parallel_tempering(counts, K, zetas, a, alpha, a0, b0, iters, warmup,
+                           thin=1, swap_every=10, seed=1, processes=None,
+                           verbose=True, draws=None, init=None):
+    """Return the draws at each zeta (in increasing order) and the swap
+    acceptance rate of each neighbouring pair.
+
+    ``init`` is an optional starting state for every replica, e.g. from
+    ``h5io.load_last_draw``.
+
+    ``draws`` optionally gives one sink per zeta, in increasing order, with
+    an ``extend`` method (e.g. ``h5io.DrawWriter``) to stream the draws to.
+    """
+    zetas = sorted(zetas)
+    n_temps = len(zetas)
+    seeds = np.random.SeedSequence(seed).spawn(n_temps + 1)
+    rngs = [np.random.default_rng(s) for s in seeds[:-1]]
+    swap_rng = np.random.default_rng(seeds[-1])
+    _init_worker(counts, K, a, alpha, a0, b0)
+    if init is None:
+        states = [_sampler.initialize(rng) for rng in rngs]
+    else:
+        states = [{k: np.array(v, copy=True) for k, v in init.items()}
+                  for _ in rngs]
+    lls = np.empty(n_temps)
+    if draws is None:
+        draws = [[] for _ in zetas]
+    proposed = np.zeros(n_temps - 1)
+    accepted = np.zeros(n_temps - 1)
+
+    with multiprocessing.Pool(processes or n_temps, initializer=_init_worker,
+                              initargs=(counts, K, a, alpha, a0, b0)) as pool:
+        it = 0
+        rnd = 0
+        while it < iters:
+            n = min(swap_every, iters - it)
+            jobs = [(states[i], zetas[i], n, it - warmup, thin, rngs[i])
+                    for i in range(n_temps)]
+            for i, (state, new_draws, ll, rng) in enumerate(pool.map(_advance, jobs)):
+                states[i] = state
+                draws[i].extend(new_draws)
+                lls[i] = ll
+                rngs[i] = rng
+            it += n
+            for i in range(rnd % 2, n_temps - 1, 2):
+                proposed[i] += 1
+                log_ratio = swap_log_ratio(zetas[i], zetas[i+1], lls[i],
+                                           lls[i+1])
+                if np.log(swap_rng.uniform()) < log_ratio:
+                    accepted[i] += 1
+                    states[i], states[i+1] = states[i+1], states[i]
+                    lls[i], lls[i+1] = lls[i+1], lls[i]
+            rnd += 1
+            if verbose and rnd % max(1, iters // (10 * swap_every)) == 0:
+                print('iteration {}/{} swap rates {}'.format(
+                    it, iters, np.round(accepted / np.maximum(proposed, 1), 2)))
+    return zetas, draws, accepted / np.maximum(proposed, 1)
+
+
+def fit_model_and_save_results(counts, K, samples_path, J0, eps, alpha, a, a0,
+                               b0, zetas, iters=2000, warmup=1000, thin=1,
+                               seed=1, swap_every=10, processes=None,
+                               buffer_size=100, init=None, init_from=None):
+    """Run parallel tempering and write one group per zeta to ``samples_path``.
+
+    The draws are streamed to ``samples_path + '.part'``, which is renamed
+    when the run completes.
+    """
+    start = time.time()
+    zetas = sorted(zetas)
+    part_path = samples_path + '.part'
+    model = gibbs.PowerNMFGibbs(counts, K, a=a, alpha=alpha, a0=a0, b0=b0)
+    with h5py.File(part_path, 'w') as f:
+        writers = [h5io.DrawWriter(f.create_group(h5io.zeta_group_name(zeta)),
+                                   buffer_size=buffer_size,
+                                   stats=model.draw_stats)
+                   for zeta in zetas]
+        zetas, _, swap_rates = run_parallel_tempering(
+            counts, K, zetas, a=a, alpha=alpha, a0=a0, b0=b0, iters=iters,
+            warmup=warmup, thin=thin, swap_every=swap_every, seed=seed,
+            processes=processes, draws=writers, init=init)
+        runtime = time.time() - start
+        for zeta, writer in zip(zetas, writers):
+            parameters = dict(a=a, alpha=alpha, a0=a0, b0=b0, zeta=zeta,
+                              eps=eps, J0=J0)
+            attrs = dict(engine='parallel-tempering', seed=seed)
+            if init_from is not None:
+                attrs['init_from'] = init_from
+            writer.close(parameters, runtime, attrs=attrs)
+        f.attrs['engine'] = 'parallel-tempering'
+        f.attrs['zetas'] = zetas
+        f.attrs['swap_every'] = swap_every
+        f.attrs['swap_acceptance'] = swap_rates
+        f.attrs['runtime'] = runtime
+    os.replace(part_path, samples_path)
+    return runtime
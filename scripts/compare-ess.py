@@ -0,0 +1,46 @@
+import os
+import argparse
+
+import numpy as np
+import h5py
+
+from mutsigtools import analysis
+
+from bpstools import diagnostics
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='effective samples per second of posterior samples files')
+    parser.add_argument('samples_files', nargs='+')
+    parser.add_argument('--cutoff', type=float, default=1.,
+                        help='only use loadings whose posterior mean exceeds '
+                             'the cutoff')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print('\t'.join(['file', 'engine', 'runtime (s)', 'draws',
+                     'min ESS/s', 'median ESS/s']))
+    for path in args.samples_files:
+        msi = analysis.load_samples_h5_file(path, verbose=False, cutoff=0,
+                                            sample_start=0)[0]
+        with h5py.File(path, 'r') as f:
+            engine = f.attrs.get('engine', 'nuts')
+        mu = msi.expected_loadings_samples.reshape(
+            -1, msi.expected_loadings_samples.shape[-1])
+        loadings = msi.loadings_samples.reshape(
+            -1, msi.loadings_samples.shape[-1])
+        ess = np.concatenate([
+            diagnostics.effective_sample_size(mu),
+            diagnostics.effective_sample_size(
+                loadings[loadings.mean(axis=-1) > args.cutoff])])
+        print('\t'.join([os.path.basename(path), str(engine),
+                         '{:.0f}'.format(msi.runtime), str(mu.shape[-1]),
+                         '{:.3g}'.format(np.min(ess) / msi.runtime),
+                         '{:.3g}'.format(np.median(ess) / msi.runtime)]))
+
+
+if __name__ == '__main__':
+    main()
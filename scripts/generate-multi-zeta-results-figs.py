@@ -19,6 +19,8 @@ import seaborn as sns
 
 from mutsigtools import analysis, mutsig, plotting, util
 
+from bpstools import h5io, likelihood
+
 CUTOFF = 1
 
 
@@ -44,8 +46,15 @@ def parse_args():
     return parser.parse_args()
 
 
-def expected_K(msi, start_sample=0):
+def expected_K(msi, start_sample=0, file_path=None):
     # return np.mean(msi.expected_loadings_samples[:,:,start_sample:] > CUTOFF)*msi.expected_loadings_samples.shape[1]
+    summary = None if file_path is None else h5io.load_summary(file_path)
+    if summary is not None:
+        # medians accumulated while sampling
+        return np.sum(summary[h5io.EXPECTED_LOADINGS]['median'][0] > CUTOFF)
+    if msi is None:
+        with h5py.File(file_path, 'r') as f:
+            return np.sum(np.median(f[h5io.EXPECTED_LOADINGS][()], axis = (0, 2)) > CUTOFF)
     return np.sum(np.median(msi.expected_loadings_samples, axis = (0, 2)) > CUTOFF)
 
 
@@ -65,29 +74,43 @@ def select_best_seed(sample_file_template, output_file_template, zeta, seeds, sk
         file_path = format_template(sample_file_template, seed, zeta)
         print(file_path)
         if os.path.isfile(file_path):
-            msi, counts, _ = analysis.load_samples_h5_file(
-                file_path, verbose=False, cutoff=0, sample_start=0)
-            counts = counts or all_counts
-            for pname in ['zeta', 'eps', 'J0']:
-                msi.parameters.pop(pname, None)
-            model = mutsig.MutSigModel(counts, **msi.parameters)
             start = 0
-            lml = model.log_marginal_likelihood_approx(msi.loadings_samples[:,:,start::skip],
-                msi.mutsigs_samples[:,:,start::skip],
-                msi.expected_loadings_samples[:,:,start::skip])
-            ll_n = model.log_likelihood(msi.loadings_samples[:,:,start::skip],
-                msi.mutsigs_samples[:,:,start::skip],
-                msi.expected_loadings_samples[:,:,start::skip], over = "n")
+            stats = h5io.load_draw_stats(file_path)
+            if stats is not None and all(name in stats for name in h5io.STAT_NAMES):
+                # recorded by the sampler for every saved draw, so the draws
+                # themselves are not read; the criterion is the mean log joint
+                ll_sn = stats[h5io.LOG_LIKELIHOOD_PER_SAMPLE][:,start::skip]
+                lml = np.mean(stats[h5io.LOG_LIKELIHOOD][start::skip]
+                              + stats[h5io.LOG_PRIOR][start::skip])
+                K = expected_K(None, file_path=file_path)
+                with h5py.File(file_path, 'r') as f:
+                    runtime = f.attrs.get('runtime', np.nan)
+            else:
+                msi, counts, _ = analysis.load_samples_h5_file(
+                    file_path, verbose=False, cutoff=0, sample_start=0)
+                counts = counts or all_counts
+                for pname in ['zeta', 'eps', 'J0']:
+                    msi.parameters.pop(pname, None)
+                model = mutsig.MutSigModel(counts, **msi.parameters)
+                lml = model.log_marginal_likelihood_approx(msi.loadings_samples[:,:,start::skip],
+                    msi.mutsigs_samples[:,:,start::skip],
+                    msi.expected_loadings_samples[:,:,start::skip])
+                # data term over the nonzero counts only
+                ll_sn = likelihood.log_likelihood(likelihood.as_coo(counts),
+                    msi.loadings_samples[:,:,start::skip],
+                    msi.mutsigs_samples[:,:,start::skip], per_sample = True)
+                K = expected_K(msi, file_path=file_path)
+                runtime = msi.runtime
+            # per-sample log likelihood averaged over the draws
+            ll_n = ll_sn.mean(axis = 1)
             stdv = np.std(ll_n) / np.sqrt(len(ll_n))
             print(seed, lml, stdv)
             lmls.append(lml) 
             stdvs.append(stdv)
-            ell = np.mean(model.log_likelihood(msi.loadings_samples[:,:,start::skip],
-                msi.mutsigs_samples[:,:,start::skip],
-                msi.expected_loadings_samples[:,:,start::skip]))
+            ell = np.mean(ll_sn.sum(axis = 0))
             ells.append(ell)
-            Ks.append(expected_K(msi))
-            runtimes.append(msi.runtime)
+            Ks.append(K)
+            runtimes.append(runtime)
         else:
             lmls.append(-np.inf)
             stdvs.append(0)
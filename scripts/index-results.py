@@ -0,0 +1,63 @@
+import sys
+import argparse
+
+from bpstools import catalog
+
+
+DEFAULT_COLUMNS = ('experiment', 'variant', 'model', 'K', 'zeta', 'seed',
+                   'complete', 'runtime', 'expected_K', 'name')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Index the results and figures of experiments in a '
+                    'SQLite catalog, reading only new and changed files, and '
+                    'list the matching samples files')
+    parser.add_argument('experiment_dirs', nargs='*',
+                        help='experiment directories to scan')
+    parser.add_argument('--catalog', default=catalog.CATALOG,
+                        help='(default: %(default)s)')
+    parser.add_argument('--where', nargs='+', default=[], metavar='COLUMN=VALUE',
+                        help='only list results with these values, e.g. '
+                             'zeta=0.3 complete=1 name=\'*-seed-1-*\'')
+    parser.add_argument('--columns', nargs='+', default=DEFAULT_COLUMNS)
+    parser.add_argument('--figures', action='store_true',
+                        help='list figures instead of results')
+    parser.add_argument('--quiet', action='store_true',
+                        help='only scan')
+    return parser.parse_args()
+
+
+def parse_value(value):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def main():
+    args = parse_args()
+    cat = catalog.Catalog(args.catalog)
+    read, removed = cat.scan(args.experiment_dirs)
+    print('read {} files, removed {}'.format(read, removed), file=sys.stderr)
+    if args.quiet:
+        return
+    where = {}
+    for condition in args.where:
+        key, _, value = condition.partition('=')
+        where[key] = parse_value(value)
+    if args.figures:
+        rows = cat.figures(**where)
+        columns = [c for c in args.columns if c in dict(catalog.FIGURE_COLUMNS)]
+    else:
+        rows = cat.results(**where)
+        columns = args.columns
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if row[c] is None else str(row[c]) for c in columns))
+
+
+if __name__ == '__main__':
+    main()
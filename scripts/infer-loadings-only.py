@@ -15,6 +15,8 @@ sns.set_context('notebook', font_scale=2, rc={'lines.linewidth': 3})
 
 from mutsigtools import mutsig, models, analysis, plotting
 
+from bpstools import stancache
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -36,6 +38,8 @@ def parse_args():
     parser.add_argument('--median', action='store_true')
     parser.add_argument('--MAP', action='store_true')
     parser.add_argument('--plain', action='store_true')
+    parser.add_argument('--stan-cache', metavar='DIR',
+                        help='directory in which to cache compiled Stan models')
     return parser.parse_args()
 
 
@@ -56,6 +60,8 @@ def read_new_sigs(filename, sig_prefix):
 
 def main():
     args = parse_args()
+    if args.stan_cache is not None:
+        stancache.install(args.stan_cache, modules=[models])
     
     # load count data and filter
     full_df = load_sbs_data(args.data, args.plain)
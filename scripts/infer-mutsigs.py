@@ -1,12 +1,18 @@
 import os
 import sys
+import copy
 import argparse
+import functools
+import multiprocessing
 
 import numpy as np
 import scipy as sp
 import pandas
 
-from mutsigtools import models
+from mutsigtools import models, analysis
+
+from bpstools import (diagnostics, gibbs, h5io, likelihood, optimize,
+                      profiling, sgmcmc, smc, stancache, stopping, tempering)
 
 
 MODEL_DEFAULT = 'normalized'
@@ -16,10 +22,13 @@ EPS_DEFAULT = 1e-3
 TOL_DEFAULT = 5e-1
 J0_DEFAULT = 1.0  # i.e. J0 = J
 ZETA_DEFAULT = 1.0
+ENGINE_DEFAULT = 'nuts'
+CUTOFF = 1
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('data')
+    parser.add_argument('data', nargs='?',
+                        help='counts table (not used with --manifest)')
     parser.add_argument('output', default='.')
     parser.add_argument('-m', '--model', default=MODEL_DEFAULT,
                         choices=['normalized',
@@ -54,34 +63,313 @@ def parse_args():
                         help='power likelihood factor')
     parser.add_argument('--seed', type=int, default=1,
                         help='random seed')
-    return parser.parse_args()
+    parser.add_argument('--chains', type=int, default=1,
+                        help='number of chains to run, with seeds --seed, '
+                             '--seed + 1, ...; each writes its own samples file')
+    parser.add_argument('--engine', default=ENGINE_DEFAULT,
+                        choices=['nuts', 'gibbs', 'sgmcmc', 'smc']
+                                + list(optimize.METHODS),
+                        help='sampler to use: Stan NUTS, the NumPy Gibbs '
+                             'sampler, stochastic-gradient MCMC over '
+                             'minibatches of samples, sequential Monte Carlo '
+                             'over --zetas, or a MAP or mean-field variational '
+                             'point estimate for --zeta or each of --zetas '
+                             '(all but NUTS for the normalized model only)')
+    parser.add_argument('--init-from', metavar='SAMPLES_FILE',
+                        help='initialize from the last draw (and, for NUTS, '
+                             'the adapted step size and metric) of an '
+                             'existing samples file')
+    parser.add_argument('--warm-burnin', type=int, default=None,
+                        help='number of burnin iterations to run when '
+                             'initializing with --init-from (default: '
+                             '--burnin); output names still use --burnin')
+    parser.add_argument('--parallel-tempering', action='store_true',
+                        help='run one Gibbs replica per value of --zetas and '
+                             'swap states between neighbouring powers')
+    parser.add_argument('--zetas', type=float, metavar='zeta', nargs='*',
+                        help='power likelihood factors for '
+                             '--parallel-tempering and --engine smc, map or '
+                             'advi')
+    parser.add_argument('--swap-every', type=int, default=10,
+                        help='iterations between replica swap proposals')
+    parser.add_argument('--particles', type=int, default=200,
+                        help='number of SMC particles')
+    parser.add_argument('--moves', type=int, default=5,
+                        help='Gibbs sweeps per SMC rejuvenation step')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='samples per sgmcmc minibatch')
+    parser.add_argument('--step-size', type=float, default=.01,
+                        help='initial sgmcmc step size')
+    parser.add_argument('--step-decay', type=float, default=100.,
+                        help='iterations over which the sgmcmc step size '
+                             'decays as (1 + t / step_decay) ** -0.55')
+    parser.add_argument('--local-sweeps', type=int, default=2,
+                        help='Gibbs sweeps of the minibatch loadings per '
+                             'sgmcmc step')
+    parser.add_argument('--restarts', type=int, default=8,
+                        help='random restarts per zeta for --engine map and '
+                             'advi')
+    parser.add_argument('--max-iter', type=int, default=5000,
+                        help='maximum iterations per restart')
+    parser.add_argument('--rel-tol', type=float, default=1e-6,
+                        help='relative change in the log posterior at which '
+                             'a restart has converged')
+    parser.add_argument('--cores', type=int, default=None,
+                        help='number of worker processes (default: one per '
+                             'chain, one per replica for --parallel-tempering, '
+                             'all CPUs for smc, map and advi)')
+    parser.add_argument('--checkpoint-every', type=int, default=0,
+                        help='checkpoint the run every this many iterations '
+                             '(gibbs and sgmcmc engines only)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the checkpoint of an interrupted '
+                             'run, if there is one')
+    parser.add_argument('--stop-when-converged', action='store_true',
+                        help='stop sampling once the split R-hat and bulk and '
+                             'tail ESS targets are met, treating --samples as '
+                             'a cap (gibbs and sgmcmc engines only)')
+    parser.add_argument('--target-rhat', type=float, default=1.01,
+                        help='split R-hat target for --stop-when-converged')
+    parser.add_argument('--target-ess', type=float, default=400,
+                        help='bulk and tail ESS target for --stop-when-converged')
+    parser.add_argument('--check-every', type=int, default=500,
+                        help='iterations between convergence checks')
+    parser.add_argument('--pool-dir', metavar='DIR',
+                        help='directory through which chains of the same data '
+                             'and zeta pool their convergence checks (default '
+                             'with --chains: a directory under the output)')
+    parser.add_argument('--pool-size', type=int, default=None,
+                        help='number of chains sharing --pool-dir (default: '
+                             '--chains)')
+    parser.add_argument('--prune', action='store_true',
+                        help='drop signatures whose expected loading stays '
+                             'below --prune-factor * epsilon for '
+                             '--prune-window warmup iterations (gibbs engine '
+                             'only); output is padded back to K')
+    parser.add_argument('--prune-factor', type=float, default=10.,
+                        help='pruning threshold as a multiple of epsilon')
+    parser.add_argument('--prune-window', type=int, default=200,
+                        help='warmup iterations a component must stay below '
+                             'the threshold before it is pruned')
+    parser.add_argument('--threads-per-chain', type=int, default=1,
+                        help='split each Gibbs sweep over this many blocks of '
+                             'samples, run on as many threads (gibbs engine '
+                             'only); draws depend on the number of threads')
+    parser.add_argument('--draw-buffer', type=int, default=100,
+                        help='number of draws to hold in memory before '
+                             'appending them to the samples file (gibbs '
+                             'engine and --parallel-tempering)')
+    parser.add_argument('--stan-cache', metavar='DIR',
+                        help='directory in which to cache compiled Stan models')
+    parser.add_argument('--manifest', metavar='RUNS_TSV',
+                        help='run every row of this table in one process, '
+                             'over --cores workers; its columns are data and '
+                             'optionally zeta, seed, K, a and J0, which '
+                             'override the corresponding options. Rows whose '
+                             'samples file exists are skipped')
+    args = parser.parse_args()
+    if (args.data is None) == (args.manifest is None):
+        parser.error('give either data or --manifest')
+    return args
 
 
 
-def main():
-    args = parse_args()
+def check_args(args):
+    if args.engine != 'nuts' and args.model != 'normalized':
+        raise ValueError('the {} engine only supports the normalized model'.format(
+            args.engine))
+    if args.parallel_tempering and (args.engine != 'gibbs' or not args.zetas):
+        raise ValueError('--parallel-tempering requires --engine gibbs and --zetas')
+    if args.engine == 'smc' and not args.zetas:
+        raise ValueError('the smc engine requires --zetas')
+    if args.engine == 'smc' and args.init_from is not None:
+        # the particles start from the prior at zeta = 0
+        raise ValueError('the smc engine does not take --init-from')
+    if ((args.checkpoint_every > 0 or args.resume)
+            and (args.engine not in ('gibbs', 'sgmcmc')
+                 or args.parallel_tempering)):
+        # pystan runs the whole chain in a single call, so there is no
+        # sampler state to save part way through
+        raise ValueError('--checkpoint-every and --resume require --engine '
+                         'gibbs or sgmcmc')
+    if args.stop_when_converged and (args.engine not in ('gibbs', 'sgmcmc')
+                                     or args.parallel_tempering):
+        raise ValueError('--stop-when-converged requires --engine gibbs or '
+                         'sgmcmc')
+    if args.threads_per_chain > 1 and (args.engine != 'gibbs'
+                                       or args.parallel_tempering):
+        # the pystan models have no threaded (reduce_sum) likelihood
+        raise ValueError('--threads-per-chain requires --engine gibbs')
+    if args.prune and (args.engine != 'gibbs' or args.parallel_tempering):
+        # Stan's parameter set is fixed for the whole run
+        raise ValueError('--prune requires --engine gibbs')
+    if args.chains > 1 and (args.parallel_tempering
+                            or args.engine not in ('nuts', 'gibbs', 'sgmcmc')):
+        raise ValueError('--chains cannot be combined with engines that run '
+                         'their own process pool')
+    if args.manifest is not None and (args.chains > 1 or args.parallel_tempering
+                                      or args.engine not in ('nuts', 'gibbs',
+                                                             'sgmcmc')):
+        raise ValueError('--manifest runs one chain per row and requires '
+                         '--engine nuts, gibbs or sgmcmc')
 
-    os.makedirs(args.output, exist_ok=True)
-    data = pandas.read_csv(args.data, sep='\t')
-    counts = data.iloc[:,1:].values
 
+def read_counts(args, data_path):
+    counts = pandas.read_csv(data_path, sep='\t').iloc[:,1:].values
     if args.I != counts.shape[0]:
         raise ValueError('incorrect number of substitution types')
-
     J = counts.shape[1]
     if args.max_J > 0 and J > args.max_J:
-        J = args.max_J
-        counts = counts[:,:J]
+        counts = counts[:,:args.max_J]
+    if args.engine != 'nuts':
+        # the NumPy engines only visit the nonzero counts
+        counts = likelihood.as_coo(counts)
+    return counts
+
+
+def resolve_J0(J0, J):
+    return J0 * J if J0 <= 1 else J0
+
+
+def main():
+    args = parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    check_args(args)
+    if args.manifest is not None:
+        run_manifest(args)
+        return
+    profile = profiling.Profile()
+    with profile.phase('load'):
+        counts = read_counts(args, args.data)
+    J0 = resolve_J0(args.J0, counts.shape[1])
+
+    if args.stop_when_converged and args.chains > 1 and args.pool_dir is None:
+        args.pool_dir = os.path.join(
+            args.output, 'convergence', '{}-zeta-{:.3f}-seed-{}'.format(
+                os.path.splitext(os.path.basename(args.data))[0], args.zeta,
+                args.seed))
+    if args.pool_size is None:
+        args.pool_size = args.chains
+
+    seeds = list(range(args.seed, args.seed + args.chains))
+    if args.chains == 1:
+        run_chain(args, counts, J0, args.seed, profile)
+        return
+    # forked workers share the count matrix read-only
+    global _counts
+    _counts = counts
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(min(args.cores or args.chains, args.chains)) as pool:
+        samples_paths = pool.map(
+            functools.partial(_run_chain_worker, args, J0, profile), seeds)
+    # point estimates have no draws to compare
+    if args.engine not in optimize.METHODS:
+        print_chain_diagnostics([paths[0] for paths in samples_paths])
+
+
+_counts = None
+
+
+def _run_chain_worker(args, J0, profile, seed):
+    # every chain is charged the shared load time
+    return run_chain(args, _counts, J0, seed, copy.deepcopy(profile))
 
-    J0 = args.J0
-    if J0 <= 1:
-        J0 *= J
 
+# manifest columns and their types; missing columns take the option values
+MANIFEST_COLUMNS = dict(data=str, zeta=float, seed=int, K=int, a=float,
+                        J0=float)
+
+
+def read_manifest(path):
+    runs = pandas.read_csv(path, sep='\t')
+    unknown = set(runs.columns) - set(MANIFEST_COLUMNS)
+    if 'data' not in runs.columns or unknown:
+        raise ValueError('{} must have a data column and no columns other '
+                         'than {}'.format(path, ', '.join(MANIFEST_COLUMNS)))
+    return [{name: MANIFEST_COLUMNS[name](value)
+             for name, value in row.items()}
+            for row in runs.to_dict('records')]
+
+
+def run_manifest(args):
+    """Run each row of ``args.manifest`` as its own chain in a worker pool.
+
+    Every counts table is parsed once and, like the compiled Stan models,
+    shared with the forked workers.
+    """
+    runs = read_manifest(args.manifest)
+    if args.stan_cache is not None:
+        stancache.install(args.stan_cache, modules=[models])
+        args.stan_cache = None
+    if args.pool_size is None:
+        args.pool_size = 1
+    global _counts, _load_profiles
+    _counts = {}
+    _load_profiles = {}
+    for path in sorted(set(run['data'] for run in runs)):
+        _load_profiles[path] = profiling.Profile()
+        with _load_profiles[path].phase('load'):
+            _counts[path] = read_counts(args, path)
+    jobs = []
+    for run in runs:
+        run_args = argparse.Namespace(**vars(args))
+        for name, value in run.items():
+            setattr(run_args, name, value)
+        jobs.append(run_args)
+    print('{} runs over {} counts tables'.format(len(jobs), len(_counts)))
+    ctx = multiprocessing.get_context('fork')
+    processes = min(args.cores or multiprocessing.cpu_count(), len(jobs))
+    with ctx.Pool(processes) as pool:
+        for samples_paths in pool.imap_unordered(_run_manifest_worker, jobs):
+            print('finished', ' '.join(samples_paths))
+
+
+_load_profiles = None
+
+
+def _run_manifest_worker(args):
+    counts = _counts[args.data]
+    return run_chain(args, counts, resolve_J0(args.J0, counts.shape[1]),
+                     args.seed, copy.deepcopy(_load_profiles[args.data]))
+
+
+def print_chain_diagnostics(samples_paths):
+    """Cross-chain split R-hat of label-invariant summaries of the draws."""
+    sorted_mu = []
+    for path in samples_paths:
+        msi = analysis.load_samples_h5_file(path, verbose=False, cutoff=0,
+                                            sample_start=0)[0]
+        mu = msi.expected_loadings_samples.reshape(
+            -1, msi.expected_loadings_samples.shape[-1])
+        sorted_mu.append(-np.sort(-mu, axis=0))
+    n_draws = min(mu.shape[-1] for mu in sorted_mu)
+    sorted_mu = np.stack([mu[:,:n_draws] for mu in sorted_mu])
+    Ks = np.sum(sorted_mu > CUTOFF, axis=1)
+    print('expected K per chain:', np.median(Ks, axis=-1))
+    print('split R-hat of K: {:.3f}'.format(
+        diagnostics.split_rhat(Ks[:,np.newaxis])[0]))
+    print('split R-hat of sorted expected loadings:',
+          np.round(diagnostics.split_rhat(sorted_mu), 3))
+
+
+def run_chain(args, counts, J0, seed, profile=None):
+    """Run one chain (or optimization) and return the samples files written."""
     # where to save results
     base_filename = os.path.splitext(os.path.basename(args.data))[0]
     description = args.model + '-'
-    description += 'burnin-{}-samps-{}-K-{}-seed-{}'.format(
-        args.burnin, args.samples, args.K, args.seed)
+    if args.engine == 'smc':
+        description += 'smc-particles-{}-moves-{}-K-{}-seed-{}'.format(
+            args.particles, args.moves, args.K, seed)
+    elif args.engine in optimize.METHODS:
+        description += '{}-restarts-{}-K-{}-seed-{}'.format(
+            args.engine, args.restarts, args.K, seed)
+    elif args.engine == 'sgmcmc':
+        description += 'sgmcmc-batch-{}-burnin-{}-samps-{}-K-{}-seed-{}'.format(
+            args.batch_size, args.burnin, args.samples, args.K, seed)
+    else:
+        description += 'burnin-{}-samps-{}-K-{}-seed-{}'.format(
+            args.burnin, args.samples, args.K, seed)
     if args.a != A_DEFAULT:
         description += '-a-{:.2f}'.format(args.a)
     if args.alpha != ALPHA_DEFAULT:
@@ -90,24 +378,147 @@ def main():
        description += '-eps-{:f}'.format(args.epsilon)
     if args.J0 != J0_DEFAULT:
        description += '-J0-{:.1f}'.format(J0)
-    description += '-zeta-{:.3f}'.format(args.zeta)
-    samples_path = os.path.join(args.output,
-                                '{}-{}-samples.h5'.format(base_filename,
-                                                          description))
+
+    def samples_file(suffix):
+        return os.path.join(args.output, '{}-{}{}-samples.h5'.format(
+            base_filename, description, suffix))
+
+    if args.parallel_tempering or args.engine == 'smc':
+        samples_path = samples_file('-{}-{}-zetas-{:.3f}-{:.3f}'.format(
+            'pt' if args.parallel_tempering else 'smc',
+            len(args.zetas), min(args.zetas), max(args.zetas)))
+    else:
+        samples_path = samples_file('-zeta-{:.3f}'.format(args.zeta))
+    written = [samples_path]
+    if args.engine in optimize.METHODS:
+        # one file per power
+        written = [samples_file('-zeta-{:.3f}'.format(zeta))
+                   for zeta in args.zetas or [args.zeta]]
+
+    if (args.resume or args.manifest) and all(map(os.path.exists, written)):
+        print('already completed:', ' '.join(written))
+        return written
 
     a0 = J0 * args.a + 1
     b0 = args.epsilon * (a0 - 1)
     print("a0: {} b0: {}".format(a0, b0))
 
+    # warm start from a previous run, e.g. the neighbouring zeta
+    init = None
+    burnin = args.burnin
+    control = dict(adapt_delta=.98, max_treedepth=15)
+    if args.init_from is not None:
+        init, adaptation = h5io.load_last_draw(args.init_from)
+        if init[h5io.LOADINGS].shape != (args.K, counts.shape[1]):
+            raise ValueError('{} has loadings of shape {}, expected {}'.format(
+                args.init_from, init[h5io.LOADINGS].shape,
+                (args.K, counts.shape[1])))
+        print('initializing from', args.init_from)
+        if args.warm_burnin is not None:
+            burnin = args.warm_burnin
+        control.update(adaptation)
+
     # sample from posterior and save results
-    total_iters = args.burnin + args.samples
-    models.fit_model_and_save_results(
-        args.model + '_nmf', counts, args.K, samples_path, J0=J0, 
-        eps=args.epsilon, alpha=args.alpha, 
-        a=args.a, no_rho=True, seed=args.seed, 
-        a0 = a0, b0 = b0,
-        lik_power=args.zeta, iters=total_iters, warmup=args.burnin,
-        control=dict(adapt_delta=.98, max_treedepth=15))
+    total_iters = burnin + args.samples
+    profile = profile or profiling.Profile()
+    monitor = None
+    if args.stop_when_converged:
+        monitor = functools.partial(
+            stopping.ConvergenceMonitor, rhat=args.target_rhat,
+            ess=args.target_ess, check_every=args.check_every,
+            pool_dir=args.pool_dir, pool_size=args.pool_size, chain_id=seed)
+    if args.parallel_tempering:
+        with profile.phase('sampling'):
+            tempering.fit_model_and_save_results(
+                counts, args.K, samples_path, J0=J0, eps=args.epsilon,
+                alpha=args.alpha, a=args.a, a0=a0, b0=b0, zetas=args.zetas,
+                iters=total_iters, warmup=burnin, thin=args.thin, seed=seed,
+                swap_every=args.swap_every, processes=args.cores,
+                buffer_size=args.draw_buffer, init=init,
+                init_from=args.init_from)
+    elif args.engine == 'smc':
+        with profile.phase('sampling'):
+            smc.fit_model_and_save_results(
+                counts, args.K, samples_path, J0=J0, eps=args.epsilon,
+                alpha=args.alpha, a=args.a, a0=a0, b0=b0, zetas=args.zetas,
+                particles=args.particles, moves=args.moves, seed=seed,
+                processes=args.cores)
+    elif args.engine in optimize.METHODS:
+        with profile.phase('sampling'):
+            optimize.fit_model_and_save_results(
+                counts, args.K, written, J0=J0, eps=args.epsilon,
+                alpha=args.alpha, a=args.a, a0=a0, b0=b0,
+                zetas=args.zetas or [args.zeta],
+                method=args.engine, restarts=args.restarts,
+                max_iter=args.max_iter, tol=args.rel_tol, seed=seed,
+                processes=args.cores, cutoff=CUTOFF)
+    elif args.engine == 'sgmcmc':
+        sgmcmc.fit_model_and_save_results(
+            counts, args.K, samples_path, J0=J0, eps=args.epsilon,
+            alpha=args.alpha, a=args.a, a0=a0, b0=b0, lik_power=args.zeta,
+            iters=total_iters, warmup=burnin, thin=args.thin, seed=seed,
+            batch_size=args.batch_size, step_size=args.step_size,
+            step_decay=args.step_decay, local_sweeps=args.local_sweeps,
+            init=init, init_from=args.init_from,
+            checkpoint_every=args.checkpoint_every, resume=args.resume,
+            buffer_size=args.draw_buffer, monitor=monitor, profile=profile)
+    elif args.engine == 'gibbs':
+        gibbs.fit_model_and_save_results(
+            counts, args.K, samples_path, J0=J0, eps=args.epsilon,
+            alpha=args.alpha, a=args.a, a0=a0, b0=b0, lik_power=args.zeta,
+            iters=total_iters, warmup=burnin, thin=args.thin,
+            seed=seed, init=init, init_from=args.init_from,
+            checkpoint_every=args.checkpoint_every, resume=args.resume,
+            buffer_size=args.draw_buffer, monitor=monitor,
+            prune_threshold=(args.prune_factor * args.epsilon if args.prune
+                             else None),
+            prune_window=args.prune_window, threads=args.threads_per_chain,
+            profile=profile)
+    else:
+        if args.stan_cache is not None:
+            stancache.install(args.stan_cache, modules=[models])
+        profiling.install_pystan(modules=[models])
+        profiling.activate(profile)
+        kwargs = dict()
+        if init is not None:
+            kwargs['init'] = [h5io.stan_init(init)]
+        # compilation and sampling are timed by the pystan hooks; the rest
+        # of the call is writing the results
+        with profile.phase('write'):
+            models.fit_model_and_save_results(
+                args.model + '_nmf', counts, args.K, samples_path, J0=J0,
+                eps=args.epsilon, alpha=args.alpha,
+                a=args.a, no_rho=True, seed=seed,
+                a0 = a0, b0 = b0,
+                lik_power=args.zeta, iters=total_iters, warmup=burnin,
+                control=control, **kwargs)
+            h5io.add_summary(samples_path)
+            if profile.adaptation is not None:
+                h5io.save_adaptation(samples_path, **profile.adaptation)
+            if args.model == 'normalized':
+                # the same model as the NumPy engines, so the same statistics
+                h5io.add_draw_stats(samples_path, gibbs.PowerNMFGibbs(
+                    counts, args.K, a=args.a, alpha=args.alpha, a0=a0,
+                    b0=b0).draw_stats)
+        profiling.activate(None)
+
+    if args.parallel_tempering or args.engine == 'smc':
+        # one file for the whole ladder
+        powers = [dict(zetas=list(args.zetas))]
+    elif args.engine in optimize.METHODS:
+        powers = [dict(zeta=zeta) for zeta in args.zetas or [args.zeta]]
+    else:
+        powers = [dict(zeta=args.zeta)]
+        # the only single chain with draws at the root of its file
+        profile.record_ess(samples_path)
+    for path, power in zip(written, powers):
+        profile.save(path, dict(power, engine=args.engine, model=args.model,
+                                data=args.data, seed=seed, K=args.K,
+                                cores=args.cores, files=len(written),
+                                I=args.I, J=counts.shape[1],
+                                samples=args.samples, burnin=burnin,
+                                thin=args.thin))
+    return written
 
 
 if __name__ == '__main__':
@@ -0,0 +1,94 @@
+import os
+import glob
+import json
+import argparse
+
+import numpy as np
+import pandas
+
+from bpstools import profiling
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Aggregate the -profile.json files that infer-mutsigs.py '
+                    'writes next to each samples file')
+    parser.add_argument('results_dir', nargs='+',
+                        help='directories searched recursively for profiles')
+    parser.add_argument('--by', nargs='*', default=['engine'],
+                        help='columns to group the totals by, e.g. engine '
+                             'data zeta')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of slowest runs to list')
+    parser.add_argument('--output', metavar='TSV',
+                        help='also write every run\'s profile to this table')
+    return parser.parse_args()
+
+
+def read_profiles(dirs):
+    records = []
+    for d in dirs:
+        for path in glob.glob(os.path.join(d, '**', '*-profile.json'),
+                              recursive=True):
+            with open(path) as f:
+                records.append(json.load(f))
+    return pandas.DataFrame(records)
+
+
+def main():
+    args = parse_args()
+    runs = read_profiles(args.results_dir)
+    if len(runs) == 0:
+        print('no profiles found')
+        return
+    wall = ['wall_' + p for p in profiling.PHASES]
+    cpu = ['cpu_' + p for p in profiling.PHASES]
+    runs['wall_total'] = runs[wall].sum(axis=1)
+    runs['cpu_total'] = runs[cpu].sum(axis=1)
+    # runs that wrote several samples files (e.g. map over --zetas) carry
+    # the same profile in each of them
+    weight = 1. / runs['files'].fillna(1) if 'files' in runs else 1.
+    for column in wall + cpu + ['wall_total', 'cpu_total']:
+        runs['shared_' + column] = runs[column] * weight
+    shared_wall = ['shared_' + c for c in wall]
+    shared_cpu = ['shared_' + c for c in cpu]
+
+    print('{} runs, {:.1f} wall hours, {:.1f} CPU hours'.format(
+        len(runs), runs['shared_wall_total'].sum() / 3600,
+        runs['shared_cpu_total'].sum() / 3600))
+    print('\nwall time by phase:')
+    phases = pandas.DataFrame({
+        'hours': runs[shared_wall].sum().values / 3600,
+        'cpu hours': runs[shared_cpu].sum().values / 3600,
+    }, index=profiling.PHASES)
+    phases['share'] = phases['hours'] / phases['hours'].sum()
+    print(phases.round(3).to_string())
+
+    print('\nby {}:'.format(', '.join(args.by)))
+    groups = runs.groupby(args.by)
+    table = pandas.DataFrame({
+        'runs': groups.size(),
+        'wall hours': groups['shared_wall_total'].sum() / 3600,
+        'median wall s': groups['wall_total'].median(),
+        'max peak RSS MB': groups['peak_rss_mb'].max(),
+    })
+    for column in ['ess_per_second', 'mean_treedepth', 'divergences',
+                   'gradient_evaluations']:
+        if column in runs:
+            table['median ' + column.replace('_', ' ')] = \
+                groups[column].median()
+    print(table.round(2).to_string())
+
+    print('\nslowest runs:')
+    slowest = runs.sort_values('wall_total', ascending=False).head(args.top)
+    print(slowest[['samples_file', 'wall_total'] + wall].assign(
+        samples_file=slowest['samples_file'].map(os.path.basename)
+    ).round(1).to_string(index=False))
+
+    if args.output is not None:
+        runs.drop(columns=[c for c in runs if c.startswith('shared_')]).to_csv(
+            args.output, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
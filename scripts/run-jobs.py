@@ -0,0 +1,28 @@
+import os
+import sys
+import argparse
+
+from bpstools import localrun
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run a file of jobs (see bpstools.localrun.save_jobs) on '
+                    'this machine, e.g. one allocation of submit-nmf-jobs.py '
+                    '--pack; jobs whose outputs exist are skipped')
+    parser.add_argument('jobs_file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='jobs run at once (default: %(default)s)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    status = localrun.run_jobs(localrun.load_jobs(args.jobs_file), args.workers)
+    failed = localrun.failed(status)
+    if len(failed) > 0:
+        sys.exit('failed or not run: ' + ' '.join(failed))
+
+
+if __name__ == '__main__':
+    main()
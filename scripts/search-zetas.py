@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+import argparse
+import getpass
+import os
+import re
+import sys
+import time
+import subprocess
+
+import numpy as np
+
+from bpstools import catalog
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run NMF chains on a coarse ladder of zetas, then only '
+                    'at midpoints of the intervals where the estimated K '
+                    'changes or the log likelihood curve bends most, until '
+                    'those intervals are narrower than --tolerance.  Runs are '
+                    'submitted with submit-nmf-jobs.py, which gets any '
+                    'options not listed here (e.g. --slurm, --pack).  Runs '
+                    'whose jobs end without a samples file are left out.')
+    parser.add_argument('prefix')
+    parser.add_argument('experiment_dir')
+    parser.add_argument('output_template')
+    parser.add_argument('--seeds', metavar='seed', nargs='+', required=True)
+    parser.add_argument('--zetas', type=float, metavar='zeta', nargs='+',
+                        required=True, help='the coarse ladder')
+    parser.add_argument('--exp-list', nargs='*', default=[])
+    parser.add_argument('--tolerance', type=float, default=.05,
+                        help='width to which the changes are bracketed '
+                             '(default: %(default)s)')
+    parser.add_argument('--max-rounds', type=int, default=6,
+                        help='refinements per data set (default: %(default)s)')
+    parser.add_argument('--poll', type=float, default=60,
+                        help='seconds between checks for finished runs '
+                             '(default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=48,
+                        help='hours to wait for the runs of one round before '
+                             'going on without the unfinished ones '
+                             '(default: %(default)s)')
+    parser.add_argument('--catalog', default=catalog.CATALOG,
+                        help='results catalog, on local disk, also passed to '
+                             'submit-nmf-jobs.py (default: %(default)s)')
+    args, submit_opts = parser.parse_known_args()
+    # the file names have zeta to three decimals
+    args.tolerance = max(args.tolerance, .002)
+    # where submit-nmf-jobs.py runs the chains
+    backend = argparse.ArgumentParser(add_help=False)
+    backend.add_argument('--slurm', action='store_true')
+    backend.add_argument('--backend')
+    opts, _ = backend.parse_known_args(submit_opts)
+    args.backend = opts.backend or ('slurm' if opts.slurm else 'uger')
+    return args, submit_opts
+
+
+def active_jobs(backend, job_ids):
+    """The ones of ``job_ids`` still queued or running."""
+    if backend == 'local' or len(job_ids) == 0:
+        return set()
+    if backend == 'slurm':
+        cmd = ['squeue', '--noheader', '--format=%F', '--user',
+               getpass.getuser()]
+    else:
+        cmd = ['qstat', '-u', getpass.getuser()]
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return set(job_ids) & set(line.split()[0]
+                              for line in out.stdout.splitlines() if line.split())
+
+
+def refine(zetas, Ks, log_liks, tolerance):
+    """Midpoints of the intervals wider than ``tolerance`` that bracket a
+    change of K or the sharpest bend of the log likelihood (the largest
+    second difference, as in the zeta-vs-dd-log-lik plot)."""
+    zetas = np.asarray(zetas)
+    intervals = set(i for i in range(len(zetas) - 1) if Ks[i] != Ks[i + 1])
+    if len(zetas) >= 3:
+        d_ys = np.diff(log_liks) / np.diff(zetas)
+        dd_ys = np.abs(2 * np.diff(d_ys) / (zetas[2:] - zetas[:-2]))
+        bend = np.argmax(dd_ys) + 1
+        intervals.update([bend - 1, bend])
+    return sorted(set(round((zetas[i] + zetas[i + 1]) / 2, 3) for i in intervals
+                      if zetas[i + 1] - zetas[i] > tolerance + 1e-9))
+
+
+def main():
+    args, submit_opts = parse_args()
+    exps = args.exp_list if len(args.exp_list) > 0 else [None]
+    experiment = os.path.basename(os.path.normpath(args.experiment_dir))
+    zeta_dir = os.path.join(args.experiment_dir, "zetas")
+    os.makedirs(zeta_dir, exist_ok = True)
+
+    def results_path(exp, seed, zeta):
+        return os.path.normpath(os.path.join(args.experiment_dir, "results", args.output_template.format(exp = exp or "", seed = seed, zeta = zeta)))
+
+    cat = catalog.Catalog(args.catalog)
+    done = {exp: [] for exp in exps}
+    pending = {exp: sorted(set(round(z, 3) for z in args.zetas)) for exp in exps}
+    for rnd in range(args.max_rounds + 1):
+        pending = {exp: zetas for exp, zetas in pending.items() if len(zetas) > 0}
+        if len(pending) == 0:
+            break
+        job_ids = []
+        for exp, zetas in pending.items():
+            cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "submit-nmf-jobs.py"),
+                   args.prefix, args.experiment_dir, args.output_template,
+                   "--seeds"] + args.seeds + ["--zetas"] + [str(z) for z in zetas] + ["--catalog", args.catalog]
+            if exp is not None:
+                cmd += ["--exp-list", exp]
+            print("round {}: {}".format(rnd, " ".join(cmd + submit_opts)))
+            sys.stdout.flush()
+            # a failed chain is left out below, not a reason to stop
+            out = subprocess.run(cmd + submit_opts, capture_output = True, text = True)
+            sys.stdout.write(out.stdout)
+            sys.stderr.write(out.stderr)
+            job_ids += re.findall(r"^Submitted job (\S+)$", out.stdout, re.MULTILINE)
+
+        # wait for every chain of the round to finish or its job to end
+        wanted = set(results_path(exp, s, z) for exp, zetas in pending.items()
+                     for z in zetas for s in args.seeds)
+        deadline = time.time() + 3600 * args.timeout
+        while True:
+            # asked before the scan, so a job that ended has its file scanned
+            active = active_jobs(args.backend, job_ids)
+            cat.scan([args.experiment_dir])
+            finished = wanted & cat.paths(experiment = experiment, complete = 1)
+            if finished == wanted:
+                break
+            if len(active) == 0:
+                print("jobs ended without results, leaving out: " + " ".join(sorted(wanted - finished)))
+                break
+            if time.time() > deadline:
+                print("not finished after {} hours, leaving out: {}".format(args.timeout, " ".join(sorted(wanted - finished))))
+                break
+            time.sleep(args.poll)
+
+        for exp, zetas in pending.items():
+            done[exp] = sorted(done[exp] + zetas)
+            # the best seed of each zeta, as select_best_seed picks it but by
+            # the mean log likelihood the sampler recorded
+            curve = []
+            for zeta in done[exp]:
+                rows = [r for s in args.seeds for r in cat.results(path = results_path(exp, s, zeta))
+                        if r["mean_log_likelihood"] is not None and r["expected_K"] is not None]
+                if len(rows) == 0:
+                    print("no log likelihood or summary for zeta {}; leaving it out".format(zeta))
+                    continue
+                best = max(rows, key = lambda r: r["mean_log_likelihood"])
+                curve.append((zeta, best["expected_K"], best["mean_log_likelihood"]))
+            print("\n{}:".format(exp or args.prefix))
+            for zeta, K, ll in curve:
+                print("  zeta {:.3f}  K {}  log lik {:.1f}".format(zeta, K, ll))
+            with open(os.path.join(zeta_dir, "{}.txt".format(exp or "original_counts")), "w") as f:
+                f.write(" ".join("{:.3f}".format(z) for z in done[exp]) + "\n")
+            zetas, Ks, log_liks = zip(*curve) if len(curve) > 0 else ((), (), ())
+            pending[exp] = [z for z in refine(zetas, Ks, log_liks, args.tolerance) if z not in done[exp]]
+    cat.close()
+
+    for exp in exps:
+        print("{}: ran {} zetas: {}".format(exp or args.prefix, len(done[exp]), " ".join("{:.3f}".format(z) for z in done[exp])))
+    unresolved = [exp or args.prefix for exp, zetas in pending.items() if len(zetas) > 0]
+    if len(unresolved) > 0:
+        print("not bracketed to {} after {} rounds: {}".format(args.tolerance, args.max_rounds, " ".join(unresolved)))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,14 @@
 
 import argparse
 import os
+import re
 import sys
+import time
+import subprocess
+
+import h5py
+
+from bpstools import catalog, localrun, resources
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -12,49 +19,327 @@ def parse_args():
     parser.add_argument('--seeds', metavar='seed', nargs='*')
     parser.add_argument('--zetas', type=float, metavar='zeta', nargs='*')
     parser.add_argument('--exp-list', nargs='*')
-    parser.add_argument('--slurm', action='store_true')
-    return parser.parse_args()
+    parser.add_argument('--slurm', action='store_true',
+                        help='same as --backend slurm')
+    parser.add_argument('--backend', choices=['slurm', 'uger', 'local'],
+                        help='submit array jobs with sbatch (slurm) or qsub '
+                             '(uger, the default without --slurm), or run '
+                             'the chains here with a pool of --workers '
+                             'processes (local)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='chains run at once with --backend local '
+                             '(default: %(default)s)')
+    parser.add_argument('--table', action='store_true',
+                        help='write the missing runs to a parameter table '
+                             'and submit one job array over its rows (one '
+                             'per zeta with --warm-start) instead of one '
+                             'array per zeta and data set')
+    parser.add_argument('--max-concurrent', type=int, default=None,
+                        help='with --table, tasks of an array run at once '
+                             '(sbatch --array=...%%N, qsub -tc N)')
+    parser.add_argument('--pack', action='store_true',
+                        help='bundle the chains into jobs of --pack-cores '
+                             'cores, --pack-memory GB and --pack-hours each, '
+                             'sized from the runtime and memory predicted '
+                             'for every chain; each job runs its chains with '
+                             'a local pool (slurm/uger backends)')
+    parser.add_argument('--pack-cores', type=int, default=8)
+    parser.add_argument('--pack-memory', type=float, default=64,
+                        help='GB (default: %(default)s)')
+    parser.add_argument('--pack-hours', type=float, default=12,
+                        help='walltime of each job (default: %(default)s)')
+    parser.add_argument('--profile-dirs', nargs='*', default=[],
+                        help='directories of past runs\' -profile.json files '
+                             'to predict runtimes from, besides the '
+                             'experiment\'s results directory')
+    parser.add_argument('--catalog', default=catalog.CATALOG,
+                        help='results catalog (see index-results.py) used '
+                             'to find finished runs, on local disk '
+                             '(default: %(default)s)')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='run the zetas in increasing order, initializing '
+                             'each from the results of the previous zeta')
+    parser.add_argument('--screen', metavar='TEMPLATE',
+                        help='template, like output_template, of MAP or '
+                             'variational results (infer-mutsigs.py --engine '
+                             'map/advi); zetas whose estimated K matches both '
+                             'neighbouring zetas are skipped')
+    parser.add_argument('--init-from-screen', action='store_true',
+                        help='initialize chains from the --screen results '
+                             '(after the first zeta with --warm-start)')
+    args = parser.parse_args()
+    if args.pack and args.table:
+        parser.error('--pack and --table are alternatives')
+    return args
+
+
+def submit(cmd):
+    """Submit ``cmd`` and return its job id; exit if the submission failed,
+    so later jobs are never chained onto a missing id."""
+    print(cmd)
+    out = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+    if out.returncode != 0:
+        sys.exit("submission failed (exit status {}): {}".format(out.returncode, out.stderr.strip()))
+    # sbatch --parsable prints "jobid[;cluster]", qsub -terse "jobid[.tasks]"
+    job_id = out.stdout.strip().split(';')[0].split('.')[0]
+    if job_id == "":
+        sys.exit("submission printed no job id: " + out.stderr.strip())
+    print("Submitted job " + job_id)
+    return job_id
+
+
+def run_settings(script):
+    """Shell variables assigned in run_nmf.sh, e.g. ``K`` and ``SAMPLES``."""
+    settings = {}
+    with open(script) as f:
+        for line in f:
+            m = re.match(r'([A-Z_]+)=(.*)$', line.strip())
+            if m is not None:
+                settings[m.group(1)] = m.group(2).strip('"')
+    return settings
+
+
+def num_samples(data_path):
+    with open(data_path) as f:
+        return len(f.readline().rstrip('\n').split('\t')) - 1
+
+
+def pack_jobs(args, backend, jobs, runs):
+    """Submit ``jobs`` bundled into allocations; ``runs`` maps a job name to
+    its row (see ``TABLE_COLUMNS``).  Warm-started chains stay in one
+    allocation."""
+    settings = run_settings(os.path.join(args.experiment_dir, "experiment_scripts", "run_nmf.sh"))
+    engine = re.search(r"--engine (\S+)", settings.get("OPTS", ""))
+    model = resources.CostModel("nuts" if engine is None else engine.group(1),
+                                resources.read_profiles([os.path.join(args.experiment_dir, "results")] + args.profile_dirs))
+    threads = re.search(r"--threads-per-chain (\d+)", settings.get("OPTS", ""))
+    threads = 1 if threads is None else int(threads.group(1))
+    I, K = int(settings["I"]), int(settings["K"])
+    samples, burnin, thin = int(settings["SAMPLES"]), int(settings["BURNIN"]), int(settings.get("THIN", 1))
+
+    def predict(name):
+        zeta, data_file = runs[name][:2]
+        J = min(int(settings["J"]), num_samples(os.path.join(args.experiment_dir, "synthetic_data", data_file)))
+        return (model.seconds(I, J, K, samples, burnin, zeta), model.memory_gb(I, J, K, samples, burnin, thin))
+
+    # a chain is a job and the jobs warm-started from it
+    chains = {}
+    chain_of = {}
+    for job in jobs:
+        chain_of[job.name] = chain_of[job.deps[0]] if job.deps else job.name
+        chains.setdefault(chain_of[job.name], []).append(job)
+    items = []
+    for chain, members in chains.items():
+        predictions = [predict(job.name) for job in members]
+        items.append((chain, sum(p[0] for p in predictions), max(p[1] for p in predictions)))
+
+    pack_dir = os.path.join(args.experiment_dir, "packs")
+    os.makedirs(pack_dir, exist_ok = True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    run_jobs = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run-jobs.py")
+    packed = resources.pack(items, max(1, args.pack_cores // threads), args.pack_hours * 3600, args.pack_memory)
+    for i, (keys, workers, memory, seconds) in enumerate(packed):
+        members = [job for key in keys for job in chains[key]]
+        jobs_file = os.path.join(pack_dir, "{}-{}.json".format(stamp, i))
+        localrun.save_jobs(jobs_file, members)
+        name = "{}_NMF_pack_{}".format(args.prefix, i)
+        wrap = "{} {} {} --workers {}".format(sys.executable, run_jobs, jobs_file, workers)
+        print("{}: {} runs of {} chains, {} at once".format(name, len(members), len(keys), workers))
+        if backend == "slurm":
+            submit("sbatch --parsable -c {} --mem={}G -t {} --job-name={} -o {} --wrap '{}'".format(
+                workers * threads, memory, resources.slurm_time(seconds), name,
+                os.path.join(args.experiment_dir, "logs", name + "_%j.out"), wrap))
+        else:
+            # h_vmem is per slot
+            submit("qsub -terse -b y -cwd -pe smp {} -l h_vmem={}G -l h_rt={} -N {} -j y -o {} {}".format(
+                workers * threads, -(-memory // (workers * threads)), resources.uger_time(seconds), name,
+                os.path.join(args.experiment_dir, "logs"), wrap))
+
+
+# columns of a --table parameter table, as run_nmf.sh reads them; init,
+# which may be empty, has to stay last
+TABLE_COLUMNS = ("zeta", "data_file", "seed", "resume", "init")
+
+
+def submit_tables(args, backend, jobs, runs):
+    """Submit the rows of ``runs`` as job arrays over parameter tables.
+
+    Without warm starts all rows go in one table.  With them each zeta gets a
+    table, whose array waits for the previous one.
+    """
+    table_dir = os.path.join(args.experiment_dir, "tables")
+    os.makedirs(table_dir, exist_ok = True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    run_nmf = os.path.join(args.experiment_dir, "experiment_scripts", "run_nmf.sh")
+    levels = []
+    for job in jobs:
+        zeta = runs[job.name][0]
+        if not args.warm_start:
+            zeta = None
+        if len(levels) == 0 or levels[-1][0] != zeta:
+            levels.append((zeta, []))
+        levels[-1][1].append(runs[job.name])
+    previous = None
+    for i, (zeta, rows) in enumerate(levels):
+        table = os.path.abspath(os.path.join(table_dir, "{}{}.tsv".format(stamp, "" if zeta is None else "-zeta-{}".format(zeta))))
+        with open(table, "w") as f:
+            f.write("\t".join(TABLE_COLUMNS) + "\n")
+            for row in rows:
+                f.write("\t".join(map(str, row)) + "\n")
+        name = "{}_{}_NMF{}".format(args.experiment_dir, args.prefix, "" if zeta is None else "_{}".format(zeta))
+        if backend == "slurm":
+            limit = "" if args.max_concurrent is None else "%{}".format(args.max_concurrent)
+            depend = "" if previous is None else " --dependency=afterok:{}".format(previous)
+            cmd = "sbatch --parsable{} --array=1-{}{} --job-name={} {} --table {}".format(depend, len(rows), limit, name, run_nmf, table)
+        else:
+            limit = "" if args.max_concurrent is None else " -tc {}".format(args.max_concurrent)
+            depend = "" if previous is None else " -hold_jid {}".format(previous)
+            cmd = "qsub -terse{} -t 1-{}{} -N {} {} --table {}".format(depend, len(rows), limit, name, run_nmf, table)
+        previous = submit(cmd)
+
+
+def screen_zetas(zetas, Ks):
+    """Zetas worth sampling: those at the ends of each run of equal K."""
+    keep = []
+    for i, zeta in enumerate(zetas):
+        neighbours = Ks[max(i - 1, 0):i] + Ks[i + 1:i + 2]
+        if Ks[i] is None or len(neighbours) < 2 or any(K != Ks[i] for K in neighbours):
+            keep.append(zeta)
+    return keep
+
+
+def estimated_K(path):
+    if not os.path.exists(path):
+        return None
+    with h5py.File(path, 'r') as f:
+        return int(f.attrs['K_estimate'])
 
 
 def main():
     args = parse_args()
     
+    backend = args.backend or ("slurm" if args.slurm else "uger")
     any_submit = False
-    if args.slurm:
-        batch_template = "sbatch --array={seeds} --job-name={exp}_{prefix}_NMF_{zeta} " + os.path.join(args.experiment_dir, "experiment_scripts", "run_nmf.sh") + " {zeta} {data_file}"
+    if backend == "slurm":
+        batch_template = "sbatch --parsable{depend}{resume} --array={seeds} --job-name={exp}_{prefix}_NMF_{zeta} " + os.path.join(args.experiment_dir, "experiment_scripts", "run_nmf.sh") + " {zeta} {data_file}{init}"
+        depend_template = " --dependency=afterok:{}"
+        resume_opt = " --export=ALL,RESUME=1"
+        id_sep = ":"
     else:
-        batch_template = "qsub -t {seeds} -N {exp}_{prefix}_NMF_{zeta} " + os.path.join(args.experiment_dir, "experiment_scripts", "run_nmf.sh") + " {zeta} {data_file}"
+        batch_template = "qsub -terse{depend}{resume} -t {seeds} -N {exp}_{prefix}_NMF_{zeta} " + os.path.join(args.experiment_dir, "experiment_scripts", "run_nmf.sh") + " {zeta} {data_file}{init}"
+        depend_template = " -hold_jid {}"
+        resume_opt = " -v RESUME=1"
+        id_sep = ","
+    run_nmf = os.path.join(args.experiment_dir, "experiment_scripts", "run_nmf.sh")
+    local_jobs = []
+    local_runs = {}
+    # packed chains are run by a local pool inside each job; table rows are
+    # collected and submitted together
+    run_here = backend == "local" or args.pack or args.table
+    # one directory scan instead of a stat of every expected results file
+    cat = catalog.open_scanned(args.experiment_dir, args.catalog)
+    experiment_name = os.path.basename(os.path.normpath(args.experiment_dir))
+    present = cat.paths(experiment = experiment_name)
+    existing = cat.paths(experiment = experiment_name, complete = 1)
+    cat.close()
 
-    for zeta in args.zetas:
-        # Stage III
-        for exp in args.exp_list:
-            run_seeds = []
-            for s in args.seeds:
-                if not os.path.exists(os.path.join(args.experiment_dir, "results", args.output_template.format(exp = exp, seed = s, zeta = zeta))):
-                    run_seeds.append(s)
-                    # print("Missing " + os.path.join(args.experiment_dir, "results", args.output_template.format(exp = exp, seed = s, zeta = zeta)))
-                    any_submit = True
+    def results_path(exp, seed, zeta):
+        return os.path.join(args.experiment_dir, "results", args.output_template.format(exp = exp, seed = seed, zeta = zeta))
 
-            if len(run_seeds) > 0:
-                experiment = args.prefix + "-seed-" + exp
-                cmd = batch_template.format(seeds = ",".join(map(str, run_seeds)), exp = args.experiment_dir, prefix = experiment, zeta = zeta, data_file = experiment + ".tsv")
-                print(cmd)
-                os.system(cmd)
+    def screen_path(exp, seed, zeta):
+        return os.path.join(args.experiment_dir, "results", args.screen.format(exp = exp, seed = seed, zeta = zeta))
 
-        # Stage V
-        if len(args.exp_list) == 0:
+    zetas = sorted(args.zetas) if args.warm_start else args.zetas
+    # Stage V runs on the original counts rather than on synthetic experiments
+    exps = args.exp_list if len(args.exp_list) > 0 else [None]
+    screened = {}
+    for exp in exps:
+        exp_name = "" if exp is None else exp
+        screened[exp] = zetas
+        if args.screen is not None:
+            by_zeta = sorted(zetas)
+            Ks = [estimated_K(screen_path(exp_name, args.seeds[0], zeta)) for zeta in by_zeta]
+            screened[exp] = screen_zetas(by_zeta, Ks)
+            skipped = [zeta for zeta in zetas if zeta not in screened[exp]]
+            if len(skipped) > 0:
+                print("Skipping zetas {} for {} (same estimated K as both neighbours)".format(" ".join(map(str, skipped)), exp_name or args.prefix))
+    prev_jobs = {}
+    prev_zetas = {}
+    for zeta in zetas:
+        for exp in exps:
+            exp_name = "" if exp is None else exp
+            if zeta not in screened[exp]:
+                continue
             run_seeds = []
+            resume_seeds = []
             for s in args.seeds:
-                if not os.path.exists(os.path.join(args.experiment_dir, "results", args.output_template.format(exp = "", seed = s, zeta = zeta))):
+                path = results_path(exp_name, s, zeta)
+                if os.path.exists(path + ".ckpt"):
+                    if os.path.normpath(path) in present:
+                        # the samples file was written; only the checkpoint
+                        # was left behind
+                        print("Already complete, skipping: " + path)
+                        continue
+                    print("Resuming from checkpoint: " + path)
+                    resume_seeds.append(s)
+                elif os.path.normpath(path) not in existing:
+                    # print("Missing " + path)
                     run_seeds.append(s)
-                    any_submit = True
 
-            if len(run_seeds) > 0:
-                cmd = batch_template.format(seeds = ",".join(map(str, run_seeds)), exp = args.experiment_dir, prefix = args.prefix, zeta = zeta, data_file = args.prefix + "_original_counts.tsv")
-                print(cmd)
-                os.system(cmd)
+            if len(run_seeds) + len(resume_seeds) > 0:
+                any_submit = True
+                if exp is None:
+                    experiment = args.prefix
+                    data_file = args.prefix + "_original_counts.tsv"
+                else:
+                    experiment = args.prefix + "-seed-" + exp
+                    data_file = experiment + ".tsv"
+                depend = init = ""
+                # run_nmf.sh substitutes the array task's seed for @SEED@
+                if args.warm_start and exp in prev_zetas:
+                    init = " " + results_path(exp_name, "@SEED@", prev_zetas[exp])
+                    if prev_jobs.get(exp):
+                        depend = depend_template.format(prev_jobs[exp])
+                elif args.init_from_screen:
+                    init = " " + screen_path(exp_name, "@SEED@", zeta)
+                if run_here:
+                    names = {}
+                    for s in sorted(run_seeds + resume_seeds, key = args.seeds.index):
+                        resume = int(s in resume_seeds)
+                        name = "{}_NMF_{}_{}".format(experiment, zeta, s)
+                        # the previous zeta's chain of this seed, if it is being run too
+                        deps = [prev_jobs[exp][s]] if depend and s in prev_jobs[exp] else []
+                        # run_nmf.sh takes the seed from the array task id
+                        local_jobs.append(localrun.Job(
+                            name, ["bash", run_nmf, zeta, data_file] + ([init.strip()] if init else []),
+                            deps = deps, outputs = [results_path(exp_name, s, zeta)],
+                            env = dict(SLURM_ARRAY_TASK_ID = s, SGE_TASK_ID = s, RESUME = resume),
+                            log = os.path.join(args.experiment_dir, "logs", name)))
+                        names[s] = name
+                        local_runs[name] = (zeta, data_file, s, resume, init.strip().replace("@SEED@", s))
+                    prev_jobs[exp] = names
+                else:
+                    # resumed chains get an array of their own, run with --resume
+                    ids = []
+                    for seeds, resume in ((run_seeds, ""), (resume_seeds, resume_opt)):
+                        if len(seeds) > 0:
+                            cmd = batch_template.format(seeds = ",".join(map(str, seeds)), exp = args.experiment_dir, prefix = experiment, zeta = zeta, data_file = data_file, depend = depend, resume = resume, init = init)
+                            ids.append(submit(cmd))
+                    prev_jobs[exp] = id_sep.join(ids)
+            else:
+                prev_jobs.pop(exp, None)
+            prev_zetas[exp] = zeta
 
-    if not any_submit:
+    if len(local_jobs) > 0 and backend != "local" and args.pack:
+        pack_jobs(args, backend, local_jobs, local_runs)
+    elif len(local_jobs) > 0 and backend != "local":
+        submit_tables(args, backend, local_jobs, local_runs)
+    elif len(local_jobs) > 0:
+        failed = localrun.failed(localrun.run_jobs(local_jobs, args.workers))
+        if len(failed) > 0:
+            sys.exit("failed or not run: " + " ".join(failed))
+        print("All sampling completed. Proceed to next step.")
+    elif not any_submit:
         print("All sampling completed. Proceed to next step.")
 
 
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+
+@pytest.fixture
+def counts():
+    """A small counts table drawn from the NMF model."""
+    rng = np.random.default_rng(0)
+    mutsigs = rng.dirichlet(np.ones(12), size=3)
+    loadings = rng.gamma(2., 50., size=(3, 8))
+    return rng.poisson(mutsigs.T.dot(loadings))
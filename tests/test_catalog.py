@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+
+from bpstools import catalog, h5io
+
+
+NAME = ('synthetic-20-lung-seed-1-normalized-burnin-10-samps-20-K-3-seed-{seed}'
+        '-a-0.50-J0-10.0-zeta-{zeta:.3f}-samples.h5')
+
+
+def write_run(results, seed, zeta, K=3, I=6, J=4, S=5):
+    rng = np.random.default_rng(seed)
+    draws = {h5io.LOADINGS: rng.gamma(1., 10., (K, J, S)),
+             h5io.MUTSIGS: rng.dirichlet(np.ones(I), (K, S)).transpose(0, 2, 1),
+             h5io.EXPECTED_LOADINGS: np.full((1, K, S), 10.),
+             h5io.LOG_LIKELIHOOD: np.full(S, -100. * zeta)}
+    path = os.path.join(results, NAME.format(seed=seed, zeta=zeta))
+    h5io.save_samples(path, draws, dict(a=.5, J0=10., zeta=zeta), 12.,
+                      attrs=dict(engine='gibbs', seed=seed))
+    return os.path.normpath(path)
+
+
+def test_scan_and_query(tmp_path):
+    exp_dir = tmp_path / 'lung-test'
+    results = str(exp_dir / 'results')
+    figures = exp_dir / 'figures' / 'final'
+    os.makedirs(results)
+    os.makedirs(str(figures))
+    done = [write_run(results, seed, .3) for seed in (1, 2)]
+    other = write_run(results, 1, .5)
+    interrupted = write_run(results, 3, .3)
+    open(interrupted + '.ckpt', 'w').close()
+    (figures / 'best-seed-comparison-zeta-0.300.pdf').write_text('')
+
+    cat = catalog.Catalog(str(tmp_path / 'catalog.sqlite'))
+    assert cat.scan([str(exp_dir)]) == (5, 0)
+    assert cat.paths(experiment='lung-test', zeta=.3) == set(done
+                                                           + [interrupted])
+    assert cat.paths(experiment='lung-test', zeta=.3, complete=1) == set(done)
+    row, = cat.results(path=other)
+    assert (row['K'], row['seed'], row['n_draws'], row['expected_K']) \
+        == (3, 1, 5, 3)
+    assert row['variant'] == '1' and np.isclose(row['mean_log_likelihood'],
+                                                -50.)
+    # substring match, as ``ls | grep`` was
+    assert cat.paths(name='*-seed-2-*') == set([done[1]])
+    figure, = cat.figures(directory=str(figures),
+                          name='best-seed-comparison-zeta-*.pdf')
+    assert figure['zeta'] == .3
+
+    # only changed files are read again, and removed ones dropped
+    assert cat.scan([str(exp_dir)]) == (0, 0)
+    # the checkpoint goes after the samples file is in place
+    os.remove(interrupted + '.ckpt')
+    os.remove(other)
+    assert cat.scan([str(exp_dir)]) == (1, 1)
+    assert cat.paths(experiment='lung-test', complete=1) == set(done
+                                                                + [interrupted])
+    cat.close()
@@ -0,0 +1,52 @@
+import numpy as np
+
+from bpstools import diagnostics
+
+
+def ar1(rng, phi, shape):
+    """AR(1) chains with unit marginal variance, draws along the last axis."""
+    noise = rng.normal(scale=np.sqrt(1 - phi ** 2), size=shape)
+    x = np.empty(shape)
+    x[..., 0] = rng.normal(size=shape[:-1])
+    for t in range(1, shape[-1]):
+        x[..., t] = phi * x[..., t - 1] + noise[..., t]
+    return x
+
+
+def test_split_rhat_by_hand():
+    # halves [1, 3] and [5, 7]: W = 2, B = 2 * var([2, 6]) = 16 and
+    # var+ = W / 2 + B / 2 = 9
+    assert np.isclose(diagnostics.split_rhat([[1., 3., 5., 7.]]), np.sqrt(9 / 2))
+    # constant chains count as converged
+    assert diagnostics.split_rhat(np.ones((2, 10))) == 1.
+
+
+def test_split_rhat_flags_chains_that_disagree():
+    rng = np.random.default_rng(0)
+    chains = rng.normal(size=(4, 2000))
+    assert abs(diagnostics.split_rhat(chains) - 1) < .01
+    chains[0] += 3.
+    assert diagnostics.split_rhat(chains) > 1.3
+
+
+def test_ess_matches_ar1_integrated_autocorrelation_time():
+    # for AR(1) with coefficient phi, ESS = S (1 - phi) / (1 + phi)
+    rng = np.random.default_rng(1)
+    S = 20000
+    assert abs(diagnostics.effective_sample_size(rng.normal(size=S)) / S - 1) < .1
+    for phi in (.5, .9):
+        x = ar1(rng, phi, (4, S))
+        expected = (1 - phi) / (1 + phi)
+        assert np.isclose(diagnostics.autocorrelation(x)[:, 1].mean(), phi, atol=.02)
+        ess = diagnostics.effective_sample_size(x)
+        assert np.all(np.abs(ess / (S * expected) - 1) < .15)
+        assert abs(diagnostics.multichain_ess(x) / (4 * S * expected) - 1) < .15
+
+
+def test_bulk_ess_is_rank_based():
+    rng = np.random.default_rng(2)
+    x = ar1(rng, .5, (4, 2000))
+    assert np.isclose(diagnostics.bulk_ess(x), diagnostics.bulk_ess(np.exp(x)))
+    # a chain stuck elsewhere cuts the pooled ESS
+    x[0] += 5.
+    assert diagnostics.bulk_ess(x) < .1 * 4 * 2000
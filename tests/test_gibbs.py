@@ -0,0 +1,83 @@
+import threading
+
+import numpy as np
+import h5py
+
+from bpstools import diagnostics, gibbs, h5io
+
+
+def test_threaded_fit_stops_its_threads(counts, tmp_path):
+    before = threading.active_count()
+    path = str(tmp_path / 'samples.h5')
+    gibbs.fit_model_and_save_results(
+        counts, 3, path, J0=10., eps=1e-3, alpha=.5, a=.5, a0=6., b0=.005,
+        iters=20, warmup=10, threads=2)
+    assert threading.active_count() == before
+    with h5py.File(path, 'r') as f:
+        assert f[h5io.LOADINGS].shape == (3, 8, 10)
+        assert f.attrs['threads'] == 2
+
+
+class Recorder(object):
+    """A generator that records the arguments and results of its draws."""
+    def __init__(self, seed):
+        self.rng = np.random.default_rng(seed)
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.rng, name)
+
+        def record(*args):
+            out = method(*args)
+            self.calls.append((name, args, out))
+            return out
+        return record
+
+
+def test_conditionals_are_tempered(counts):
+    zeta = .3
+    sampler = gibbs.PowerNMFGibbs(counts, 3, a=.5, alpha=.5, a0=6., b0=.005,
+                                  zeta=zeta)
+    state = sampler.initialize(np.random.default_rng(1))
+    mu = state[h5io.EXPECTED_LOADINGS].copy()
+    rng = Recorder(2)
+    sampler.sweep(state, rng)
+    (_, _, z), (_, loading_args, loadings), (_, mutsig_args, _), \
+        (_, mu_args, _) = rng.calls
+    z_sample = np.zeros((3, 8))
+    z_channel = np.zeros((3, 12))
+    rows, cols = np.nonzero(counts)
+    np.add.at(z_sample.T, cols, z)
+    np.add.at(z_channel.T, rows, z)
+    # loadings_kj | z ~ Gamma(a + zeta z_.jk, rate a / mu_k + zeta)
+    assert np.allclose(loading_args[0], .5 + zeta * z_sample)
+    assert np.allclose(loading_args[1], 1. / (.5 / mu[:,np.newaxis] + zeta))
+    # mutsigs_k | z ~ Dirichlet(alpha + zeta z_i.k)
+    assert np.allclose(mutsig_args[0], .5 + zeta * z_channel)
+    # mu_k | loadings ~ InvGamma(a0 + J a, b0 + a sum_j loadings_kj), untempered
+    assert np.isclose(mu_args[0], 6. + 8 * .5)
+    assert np.allclose(mu_args[1], 1. / (.005 + .5 * loadings.sum(axis=1)))
+
+
+def test_joint_distribution_at_zeta_one():
+    """Geweke's successive-conditional check: alternating counts drawn from
+    the likelihood with sweeps keeps the parameters at their prior."""
+    I, J, K, a, a0, b0 = 4, 3, 2, 2., 6., 50.
+    rng = np.random.default_rng(0)
+    sampler = gibbs.PowerNMFGibbs(np.ones((I, J)), K, a=a, alpha=1., a0=a0,
+                                  b0=b0)
+    state = sampler.sample_prior(rng)
+    trace = []
+    for _ in range(6000):
+        counts = rng.poisson(state[h5io.MUTSIGS].T.dot(state[h5io.LOADINGS]))
+        state = gibbs.PowerNMFGibbs(counts, K, a=a, alpha=1., a0=a0,
+                                    b0=b0).sweep(state, rng)
+        mu = state[h5io.EXPECTED_LOADINGS]
+        trace.append([mu[0], mu[0] ** 2, state[h5io.LOADINGS][0, 0],
+                      state[h5io.MUTSIGS][0, 0]])
+    trace = np.array(trace).T
+    # InvGamma(6, 50) has mean 10 and variance 25
+    expected = [b0 / (a0 - 1), 125., b0 / (a0 - 1), 1. / I]
+    ess = diagnostics.effective_sample_size(trace)
+    z = (trace.mean(axis=1) - expected) / (trace.std(axis=1) / np.sqrt(ess))
+    assert np.all(np.abs(z) < 4), z
@@ -0,0 +1,19 @@
+import numpy as np
+import scipy.sparse
+
+from bpstools import likelihood
+
+
+def test_sparse_log_likelihood_matches_the_dense_reference(counts):
+    rng = np.random.default_rng(1)
+    loadings = rng.gamma(1., 50., size=(3, 8, 7))
+    mutsigs = rng.dirichlet(np.ones(12), size=(3, 7)).transpose(0, 2, 1)
+    expected = likelihood.dense_log_likelihood(counts, loadings, mutsigs)
+    assert np.allclose(likelihood.log_likelihood(counts, loadings, mutsigs,
+                                                 batch_size=3), expected)
+    per_sample = likelihood.log_likelihood(scipy.sparse.csr_matrix(counts),
+                                           loadings, mutsigs, per_sample=True)
+    assert per_sample.shape == (8, 7)
+    assert np.allclose(per_sample.sum(axis=0), expected)
+    assert np.isclose(likelihood.log_likelihood(counts, loadings[..., 0],
+                                                mutsigs[..., 0]), expected[0])
@@ -0,0 +1,119 @@
+import os
+import subprocess
+
+import pytest
+
+from bpstools import pipeline
+
+
+@pytest.fixture
+def experiment(tmp_path):
+    """Tasks ``a``, reading a counts table, and ``b``, reading ``a``'s
+    output."""
+    counts = tmp_path / 'counts.tsv'
+    counts.write_text('Substitution\ts1\nA[C>A]A\t3\n')
+    for name in ('a', 'b'):
+        (tmp_path / (name + '.sh')).write_text(
+            '#SBATCH --mem=8G\nmodule load python\npython {}.py --K 5\n'.format(
+                name))
+    tasks = [pipeline.Task('a', str(tmp_path / 'a.sh'), inputs=[str(counts)],
+                           outputs=[str(tmp_path / 'a.out')]),
+             pipeline.Task('b', str(tmp_path / 'b.sh'), deps=['a'],
+                           outputs=[str(tmp_path / 'b.out')])]
+    return tmp_path, tasks
+
+
+def finish(tmp_path, tasks, state):
+    _, keys = pipeline.plan(tasks, state)
+    for task in tasks:
+        for path in task.outputs:
+            open(path, 'w').close()
+    state.keys.update(keys)
+
+
+def reasons(tasks, state):
+    stale, _ = pipeline.plan(tasks, state)
+    return {task.name: reason for task, reason in stale}
+
+
+def test_plan_reruns_what_a_change_affects(experiment):
+    tmp_path, tasks = experiment
+    state = pipeline.State(str(tmp_path / 'state.json'))
+    assert reasons(tasks, state) == dict(a='new', b='new')
+    finish(tmp_path, tasks, state)
+    assert reasons(tasks, state) == {}
+
+    # scheduler directives and environment setup are not hashed
+    (tmp_path / 'a.sh').write_text(
+        '#SBATCH --mem=64G\nmodule load python/3\npython a.py --K 5\n')
+    assert reasons(tasks, state) == {}
+
+    (tmp_path / 'b.sh').write_text('python b.py --K 6\n')
+    assert reasons(tasks, state) == dict(b='changed')
+    finish(tmp_path, tasks, state)
+
+    # an input change reaches the downstream task through the keys
+    (tmp_path / 'counts.tsv').write_text('Substitution\ts1\nA[C>A]A\t4\n')
+    assert reasons(tasks, state) == dict(a='changed', b='changed')
+    finish(tmp_path, tasks, state)
+
+    os.remove(str(tmp_path / 'b.out'))
+    assert reasons(tasks, state) == {'b': 'outputs missing'}
+
+
+class FakeSlurm(object):
+    def __init__(self):
+        self.queue = set()
+        self.submitted = []
+        self.cancelled = []
+        self.fail = ()
+
+    def __call__(self, cmd, **kwargs):
+        if cmd[0] == 'squeue':
+            return subprocess.CompletedProcess(cmd, 0, '\n'.join(self.queue),
+                                               '')
+        if cmd[0] == 'scancel':
+            self.cancelled.append(cmd[1])
+            self.queue.discard(cmd[1])
+            return subprocess.CompletedProcess(cmd, 0, '', '')
+        name = cmd[cmd.index('--job-name') + 1]
+        if name in self.fail:
+            raise subprocess.CalledProcessError(1, cmd)
+        job = str(100 + len(self.submitted))
+        self.submitted.append((name, cmd))
+        self.queue.add(job)
+        return subprocess.CompletedProcess(cmd, 0, job + '\n', '')
+
+
+def test_slurm_run_leaves_queued_jobs_alone(experiment, monkeypatch):
+    tmp_path, tasks = experiment
+    slurm = FakeSlurm()
+    monkeypatch.setattr(pipeline.subprocess, 'run', slurm)
+    state_path = str(tmp_path / 'state.json')
+
+    # a failed submission keeps the ones before it
+    slurm.fail = ('b',)
+    with pytest.raises(subprocess.CalledProcessError):
+        pipeline.run(tasks, state_path, backend='slurm')
+    assert pipeline.State(state_path).jobs == dict(a='100')
+
+    slurm.fail = ()
+    pipeline.run(tasks, state_path, backend='slurm')
+    assert [name for name, _ in slurm.submitted] == ['a', 'b']
+    assert '--dependency=afterok:100' in slurm.submitted[1][1]
+
+    # both still queued: nothing is submitted again
+    pipeline.run(tasks, state_path, backend='slurm')
+    assert len(slurm.submitted) == 2
+
+    # b's job failed; it is resubmitted after a, which is still running
+    slurm.queue.discard('101')
+    pipeline.run(tasks, state_path, backend='slurm')
+    assert [name for name, _ in slurm.submitted] == ['a', 'b', 'b']
+    assert '--dependency=afterok:100' in slurm.submitted[2][1]
+
+    # a changed: its queued job is cancelled before resubmitting
+    (tmp_path / 'a.sh').write_text('python a.py --K 6\n')
+    pipeline.run(tasks, state_path, backend='slurm')
+    assert slurm.cancelled == ['100', '102']
+    assert [name for name, _ in slurm.submitted[3:]] == ['a', 'b']
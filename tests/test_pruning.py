@@ -0,0 +1,46 @@
+import copy
+
+import numpy as np
+import pytest
+
+from bpstools import gibbs, pruning
+
+
+class Interrupt(Exception):
+    pass
+
+
+def test_resumed_run_prunes_like_an_uninterrupted_one(counts):
+    sampler = gibbs.PowerNMFGibbs(counts, 8, a=.5, alpha=.5, a0=6., b0=.005)
+
+    def run(**kwargs):
+        pruner = kwargs.pop('pruner', pruning.ARDPruner(8, 20., window=5))
+        draws, _ = sampler.run(60, 40, seed=3, pruner=pruner, verbose=False,
+                               **kwargs)
+        return pruner, draws
+
+    full, expected = run()
+    assert np.any(full.pruned_at > 0)
+
+    saved = {}
+
+    def checkpoint(it, state, draws, rng):
+        if it == 8:
+            saved.update(it=it, state=copy.deepcopy(state), rng=copy.deepcopy(rng))
+            raise Interrupt
+
+    with pytest.raises(Interrupt):
+        run(checkpoint=checkpoint, checkpoint_every=4)
+    # some components are partway through their window at the checkpoint
+    assert np.any((saved['state'][pruning.BELOW] > 0) & saved['state'][pruning.ACTIVE])
+
+    state = dict(saved['state'])
+    counters = {key: state.pop(key) for key in pruning.STATE_KEYS}
+    pruner = pruning.ARDPruner(8, 20., window=5)
+    state = pruner.restore(state, **counters)
+    pruner, draws = run(pruner=pruner, state=state, rng=saved['rng'],
+                        first=saved['it'])
+    assert np.array_equal(pruner.pruned_at, full.pruned_at)
+    assert np.array_equal(pruner.active, full.active)
+    assert all(np.allclose(a['loadings'], b['loadings'])
+               for a, b in zip(draws, expected))
@@ -0,0 +1,51 @@
+import numpy as np
+
+from bpstools import resources
+
+
+def profile(iterations=None, **kwargs):
+    record = dict(engine='gibbs', I=96, J=50, K=10, samples=1000, burnin=1000,
+                  wall_sampling=100., peak_rss_mb=1024.)
+    record.update(kwargs)
+    if iterations is not None:
+        record['iterations'] = iterations
+    return record
+
+
+def test_rate_is_fitted_to_the_iterations_run():
+    full = resources.CostModel('gibbs', [profile() for _ in range(3)])
+    # the same seconds for half the iterations: twice the rate
+    stopped = resources.CostModel('gibbs', [profile(iterations=1000)
+                                            for _ in range(3)])
+    assert np.isclose(full.rate, 100. / (96 * 50 * 10 * 2000))
+    assert np.isclose(stopped.rate, 2 * full.rate)
+
+
+def test_fallback_is_never_below_the_fixed_requests():
+    floor = (32, 7 * 24 * 3600)
+    memory, seconds = resources.estimate_nmf('gibbs', 96, 20, 5, 100, 100,
+                                             floor=floor)
+    assert (memory, seconds) == floor
+    memory, seconds = resources.estimate_nmf('nuts', 96, 500, 30, 1000, 1000,
+                                             max_seconds=floor[1],
+                                             floor=floor)
+    assert memory >= floor[0] and seconds == floor[1]
+
+
+def test_pack_is_first_fit_decreasing():
+    hour = 3600.
+    # 1 GB runs in 3 GB allocations: two at a time
+    items = [('e', 1 * hour, 1.), ('c', 3 * hour, 1.), ('a', 4 * hour, 1.),
+             ('d', 3 * hour, 1.), ('b', 4 * hour, 1.)]
+    packed = resources.pack(items, cores=4, max_seconds=10 * hour, max_gb=3)
+    # c does not fit next to a and b, d then joins c, and e goes back to the
+    # first allocation
+    assert packed == [(['a', 'b', 'e'], 2, 3, int(1.5 * 6.5 * hour)),
+                      (['c', 'd'], 2, 3, int(1.5 * 4.5 * hour))]
+
+
+def test_pack_gives_oversized_runs_their_own_allocation():
+    hour = 3600.
+    packed = resources.pack([('long', 20 * hour, 1.), ('short', hour, 1.)],
+                            cores=4, max_seconds=10 * hour, max_gb=64)
+    assert [keys for keys, _, _, _ in packed] == [['long'], ['short']]
@@ -0,0 +1,23 @@
+import importlib
+
+search_zetas = importlib.import_module('search-zetas')
+
+
+def test_refine_brackets_K_changes():
+    assert search_zetas.refine([.2, .6], [4, 3], [-10., -9.], .05) == [.4]
+    assert search_zetas.refine([.2, .6], [4, 4], [-10., -9.], .05) == []
+
+
+def test_refine_brackets_the_sharpest_bend():
+    zetas = [.1, .2, .3, .4, .5]
+    # flat after .3, where K also drops
+    log_liks = [0., 1., 2., 2., 2.]
+    assert search_zetas.refine(zetas, [5, 5, 5, 4, 4], log_liks, .05) \
+        == [.25, .35]
+
+
+def test_refine_stops_at_the_tolerance():
+    assert search_zetas.refine([.3, .31, .32], [5, 4, 3], [0., 1., 3.],
+                               .05) == []
+    assert search_zetas.refine([.3, .4, .5], [5, 4, 4], [0., 1., 3.],
+                               .05) == [.35, .45]
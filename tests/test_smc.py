@@ -0,0 +1,37 @@
+import numpy as np
+from scipy.special import logsumexp
+
+from bpstools import smc
+
+
+def test_next_zeta_keeps_the_ess_above_the_minimum():
+    lls = np.random.default_rng(0).normal(-1000., 30., size=200)
+    zeta = smc._next_zeta(.2, 1., lls, 100)
+    assert .2 < zeta < 1.
+    assert smc._ess((zeta - .2) * lls) >= 100 - 1e-6
+    # with equal likelihoods the target is reached in one step
+    assert smc._next_zeta(.2, 1., np.full(50, -10.), 25) == 1.
+
+
+def test_systematic_resample_follows_the_weights():
+    rng = np.random.default_rng(0)
+    log_weights = np.log([1e-12, 1., 1e-12, 1e-12])
+    assert np.all(smc._systematic_resample(log_weights, rng) == 1)
+    keep = smc._systematic_resample(np.log([1., 3.]), rng)
+    assert sorted(keep) in ([0, 1], [1, 1])
+
+
+def test_log_Z_is_the_log_mean_incremental_weight(counts):
+    # with no ESS floor the first power is reached in one step from the
+    # prior, so log Z is exactly log mean exp(zeta * loglik) over the
+    # initial particles
+    zetas, populations, log_Zs, steps = smc.run_smc(
+        counts, 3, [.5, 1.], a=.5, alpha=.5, a0=6., b0=.005, particles=20,
+        moves=1, ess_fraction=0., seed=1, processes=1, verbose=False)
+    assert zetas == [.5, 1.]
+    assert [len(p) for p in populations] == [20, 20]
+    assert steps == 2
+    model = smc.gibbs.PowerNMFGibbs(counts, 3, a=.5, alpha=.5, a0=6., b0=.005)
+    rng = np.random.default_rng(np.random.SeedSequence(1).spawn(1)[0])
+    lls = np.array([model.log_likelihood(model.sample_prior(rng)) for _ in range(20)])
+    assert np.isclose(log_Zs[0], logsumexp(.5 * lls) - np.log(20))
@@ -0,0 +1,50 @@
+import numpy as np
+
+from bpstools import summary
+
+
+def relative_errors(estimate, exact):
+    """Errors as fractions of the 5%-95% spread of each element."""
+    return np.abs(estimate - exact) / (exact[-1] - exact[0])
+
+
+def test_p2_quantiles_track_np_quantile():
+    rng = np.random.default_rng(0)
+    # normal, skewed and heavy-tailed streams, 300 elements each
+    x = np.concatenate([rng.normal(size=(2000, 300)),
+                        rng.gamma(.5, size=(2000, 300)),
+                        rng.standard_t(3, size=(2000, 300))], axis=1)
+    sketch = summary.P2Quantiles(summary.QUANTILES)
+    for row in x:
+        sketch.update(row)
+    errors = relative_errors(sketch.value(),
+                             np.quantile(x, summary.QUANTILES, axis=0))
+    assert np.all(np.median(errors, axis=1) < .02)
+    # the outer quantiles occasionally miss by more
+    assert np.all(np.quantile(errors, .99, axis=1) < .1)
+
+
+def test_p2_quantiles_are_exact_for_few_draws():
+    x = np.arange(4.)[:, np.newaxis]
+    sketch = summary.P2Quantiles([.25, .5])
+    for row in x:
+        sketch.update(row)
+    assert np.allclose(sketch.value(), np.quantile(x, [.25, .5], axis=0))
+
+
+def test_running_summary_matches_exact_stats():
+    rng = np.random.default_rng(1)
+    draws = dict(a=rng.gamma(2., size=(3, 4, 2000)),
+                 b=rng.normal(size=(1, 5, 2000)))
+    running = summary.RunningSummary()
+    for s in range(2000):
+        running.update({name: x[..., s] for name, x in draws.items()})
+    stats = running.stats()
+    exact = summary.exact_stats(draws)
+    for name in draws:
+        assert np.allclose(stats[name]['mean'], exact[name]['mean'])
+        assert np.allclose(stats[name]['var'], exact[name]['var'])
+        assert stats[name]['quantiles'].shape == exact[name]['quantiles'].shape
+        errors = relative_errors(stats[name]['quantiles'],
+                                 exact[name]['quantiles'])
+        assert np.median(errors) < .02
@@ -0,0 +1,31 @@
+import numpy as np
+
+from bpstools import tempering
+
+
+def test_swap_log_ratio_is_the_power_posterior_exchange_ratio():
+    # replicas targeting exp(zeta * ll): pi_i(x_j) pi_j(x_i) / (pi_i(x_i) pi_j(x_j))
+    zeta_i, zeta_j, ll_i, ll_j = .3, .8, -120., -100.
+    expected = (zeta_i * ll_j + zeta_j * ll_i) - (zeta_i * ll_i + zeta_j * ll_j)
+    assert np.isclose(tempering.swap_log_ratio(zeta_i, zeta_j, ll_i, ll_j), expected)
+    # a better state at the lower power always moves up the ladder
+    assert tempering.swap_log_ratio(zeta_i, zeta_j, ll_j, ll_i) > 0
+
+
+def test_equal_powers_always_swap(counts):
+    _, draws, rates = tempering.run_parallel_tempering(
+        counts, 3, [1., 1.], a=.5, alpha=.5, a0=6., b0=.005, iters=20,
+        warmup=10, swap_every=5, processes=1, verbose=False)
+    assert np.all(rates == 1)
+    assert [len(d) for d in draws] == [10, 10]
+
+
+def test_init_starts_every_replica(counts):
+    init = tempering.gibbs.PowerNMFGibbs(counts, 3, a=.5, alpha=.5, a0=6., b0=.005).initialize(
+        np.random.default_rng(1))
+    _, draws, _ = tempering.run_parallel_tempering(
+        counts, 3, [.5, 1.], a=.5, alpha=.5, a0=6., b0=.005, iters=1,
+        warmup=0, processes=1, verbose=False, init=init)
+    # one sweep from the same state keeps the signature count and shapes
+    for d in draws:
+        assert d[0]['loadings'].shape == init['loadings'].shape
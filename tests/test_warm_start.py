@@ -0,0 +1,38 @@
+import numpy as np
+
+from bpstools import h5io, profiling
+
+
+class Fit(object):
+    """The parts of a pystan fit that ``Profile.record_nuts`` reads."""
+    sim = dict(warmup=2)
+
+    def get_sampler_params(self, inc_warmup=True):
+        return [dict(n_leapfrog__=np.array([7., 7., 3., 3.]),
+                     treedepth__=np.array([3., 3., 2., 2.]),
+                     divergent__=np.zeros(4))]
+
+    def get_stepsize(self):
+        return [.125]
+
+    def get_inv_metric(self):
+        return [np.linspace(.5, 2., 10)]
+
+
+def test_warm_start_reads_back_the_adaptation(tmp_path):
+    rng = np.random.default_rng(0)
+    draws = {h5io.LOADINGS: rng.gamma(1., 1., (2, 3, 4)),
+             h5io.MUTSIGS: rng.dirichlet(np.ones(5), (2, 4)).transpose(0, 2, 1),
+             h5io.EXPECTED_LOADINGS: rng.gamma(1., 1., (1, 2, 4))}
+    path = str(tmp_path / 'samples.h5')
+    h5io.save_samples(path, draws, {}, 1.)
+    profile = profiling.Profile()
+    profile.record_nuts(Fit())
+    h5io.save_adaptation(path, **profile.adaptation)
+
+    state, adaptation = h5io.load_last_draw(path)
+    assert np.array_equal(state[h5io.LOADINGS], draws[h5io.LOADINGS][..., -1])
+    assert np.array_equal(state[h5io.EXPECTED_LOADINGS],
+                          draws[h5io.EXPECTED_LOADINGS][0, :, -1])
+    assert adaptation['stepsize'] == .125
+    assert np.array_equal(adaptation['inv_metric'], np.linspace(.5, 2., 10))
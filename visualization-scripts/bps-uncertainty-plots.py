@@ -1,5 +1,5 @@
 import os
-import subprocess
+import sys
 
 import numpy as np
 import pandas as pd
@@ -16,6 +16,9 @@ import seaborn as sns
 
 from mutsigtools import analysis, mutsig
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from bpstools import catalog
+
 
 MAX_CUTOFF = 1 ## cosine error
 CUTOFF = 1 ## filtering inferred sigs
@@ -36,6 +39,7 @@ def compile_bps_uncertainty_and_errors():
     uncertainty = []
 
     skip = 25
+    cat = catalog.Catalog()
 
     for exp in exp_list:
         if "WGS" in exp:
@@ -43,18 +47,19 @@ def compile_bps_uncertainty_and_errors():
             
         print("\n" + exp)
         prefix = exp.replace("\n", "")
+        cat.scan([os.path.join(bps_dir, prefix)])
 
-        os.chdir(os.path.join(base_dir, prefix))
+        ## Open h5 file
+        with open(os.path.join(base_dir, "scripts", "h5_list.csv")) as f:
+            h5_file_name = [line for line in f if prefix in line][0].rstrip("\n").split(",")[1]
+        h5_file_name = os.path.join(bps_dir, prefix, "results", h5_file_name)
+        result = cat.results(path = h5_file_name)[0]
 
-        ## Read best-seed-comparison-zeta-[]-list.csv 
-        matches_list = subprocess.run(['ls | grep best-seed-comparison-zeta-0.[0123456789]*-list.csv'],
-            shell = True, capture_output = True, text = True).stdout.split("\n")[0]
+        ## Read best-seed-comparison-zeta-[]-list.csv of the same run
+        matches_list = [f["path"] for f in cat.figures(experiment = prefix, zeta = result["zeta"], name = "best-seed-comparison-zeta-*-list.csv")
+                        if result["name"].startswith(os.path.basename(f["directory"]).split("-a-")[0])][0]
         matches = pd.read_csv(matches_list)
 
-        ## Open h5 file
-        h5_file_name = subprocess.run(['cat ../scripts/h5_list.csv | grep {}'.format(prefix)],
-            shell = True, capture_output = True, text = True).stdout.split("\n")[0].split(",")[1]
-        h5_file_name = os.path.join(bps_dir, prefix, "results", h5_file_name)
         msi = analysis.load_samples_h5_file(h5_file_name, verbose = False,
                 name_prefix = "Signature", cutoff = CUTOFF, sample_start = 0)[0]
         samples = msi.mutsigs_samples
@@ -67,6 +72,7 @@ def compile_bps_uncertainty_and_errors():
         flatness.extend([ comp_sig_flatness[np.where(comp_sig_names == sig)[0][0]] for sig in matches["COSMIC"]])
 
     exp_list.close()
+    cat.close()
 
     dct = {"Uncertainty": uncertainty, "Recovery Error": recovery_error, "Quantile": quantile, "Flatness": flatness}
     df = pd.DataFrame(dct)
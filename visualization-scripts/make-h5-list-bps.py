@@ -1,4 +1,5 @@
 import os
+import sys
 import subprocess
 
 import numpy as np
@@ -6,6 +7,9 @@ import pandas as pd
 
 from mutsigtools import mutsig
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from bpstools import catalog
+
 
 def main():
 
@@ -14,15 +18,16 @@ def main():
     exp_dir_template = "/n/miller_lab/csxue/bayes-power-sig/{experiment_name}/"
     figs_dir_template = "figures/"
     summary_file_template = "summary.npz"
-    solution_dir_template = "results/"
     
     h5_list = open("/n/miller_lab/csxue/mutsig-nmf/figures-all/comparisons/scripts/h5_list.csv", mode = "w")
+    cat = catalog.Catalog()
 
     for exp in exp_list:
         print("\n" + exp)
         exp_name = exp.replace("\n", "")
         exp_dir = exp_dir_template.format(experiment_name = exp_name)
         figs_dir = os.path.join(exp_dir, figs_dir_template)
+        cat.scan([exp_dir])
 
         ## Find specific experiment directory
         subfolders = [ f.path for f in os.scandir(figs_dir) if f.is_dir() ]
@@ -43,7 +48,7 @@ def main():
 
         summary_file = os.path.join(final_figs_dir, summary_file_template)
         # print(summary_file)
-        if not os.path.isfile(summary_file):
+        if len(cat.figures(path = summary_file)) == 0:
             print("Summary file for " + summary_file + " could not be found.")
             continue 
         # print(summary_file)
@@ -61,10 +66,8 @@ def main():
             seed = summary["best_seeds"][int(i)]
 
         ## Copy other relevant files
-        sig_comp_plot = subprocess.run(['ls {dir} | grep best-seed-comparison-zeta-[0123456789.]*.pdf'.format(dir = final_figs_dir)],
-            shell = True, capture_output = True, text = True).stdout.split("\n")[:-1]
-        sig_comp_list = subprocess.run(['ls {dir} | grep best-seed-comparison-zeta-[0123456789.]*-list.csv'.format(dir = final_figs_dir)],
-            shell = True, capture_output = True, text = True).stdout.split("\n")[:-1]
+        sig_comp_plot = [f["name"] for f in cat.figures(directory = final_figs_dir, name = "best-seed-comparison-zeta-*.pdf")]
+        sig_comp_list = [f["name"] for f in cat.figures(directory = final_figs_dir, name = "best-seed-comparison-zeta-*-list.csv")]
         if len(sig_comp_list) == 1:
             sig_comp_plot = sig_comp_plot[0]
             sig_comp_list = sig_comp_list[0]
@@ -86,9 +89,7 @@ def main():
 
         ## Convert to results file name
         results_file_root = final_figs_dir.split("/")[-1].split("-a-")[0] + "-seed-" + str(seed) + "-"
-        grep_out = subprocess.run(['ls {dir} | grep "{root}" '.format(dir = os.path.join(exp_dir, solution_dir_template),
-            root = results_file_root)],
-            shell = True, capture_output = True, text = True).stdout.split("\n")[:-1]
+        grep_out = sorted(set(r["name"] for r in cat.results(experiment = exp_name, name = "*" + results_file_root + "*")))
         if len(grep_out) == 1:
             h5_file = grep_out[0]
         elif len(grep_out) == 0: 
@@ -110,6 +111,7 @@ def main():
 
     exp_list.close()
     h5_list.close()
+    cat.close()
 
 
 
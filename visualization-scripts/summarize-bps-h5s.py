@@ -1,11 +1,23 @@
 import os
+import sys
 import numpy as np
-from mutsigtools import analysis
 
-CUTOFF = 1
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from bpstools import h5io, summary
 
 
 
+def posterior_means(h5_file_path):
+    """Mean loadings and signatures, strongest signature first, from the
+    summary group of a samples file (or from its draws if it has none)."""
+    stats = h5io.load_summary(h5_file_path)
+    if stats is None:
+        draws = h5io.load_draws(h5_file_path)[0]
+        stats = summary.exact_stats(draws)
+    order = np.argsort(-stats[h5io.EXPECTED_LOADINGS]["mean"][0])
+    return stats[h5io.LOADINGS]["mean"][order], stats[h5io.MUTSIGS]["mean"][order]
+
+
 def main():
 
     bps_dir = "/n/miller_lab/csxue/bayes-power-sig"
@@ -22,11 +34,10 @@ def main():
         h5_file_path = os.path.join(bps_dir, exp_name, "results", h5_file_name)
         output_file = os.path.join(comparisons_dir, exp_name, output_file_template.format(exp = exp_name))
 
-        ## open h5 file
-        msi = analysis.load_samples_h5_file(h5_file_path, verbose = False,
-                name_prefix = "Signature", cutoff = CUTOFF, sample_start = 0)[0]
-        loadings = np.transpose(msi.mean_loadings)
-        sigs = np.transpose(msi.mean_mutsigs)
+        ## read the posterior means, not the draws
+        mean_loadings, mean_mutsigs = posterior_means(h5_file_path)
+        loadings = np.transpose(mean_loadings)
+        sigs = np.transpose(mean_mutsigs)
 
         ## save output
         np.savez(output_file, loadings = loadings, sigs = sigs)